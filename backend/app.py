@@ -1,89 +1,148 @@
-import os
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
-from datetime import datetime
+from flask_jwt_extended import JWTManager, jwt_required, get_jwt
+from datetime import datetime, timedelta
 import sqlite3
 
+from config import Config
+from pool import get_pool
+from pagination import fetch_page, InvalidCursor
+from streaming import wants_stream, stream_rows
+from serialize import rows_response, rows_template, cursor_template
+from migrations import migrate
+from stats import read_stats
+from search import search, SEARCH_TABLES
+from etag import conditional, request_user_id
+from passwords import passwords, PasswordPoolBusy
+from revocation import revocations
+from writequeue import get_write_queue, WriteQueueBusy
+from sharding import ShardMap, DIRECTORY
+import metrics
+import compressor
+from results import classify_result
+from ingest import ingest_batch, ingest_csv, BatchTooLarge
+from export import export_stream, EXPORT_FORMATS, EXPORT_TABLES, SECRET_COLUMNS
+from series import load_series, parse_date
+from schedule import (parse_window, window_events, booking_intervals, find_conflicts,
+                      free_slots, parse_day_time, AppointmentConflict)
+from recurrence import (RuleError, SeriesNotFound, recurrence_values, get_series,
+                        edit_occurrence, delete_occurrence)
+
 app = Flask(__name__)
+app.config.from_object(Config)
 CORS(app, origins=['http://localhost:3000'])
+jwt = JWTManager(app)
+metrics.init_app(app)
+compressor.init_app(app)
 
-# Создаем папку data если ее нет
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
-DB_PATH = os.path.join(DATA_DIR, 'medical.db')
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_payload):
+    """Проверка отзыва токена: почти всегда без обращения к БД"""
+    return revocations.is_revoked(jwt_payload['jti'])
 
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
+# Импорт модуля к БД не обращается: схема проверяется (и при необходимости
+# мигрирует) при первом соединении из пула
+DB_PATH = Config.DATABASE
+pool = get_pool(DB_PATH, setup=migrate)
 
 def get_db():
-    """Получение соединения с БД"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Получение соединения с БД (одно на запрос, из пула)"""
+    if 'db' not in g:
+        g.db_ctx = pool.connection()
+        g.db = g.db_ctx.__enter__()
+    return g.db
 
-def init_db():
-    """Инициализация базы данных"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Пользователи
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            name TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Анализы
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS analyses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            type TEXT NOT NULL,
-            date DATE NOT NULL,
-            result TEXT NOT NULL,
-            unit TEXT,
-            norm_min REAL,
-            norm_max REAL,
-            doctor TEXT,
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Приемы врачей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS appointments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            start_time DATETIME NOT NULL,
-            end_time DATETIME NOT NULL,
-            doctor TEXT,
-            specialty TEXT,
-            location TEXT,
-            status TEXT DEFAULT 'scheduled',
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Создаем тестового пользователя
-    cursor.execute("SELECT COUNT(*) FROM users WHERE email = 'demo@example.com'")
-    if cursor.fetchone()[0] == 0:
-        cursor.execute(
-            "INSERT INTO users (email, password, name) VALUES (?, ?, ?)",
-            ('demo@example.com', 'demo123', 'Демо Пользователь')
+@app.teardown_appcontext
+def release_db(exception=None):
+    """Возврат соединений в пулы по окончании запроса"""
+    for db_ctx, _ in g.pop('shard_dbs', {}).values():
+        db_ctx.__exit__(None, None, None)
+    db_ctx = g.pop('db_ctx', None)
+    g.pop('db', None)
+    if db_ctx is not None:
+        db_ctx.__exit__(None, None, None)
+
+# Анализы и приемы - в шарде пользователя (sharding.py); пользователи и
+# отзывы токенов - в справочной БД. DB_SHARDS = 0 - все в справочной БД
+shards = ShardMap(DB_PATH)
+
+class RowNotFound(LookupError):
+    """id из запроса указывает на несуществующий шард"""
+
+def shard_db(index):
+    """Соединение с шардом (одно на запрос); справочная БД - get_db()"""
+    if index == DIRECTORY:
+        return get_db()
+    shard_dbs = g.setdefault('shard_dbs', {})
+    if index not in shard_dbs:
+        db_ctx = shards.pool(index).connection()
+        shard_dbs[index] = (db_ctx, db_ctx.__enter__())
+    return shard_dbs[index][1]
+
+def user_shard(user_id):
+    """Шард с данными пользователя по users.shard (запоминается на время запроса)"""
+    user_shards = g.setdefault('user_shards', {})
+    if user_id not in user_shards:
+        row = get_db().execute('SELECT shard FROM users WHERE id = ?', (user_id,)).fetchone()
+        user_shards[user_id] = (row[0] if row else None) or DIRECTORY
+    return user_shards[user_id]
+
+def row_shard(row_id):
+    """Шард анализа или приема по диапазону его id"""
+    index = shards.index_for_id(row_id)
+    if not shards.exists(index):
+        raise RowNotFound()
+    return index
+
+def user_db(user_id):
+    """Соединение с БД, где лежат анализы и приемы пользователя"""
+    return shard_db(user_shard(user_id))
+
+def user_pool(user_id):
+    """Пул этой БД - для потоковых ответов, которые читают после выхода из маршрута"""
+    return shards.pool(user_shard(user_id))
+
+# Записи фиксируются сразу или пакетами потока-писателя (WRITE_QUEUE_ENABLED);
+# у каждого шарда своя очередь
+writes = get_write_queue(DB_PATH)
+
+def write(job, shard=DIRECTORY):
+    """Выполнение записи job(conn) в шарде shard с фиксацией; результат job"""
+    queue = shards.writes(shard)
+    if queue.enabled:
+        return queue.execute(job)
+    return queue.execute(job, shard_db(shard))
+
+def write_user(user_id, job):
+    """Запись в шард пользователя"""
+    return write(job, user_shard(user_id))
+
+def write_row(row_id, job):
+    """Запись в шард строки с этим id"""
+    return write(job, row_shard(row_id))
+
+# ETag списков по версии данных пользователя (304 без запроса списка)
+versioned = conditional(user_db)
+
+def wants_page():
+    """Клиент запросил постраничную выдачу (cursor/limit)"""
+    return 'cursor' in request.args or 'limit' in request.args
+
+def page_response(table, user_id):
+    """Ответ со страницей списка и курсором на следующую"""
+    try:
+        rows, next_cursor = fetch_page(
+            user_db(user_id), table, user_id,
+            request.args.get('limit'), request.args.get('cursor')
         )
+    except InvalidCursor as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     
-    conn.commit()
-    conn.close()
-
-# Инициализируем БД при запуске
-init_db()
+    return rows_response(table, rows, rows_template(rows, table),
+                         success=True, count=len(rows), next_cursor=next_cursor)
 
 # ========== ПРОСТЫЕ РОУТЫ ==========
 
@@ -95,26 +154,72 @@ def home():
         'database': DB_PATH
     })
 
+@app.route('/api/system/pool', methods=['GET'])
+def pool_stats():
+    """Статистика пулов: соединений (для подбора DB_POOL_SIZE) и хэширования паролей"""
+    return jsonify({
+        'pool': pool.stats(),
+        'passwords': passwords.stats(),
+        'revocations': revocations.stats(),
+        'writes': writes.stats(),
+        'compression': compressor.stats()
+    })
+
+@app.errorhandler(RowNotFound)
+def row_not_found(e):
+    """Записи с таким id нет ни в одном шарде"""
+    return jsonify({
+        'success': False,
+        'message': 'Запись не найдена'
+    }), 404
+
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    """Пул bcrypt переполнен: быстрый отказ вместо ожидания"""
+    response = jsonify({
+        'success': False,
+        'message': str(e)
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(WriteQueueBusy)
+def write_queue_busy(e):
+    """Очередь записи переполнена: быстрый отказ вместо ожидания"""
+    response = jsonify({
+        'success': False,
+        'message': str(e)
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def public_user(row):
+    """Пользователь для ответа API: без хэша пароля"""
+    return {key: value for key, value in dict(row).items() if key not in SECRET_COLUMNS}
+
 @app.route('/api/auth/login', methods=['POST'])
 def login():
-    data = request.get_json()
+    data = request.get_json() or {}
     email = data.get('email')
     password = data.get('password')
     
     conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute(
-        "SELECT * FROM users WHERE email = ? AND password = ?",
-        (email, password)
-    )
+    cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
     user = cursor.fetchone()
-    conn.close()
     
-    if user:
+    if user and password and passwords.check(password, user['password_hash']):
+        # Стоимость bcrypt изменилась - пароль известен, обновляем хэш
+        if passwords.needs_rehash(user['password_hash']):
+            password_hash = passwords.hash(password)
+            write(lambda conn: conn.execute(
+                'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                (password_hash, user['id'], user['password_hash'])
+            ))
         return jsonify({
             'success': True,
-            'user': dict(user),
+            'user': public_user(user),
             'message': 'Вход выполнен'
         })
     else:
@@ -123,32 +228,70 @@ def login():
             'message': 'Неверный email или пароль'
         }), 401
 
+@app.route('/api/auth/logout', methods=['POST'])
+@jwt_required(verify_type=False)
+def logout():
+    """Выход: отзыв предъявленного токена (access или refresh)"""
+    token = get_jwt()
+    revocations.revoke(token['jti'], token['exp'])
+    return jsonify({
+        'success': True,
+        'message': 'Выход выполнен'
+    })
+
 @app.route('/api/analyses', methods=['GET'])
+@versioned
 def get_analyses():
-    user_id = request.args.get('user_id', 1)  # Временно: тестовый пользователь
+    user_id = request_user_id()  # Временно: тестовый пользователь
     
-    conn = get_db()
+    if wants_page():
+        return page_response('analyses', user_id)
+    
+    if wants_stream():
+        return stream_rows(
+            user_pool(user_id),
+            "SELECT * FROM analyses WHERE user_id = ? ORDER BY date DESC",
+            (user_id,),
+            'analyses'
+        )
+    
+    conn = user_db(user_id)
     cursor = conn.cursor()
+    cursor.row_factory = None  # кортежи: в JSON по шаблону колонок (serialize.py)
     
     cursor.execute(
         "SELECT * FROM analyses WHERE user_id = ? ORDER BY date DESC",
         (user_id,)
     )
+    
+    return rows_response('analyses', cursor.fetchall(), cursor_template(cursor, 'analyses'))
+
+@app.route('/api/analyses/abnormal', methods=['GET'])
+def get_abnormal_analyses():
+    """Анализы с отклонениями от нормы"""
+    user_id = request_user_id()
+    
+    cursor = user_db(user_id).execute(
+        "SELECT * FROM analyses INDEXED BY idx_analyses_abnormal "
+        "WHERE user_id = ? AND is_abnormal = 1 ORDER BY date DESC",
+        (user_id,)
+    )
     analyses = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     
-    return jsonify({'analyses': analyses})
+    return jsonify({'analyses': analyses, 'count': len(analyses)})
 
 @app.route('/api/analyses', methods=['POST'])
 def create_analysis():
     data = request.get_json()
     
-    conn = get_db()
-    cursor = conn.cursor()
+    # Результат разбирается один раз при записи
+    result_value, is_abnormal = classify_result(
+        data['result'], data.get('norm_min'), data.get('norm_max'))
     
-    cursor.execute('''
-        INSERT INTO analyses (user_id, type, date, result, unit, norm_min, norm_max, doctor, notes)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    analysis_id = write_user(data.get('user_id', 1), lambda conn: conn.execute('''
+        INSERT INTO analyses (user_id, type, date, result, unit, norm_min, norm_max, doctor, notes,
+                              result_value, is_abnormal)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         data.get('user_id', 1),
         data['type'],
@@ -158,12 +301,10 @@ def create_analysis():
         data.get('norm_min'),
         data.get('norm_max'),
         data.get('doctor'),
-        data.get('notes')
-    ))
-    
-    conn.commit()
-    analysis_id = cursor.lastrowid
-    conn.close()
+        data.get('notes'),
+        result_value,
+        is_abnormal
+    )).lastrowid)
     
     return jsonify({
         'success': True,
@@ -171,6 +312,117 @@ def create_analysis():
         'message': 'Анализ сохранен'
     }), 201
 
+@app.route('/api/analyses/series', methods=['GET'])
+def get_analysis_series():
+    """Динамика одного анализа за период для графика (прореживание LTTB)"""
+    user_id = request_user_id()
+    analysis_type = request.args.get('type')
+    if not analysis_type:
+        return jsonify({
+            'success': False,
+            'message': 'Отсутствует обязательный параметр: type'
+        }), 400
+    
+    try:
+        date_from = parse_date(request.args.get('from'))
+        date_to = parse_date(request.args.get('to'))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Даты from/to в формате ГГГГ-ММ-ДД'
+        }), 400
+    
+    series = load_series(
+        user_db(user_id), user_id, analysis_type, date_from, date_to,
+        request.args.get('points')
+    )
+    return jsonify({'success': True, **series})
+
+@app.route('/api/analyses/batch', methods=['POST'])
+def create_analyses_batch():
+    """Пакетная загрузка анализов: JSON-панель или CSV-выгрузка лаборатории"""
+    # CSV читается из потока запроса кусками, без загрузки в память целиком
+    if request.mimetype in ('text/csv', 'multipart/form-data'):
+        user_id = request_user_id()
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('file')
+            if upload is None:
+                return jsonify({
+                    'success': False,
+                    'message': 'Отсутствует файл: file'
+                }), 400
+            stream = upload.stream
+        else:
+            stream = request.stream
+        
+        try:
+            summary = ingest_csv(lambda job: write_user(user_id, job), user_id, stream)
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({
+                'success': False,
+                'message': f'Ошибка чтения CSV: {str(e)}'
+            }), 400
+        
+        return jsonify({
+            'success': summary['failed'] == 0,
+            **summary,
+            'message': f'Загружено анализов: {summary["inserted"]}'
+        }), 201 if summary['inserted'] else 400
+    
+    data = request.get_json()
+    if isinstance(data, list):
+        data = {'analyses': data}
+    items = (data or {}).get('analyses')
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'success': False,
+            'message': 'Отсутствует обязательное поле: analyses'
+        }), 400
+    
+    user_id = data.get('user_id', 1)
+    try:
+        results = ingest_batch(
+            lambda job: write_user(user_id, job), user_id, items,
+            strict=request.args.get('strict') in ('1', 'true')
+        )
+    except BatchTooLarge as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 413
+    
+    created = sum(1 for item in results if item['success'])
+    return jsonify({
+        'success': created == len(results),
+        'results': results,
+        'created': created,
+        'message': f'Сохранено анализов: {created} из {len(results)}'
+    }), 201 if created else 400
+
+def booking_intervals_for(data, rrule, exdates=None):
+    """Занятые приемом интервалы; None - пересечения разрешены (allow_overlap)"""
+    if data.get('allow_overlap'):
+        return None
+    return booking_intervals(data['start_time'], data['end_time'], rrule, exdates)
+
+def check_conflicts(conn, user_id, intervals, exclude_id=None):
+    """AppointmentConflict, если время занято; вызывается внутри записи, чтобы
+    проверка и вставка шли в одной транзакции"""
+    if intervals is None:
+        return
+    conflicts = find_conflicts(conn, user_id, intervals, exclude_id)
+    if conflicts:
+        raise AppointmentConflict(conflicts)
+
+@app.errorhandler(AppointmentConflict)
+def appointment_conflict(e):
+    """Ответ 409 со списком пересечений"""
+    return jsonify({
+        'success': False,
+        'message': str(e),
+        'conflicts': e.conflicts
+    }), 409
+
 @app.route('/api/appointments', methods=['POST'])
 def create_appointment():
     """Создание новой записи к врачу"""
@@ -185,16 +437,36 @@ def create_appointment():
                 'message': f'Отсутствует обязательное поле: {field}'
             }), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
+    # Повторяющийся прием: правило хранится один раз, повторения не создаются
+    try:
+        rrule, series_end = recurrence_values(data, data['start_time'], data['end_time'])
+    except RuleError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     
     try:
-        cursor.execute('''
+        intervals = booking_intervals_for(data, rrule)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Некорректное время: {str(e)}'
+        }), 400
+    
+    user_id = data.get('user_id', 1)
+    cursor = user_db(user_id).cursor()
+    
+    # Проверка пересечений и вставка - в одной транзакции записи
+    def insert(conn):
+        check_conflicts(conn, user_id, intervals)
+        return conn.execute('''
             INSERT INTO appointments (user_id, title, start_time, end_time, 
-                                      doctor, specialty, location, status, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                      doctor, specialty, location, status, notes,
+                                      rrule, series_end)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
-            data.get('user_id', 1),
+            user_id,
             data['title'],
             data['start_time'],
             data['end_time'],
@@ -202,11 +474,13 @@ def create_appointment():
             data.get('specialty'),
             data.get('location'),
             data.get('status', 'scheduled'),
-            data.get('notes')
-        ))
-        
-        conn.commit()
-        appointment_id = cursor.lastrowid
+            data.get('notes'),
+            rrule,
+            series_end
+        )).lastrowid
+    
+    try:
+        appointment_id = write_user(user_id, insert)
         
         # Получаем созданную запись
         cursor.execute('SELECT * FROM appointments WHERE id = ?', (appointment_id,))
@@ -218,27 +492,18 @@ def create_appointment():
             'message': 'Запись к врачу создана'
         }), 201
         
-    except Exception as e:
-        conn.rollback()
+    except sqlite3.Error as e:
         return jsonify({
             'success': False,
             'message': f'Ошибка создания записи: {str(e)}'
         }), 500
-        
-    finally:
-        conn.close()
-
+    
 @app.route('/api/appointments/<int:appointment_id>', methods=['DELETE'])
 def delete_appointment(appointment_id):
     """Удаление записи к врачу"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM appointments WHERE id = ?', (appointment_id,))
-    deleted = cursor.rowcount > 0
-    
-    conn.commit()
-    conn.close()
+    deleted = write_row(appointment_id, lambda conn: conn.execute(
+        'DELETE FROM appointments WHERE id = ?', (appointment_id,)
+    ).rowcount > 0)
     
     if deleted:
         return jsonify({
@@ -256,24 +521,46 @@ def update_appointment(appointment_id):
     """Обновление записи к врачу"""
     data = request.get_json()
     
-    conn = get_db()
-    cursor = conn.cursor()
+    cursor = shard_db(row_shard(appointment_id)).cursor()
     
     # Проверяем, существует ли запись
     cursor.execute('SELECT * FROM appointments WHERE id = ?', (appointment_id,))
-    if not cursor.fetchone():
-        conn.close()
+    existing = cursor.fetchone()
+    if not existing:
         return jsonify({
             'success': False,
             'message': 'Запись не найдена'
         }), 404
     
+    # Правка всей серии: правило из запроса или прежнее
+    if 'recurrence' not in data:
+        data['recurrence'] = existing['rrule']
     try:
-        cursor.execute('''
+        rrule, series_end = recurrence_values(data, data.get('start_time'), data.get('end_time'))
+    except RuleError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    intervals = None
+    if data.get('start_time') and data.get('end_time'):
+        try:
+            intervals = booking_intervals_for(data, rrule, exdates=existing['exdates'])
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': f'Некорректное время: {str(e)}'
+            }), 400
+    
+    # Проверка пересечений и изменение - в одной транзакции записи
+    def update(conn):
+        check_conflicts(conn, existing['user_id'], intervals, exclude_id=appointment_id)
+        conn.execute('''
             UPDATE appointments 
             SET title = ?, start_time = ?, end_time = ?, 
                 doctor = ?, specialty = ?, location = ?, 
-                status = ?, notes = ?
+                status = ?, notes = ?, rrule = ?, series_end = ?
             WHERE id = ?
         ''', (
             data.get('title'),
@@ -284,10 +571,13 @@ def update_appointment(appointment_id):
             data.get('location'),
             data.get('status'),
             data.get('notes'),
+            rrule,
+            series_end,
             appointment_id
         ))
-        
-        conn.commit()
+    
+    try:
+        write_row(appointment_id, update)
         
         # Получаем обновленную запись
         cursor.execute('SELECT * FROM appointments WHERE id = ?', (appointment_id,))
@@ -299,22 +589,145 @@ def update_appointment(appointment_id):
             'message': 'Запись обновлена'
         })
         
-    except Exception as e:
-        conn.rollback()
+    except sqlite3.Error as e:
         return jsonify({
             'success': False,
             'message': f'Ошибка обновления: {str(e)}'
         }), 500
-        
-    finally:
-        conn.close()
+
+def series_for_write(conn, appointment_id):
+    """Главная запись серии, перечитанная в задании записи; иначе SeriesNotFound"""
+    master = get_series(conn, appointment_id)
+    if master is None:
+        raise SeriesNotFound()
+    return master
+
+@app.errorhandler(SeriesNotFound)
+def series_not_found(e):
+    """Серии нет (или она удалена, пока запрос ждал записи)"""
+    return jsonify({
+        'success': False,
+        'message': 'Серия не найдена'
+    }), 404
+
+@app.route('/api/appointments/<int:appointment_id>/occurrence', methods=['PUT'])
+def update_occurrence(appointment_id):
+    """Изменение одного повторения серии (scope=this) или его и следующих (scope=following)"""
+    data = request.get_json() or {}
+    occurrence_start = request.args.get('start')
+    scope = request.args.get('scope', 'this')
+    
+    cursor = shard_db(row_shard(appointment_id)).cursor()
+    
+    # Изменение и проверка пересечений - в одной транзакции записи:
+    # при конфликте правка откатывается
+    def update(conn):
+        master = series_for_write(conn, appointment_id)
+        new_id = edit_occurrence(conn, master, occurrence_start, data, scope)
+        if not data.get('allow_overlap'):
+            row = conn.execute('SELECT * FROM appointments WHERE id = ?', (new_id,)).fetchone()
+            intervals = booking_intervals(row['start_time'], row['end_time'], row['rrule'], row['exdates'])
+            # Повторение не конфликтует со своей серией: для scope=this это
+            # прежняя серия, для following - новая
+            check_conflicts(conn, row['user_id'], intervals, exclude_id=row['series_id'] or row['id'])
+        return new_id
+    
+    try:
+        new_id = write_row(appointment_id, update)
+    except RuleError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    cursor.execute('SELECT * FROM appointments WHERE id = ?', (new_id,))
+    return jsonify({
+        'success': True,
+        'appointment': dict(cursor.fetchone()),
+        'message': 'Повторение обновлено'
+    })
+
+@app.route('/api/appointments/<int:appointment_id>/occurrence', methods=['DELETE'])
+def remove_occurrence(appointment_id):
+    """Удаление одного повторения серии (scope=this) или его и следующих (scope=following)"""
+    occurrence_start = request.args.get('start')
+    scope = request.args.get('scope', 'this')
+    
+    def remove(conn):
+        master = series_for_write(conn, appointment_id)
+        delete_occurrence(conn, master, occurrence_start, scope)
+    
+    try:
+        write_row(appointment_id, remove)
+    except RuleError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    return jsonify({
+        'success': True,
+        'message': 'Повторение удалено'
+    })
+
+@app.route('/api/appointments/free-slots', methods=['GET'])
+def get_free_slots():
+    """Свободные промежутки не короче duration минут в диапазоне [start, end)"""
+    user_id = request_user_id()
+    duration = request.args.get('duration', 30, type=int)
+    
+    try:
+        range_start, range_end = parse_window(request.args.get('start', ''), request.args.get('end', ''))
+        slots = free_slots(
+            user_db(user_id), user_id, range_start, range_end, timedelta(minutes=duration),
+            day_start=parse_day_time(request.args.get('day_start')),
+            day_end=parse_day_time(request.args.get('day_end'))
+        )
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Некорректный запрос: {str(e)}'
+        }), 400
+    
+    return jsonify({
+        'success': True,
+        'slots': slots,
+        'count': len(slots)
+    })
+
 @app.route('/api/appointments', methods=['GET'])
+@versioned
 def get_appointments():
     """Получение всех записей пользователя"""
-    user_id = request.args.get('user_id', 1, type=int)
+    user_id = request_user_id()
     
-    conn = get_db()
+    # Окно календаря: FullCalendar передает start/end и ждет массив событий
+    if 'start' in request.args and 'end' in request.args:
+        try:
+            window_start, window_end = parse_window(request.args['start'], request.args['end'])
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': f'Некорректное окно: {str(e)}'
+            }), 400
+        
+        return jsonify(window_events(user_db(user_id), user_id, window_start, window_end))
+    
+    if wants_page():
+        return page_response('appointments', user_id)
+    
+    if wants_stream():
+        return stream_rows(
+            user_pool(user_id),
+            "SELECT * FROM appointments WHERE user_id = ? ORDER BY start_time DESC",
+            (user_id,),
+            'appointments',
+            envelope={'success': True}
+        )
+    
+    conn = user_db(user_id)
     cursor = conn.cursor()
+    cursor.row_factory = None  # кортежи: в JSON по шаблону колонок (serialize.py)
     
     try:
         cursor.execute(
@@ -322,20 +735,9 @@ def get_appointments():
             (user_id,)
         )
         rows = cursor.fetchall()
-        appointments = []
-        
-        for row in rows:
-            appointment = dict(row)
-            # Преобразуем datetime в строку для JSON
-            appointment['start_time'] = row['start_time']
-            appointment['end_time'] = row['end_time']
-            appointments.append(appointment)
         
-        return jsonify({
-            'success': True,
-            'appointments': appointments,
-            'count': len(appointments)
-        })
+        return rows_response('appointments', rows, cursor_template(cursor, 'appointments'),
+                             success=True, count=len(rows))
         
     except Exception as e:
         print(f"Ошибка при получении записей: {e}")
@@ -344,24 +746,57 @@ def get_appointments():
             'message': f'Ошибка сервера: {str(e)}',
             'appointments': []
         }), 500
-        
-    finally:
-        conn.close()
-        
+            
+@app.route('/api/search', methods=['GET'])
+def search_records():
+    """Поиск по анализам и приемам пользователя: ранжированные результаты с подсветкой"""
+    user_id = request_user_id()
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({
+            'success': False,
+            'message': 'Отсутствует обязательный параметр: q'
+        }), 400
+    
+    # type=analyses|appointments сужает поиск до одной таблицы
+    kind = request.args.get('type')
+    if kind and kind not in SEARCH_TABLES:
+        return jsonify({
+            'success': False,
+            'message': f'Неизвестный тип: {kind}'
+        }), 400
+    
+    try:
+        results, next_offset = search(
+            user_db(user_id), user_id, query,
+            tables=(kind,) if kind else None,
+            limit=request.args.get('limit'),
+            offset=request.args.get('offset', 0, type=int)
+        )
+    except sqlite3.OperationalError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Поиск недоступен: {str(e)}'
+        }), 503
+    
+    return jsonify({
+        'success': True,
+        'query': query,
+        'results': results,
+        'count': len(results),
+        'next_offset': next_offset
+    })
+
 @app.route('/api/dashboard/stats', methods=['GET'])
+@versioned
 def get_stats():
-    user_id = request.args.get('user_id', 1)
+    user_id = request_user_id()
     
-    conn = get_db()
+    conn = user_db(user_id)
     cursor = conn.cursor()
     
-    # Количество анализов
-    cursor.execute("SELECT COUNT(*) FROM analyses WHERE user_id = ?", (user_id,))
-    total_analyses = cursor.fetchone()[0]
-    
-    # Количество приемов
-    cursor.execute("SELECT COUNT(*) FROM appointments WHERE user_id = ?", (user_id,))
-    total_appointments = cursor.fetchone()[0]
+    # Количество анализов и приемов - из счетчиков
+    stats = read_stats(conn, user_id)
     
     # Последние анализы
     cursor.execute(
@@ -378,17 +813,44 @@ def get_stats():
     ''', (user_id,))
     upcoming_appointments = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
     
     return jsonify({
         'stats': {
-            'total_analyses': total_analyses,
-            'total_appointments': total_appointments
+            'total_analyses': stats['total_analyses'],
+            'total_appointments': stats['total_appointments']
         },
         'recent_analyses': recent_analyses,
         'upcoming_appointments': upcoming_appointments
     })
 
+@app.route('/api/export', methods=['GET'])
+def export_data():
+    """Выгрузка всех данных пользователя (JSON, CSV или ZIP, по желанию gzip)"""
+    user_id = request_user_id()
+    fmt = request.args.get('format', 'json')
+    table = request.args.get('table', 'analyses')
+    
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'message': f'Формат выгрузки: {", ".join(EXPORT_FORMATS)}'
+        }), 400
+    if fmt == 'csv' and table not in EXPORT_TABLES:
+        return jsonify({
+            'success': False,
+            'message': f'Таблица для CSV: {", ".join(EXPORT_TABLES)}'
+        }), 400
+    
+    chunks, content_type, filename = export_stream(
+        pool, user_id, fmt, table,
+        compress=request.args.get('gzip') in ('1', 'true'),
+        data_pool=user_pool(user_id)
+    )
+    # Без Content-Length ответ уходит chunked, первый байт - сразу после первой пачки
+    return Response(chunks, content_type=content_type, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
 @app.route('/api/auth/register', methods=['POST'])
 def register():
     """Регистрация нового пользователя"""
@@ -410,28 +872,34 @@ def register():
     conn = get_db()
     cursor = conn.cursor()
     
-    try:
-        # Проверяем, не существует ли уже пользователь с таким email
-        cursor.execute("SELECT id FROM users WHERE email = ?", (email,))
-        if cursor.fetchone():
-            return jsonify({
-                'success': False,
-                'message': 'Пользователь с таким email уже существует'
-            }), 400
-        
+    # Проверяем, не существует ли уже пользователь с таким email
+    cursor.execute("SELECT id FROM users WHERE email = ?", (email,))
+    if cursor.fetchone():
+        return jsonify({
+            'success': False,
+            'message': 'Пользователь с таким email уже существует'
+        }), 400
+    
+    # Хэш считается в пуле bcrypt; при перегрузке - 503 (PasswordPoolBusy)
+    password_hash = passwords.hash(password)
+    
+    def insert(conn):
         # Создаем нового пользователя
-        cursor.execute(
-            "INSERT INTO users (email, password, name) VALUES (?, ?, ?)",
-            (email, password, name)
-        )
+        user_id = conn.execute(
+            "INSERT INTO users (email, password_hash, name) VALUES (?, ?, ?)",
+            (email, password_hash, name)
+        ).lastrowid
         
-        user_id = cursor.lastrowid
+        # Шард выбирается по id, поэтому назначается после вставки
+        shard = shards.placement(user_id)
+        if shard:
+            conn.execute('UPDATE users SET shard = ? WHERE id = ?', (shard, user_id))
         
         # Получаем созданного пользователя
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = dict(cursor.fetchone())
-        
-        conn.commit()
+        return public_user(conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone())
+    
+    try:
+        user = write(insert)
         
         return jsonify({
             'success': True,
@@ -439,16 +907,12 @@ def register():
             'message': 'Регистрация успешна'
         }), 201
         
-    except Exception as e:
-        conn.rollback()
+    except sqlite3.Error as e:
         return jsonify({
             'success': False,
             'message': f'Ошибка регистрации: {str(e)}'
         }), 500
-        
-    finally:
-        conn.close()
-
+    
 if __name__ == '__main__':
     print(f"База данных: {DB_PATH}")
     print("Адрес: http://localhost:5000")
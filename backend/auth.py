@@ -2,6 +2,7 @@ from flask_jwt_extended import create_access_token, create_refresh_token
 from flask import jsonify
 from datetime import datetime
 from database import db
+from revocation import revocations
 
 class Auth:
     @staticmethod
@@ -51,4 +52,9 @@ class Auth:
                 'birth_date': user['birth_date'],
                 'sex_type': user['sex_type']
             }
-        }
\ No newline at end of file
+        }
+    
+    @staticmethod
+    def logout(jwt_payload):
+        """Отзыв токена (payload из get_jwt) до истечения его срока"""
+        revocations.revoke(jwt_payload['jti'], jwt_payload['exp'])
\ No newline at end of file
@@ -0,0 +1,7 @@
+"""Нагрузочное тестирование: синтетическая популяция, воспроизведение
+запросов фронтенда, p50/p95/p99 по маршрутам и сравнение с базовым прогоном.
+
+    python -m bench populate --users 500 --years 3
+    python -m bench run --duration 30 --concurrency 4 --save-baseline bench/baseline.json
+    python -m bench run --baseline bench/baseline.json   # код возврата 1 при регрессии
+"""
@@ -0,0 +1,131 @@
+"""CLI нагрузочного тестирования (запуск из backend/: python -m bench ...)"""
+import argparse
+import os
+import platform
+import sqlite3
+import sys
+from datetime import datetime
+
+from config import Config, DATA_DIR
+
+DEFAULT_DB = os.path.join(DATA_DIR, 'bench.db')
+
+
+def parse_mix(value):
+    """'dashboard=45,analyses=25' -> {'dashboard': 45, 'analyses': 25}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def populate(args):
+    from bench.population import generate
+
+    if args.fresh:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    os.makedirs(os.path.dirname(args.db) or '.', exist_ok=True)
+
+    def progress(users, analyses, appointments):
+        print(f'  пользователей {users}, анализов {analyses}, приемов {appointments}')
+
+    users, analyses, appointments = generate(
+        args.db, users=args.users, years=args.years, analyses_per_year=args.analyses_per_year,
+        appointments_per_year=args.appointments_per_year, seed=args.seed, progress=progress)
+    print(f'Создано: пользователей {users}, анализов {analyses}, приемов {appointments} ({args.db})')
+    return 0
+
+
+def load_users(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute("SELECT id, email FROM users WHERE email LIKE 'bench%'").fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def run(args):
+    from bench import report, traffic
+
+    users = load_users(args.db)
+    if not users:
+        print(f'В {args.db} нет синтетических пользователей: python -m bench populate')
+        return 2
+
+    if args.url:
+        transport = traffic.HttpTransport(args.url)
+    else:
+        from app import app
+        transport = traffic.TestClientTransport(app)
+
+    mix = parse_mix(args.mix) if args.mix else traffic.DEFAULT_MIX
+    print(f'Нагрузка: {args.concurrency} клиентов, {args.duration} с, '
+          f'{"HTTP " + args.url if args.url else "test client"}, пользователей {len(users)}')
+    recorder, elapsed = traffic.run(transport, users, duration=args.duration,
+                                    concurrency=args.concurrency, mix=mix,
+                                    warmup=args.warmup, seed=args.seed)
+    summary = report.summarize(recorder, elapsed)
+    print(report.format_table(summary))
+
+    meta = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'transport': args.url or 'test_client',
+        'users': len(users),
+        'duration': args.duration,
+        'concurrency': args.concurrency,
+        'mix': mix,
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+    }
+    if args.save_baseline:
+        report.save_baseline(args.save_baseline, summary, meta)
+        print(f'Базовый прогон сохранен: {args.save_baseline}')
+
+    if args.baseline:
+        baseline = report.load_baseline(args.baseline)
+        regressions = report.compare(summary, baseline, args.tolerance)
+        for route, metric, was, now in regressions:
+            print(f'РЕГРЕССИЯ {route} {metric}: {was} -> {now}')
+        print('Регрессий нет' if not regressions else f'Регрессий: {len(regressions)}')
+        return 1 if regressions else 0
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Нагрузочное тестирование')
+    parser.add_argument('--db', default=DEFAULT_DB, help='файл БД для прогона')
+    parser.add_argument('--seed', type=int, default=1)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('populate', help='синтетическая популяция')
+    p.add_argument('--users', type=int, default=200)
+    p.add_argument('--years', type=int, default=3)
+    p.add_argument('--analyses-per-year', type=int, default=12)
+    p.add_argument('--appointments-per-year', type=int, default=6)
+    p.add_argument('--fresh', action='store_true', help='удалить БД перед генерацией')
+
+    p = commands.add_parser('run', help='прогон нагрузки')
+    p.add_argument('--url', help='адрес запущенного сервера (иначе test client в процессе)')
+    p.add_argument('--duration', type=float, default=30)
+    p.add_argument('--warmup', type=float, default=2)
+    p.add_argument('--concurrency', type=int, default=4)
+    p.add_argument('--mix', help='веса сценариев: dashboard=45,analyses=25,appointments=25,login=5')
+    p.add_argument('--save-baseline', help='сохранить результат как базовый (JSON)')
+    p.add_argument('--baseline', help='сравнить с базовым прогоном (JSON)')
+    p.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение, доля')
+    args = parser.parse_args(argv)
+
+    # До импорта приложения: модули берут путь к БД из Config при импорте.
+    # Сервер для --url запускается с тем же DATABASE_PATH.
+    args.db = os.path.abspath(args.db)
+    Config.DATABASE = args.db
+    return populate(args) if args.command == 'populate' else run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
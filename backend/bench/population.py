@@ -0,0 +1,135 @@
+"""Синтетические пациенты: пользователи, анализы и приемы за несколько лет.
+
+Данные пишутся напрямую в SQLite пакетами executemany в одной транзакции
+(триггеры счетчиков и поиска срабатывают как при обычной записи).
+Генерация детерминирована: одинаковый seed - одинаковая БД.
+"""
+import random
+import sqlite3
+from datetime import date, datetime, timedelta
+
+from migrations import migrate
+from passwords import passwords
+from results import classify_result
+
+BENCH_PASSWORD = 'bench123'
+
+FIRST_NAMES = ('Александр', 'Мария', 'Дмитрий', 'Анна', 'Сергей', 'Елена', 'Андрей', 'Ольга',
+               'Алексей', 'Наталья', 'Иван', 'Татьяна', 'Михаил', 'Светлана', 'Николай', 'Юлия')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов',
+              'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев')
+DOCTORS = ('Иванов И.И.', 'Петрова А.А.', 'Сидоров В.В.', 'Кузнецова Е.С.', 'Орлов Д.Н.',
+           'Белова М.П.', 'Григорьев С.А.', 'Ёлкина Т.В.')
+SPECIALTIES = ('Терапевт', 'Кардиолог', 'Эндокринолог', 'Невролог', 'Офтальмолог',
+               'Хирург', 'Гастроэнтеролог', 'Дерматолог', 'УЗИ-специалист')
+LOCATIONS = ('Поликлиника №1', 'Поликлиника №12', 'Городская больница №3',
+             'Диагностический центр «Здоровье»', 'Клиника «Медсервис»')
+BLOOD_TYPES = ('O(I) Rh+', 'A(II) Rh+', 'B(III) Rh+', 'AB(IV) Rh+', 'O(I) Rh-', 'A(II) Rh-')
+NOTES = ('В норме', 'Повторить через месяц', 'Натощак', 'Незначительное повышение',
+         'Контроль после лечения', 'Плановое обследование', '')
+
+# (тип, единица, норма от, норма до, среднее, разброс); без нормы - качественный результат
+ANALYSIS_TYPES = (
+    ('Гемоглобин', 'г/л', 120, 160, 138, 14),
+    ('Глюкоза', 'ммоль/л', 3.9, 6.1, 5.2, 0.9),
+    ('Холестерин', 'ммоль/л', 3.0, 5.2, 4.9, 0.8),
+    ('Лейкоциты', '10^9/л', 4.0, 9.0, 6.5, 1.8),
+    ('Тромбоциты', '10^9/л', 180, 320, 250, 45),
+    ('СОЭ', 'мм/ч', 2, 15, 9, 5),
+    ('АЛТ', 'Ед/л', 0, 41, 25, 12),
+    ('Креатинин', 'мкмоль/л', 62, 115, 88, 16),
+    ('ТТГ', 'мЕд/л', 0.4, 4.0, 2.1, 1.1),
+    ('Ферритин', 'нг/мл', 20, 250, 110, 60),
+    ('Общий анализ мочи', None, None, None, None, None),
+)
+QUALITATIVE = ('Отрицательно', 'Не обнаружено', 'Норма', 'Положительно')
+
+APPOINTMENT_TITLES = ('Консультация', 'Повторный прием', 'Плановый осмотр', 'УЗИ',
+                      'ЭКГ', 'Профилактический осмотр')
+APPOINTMENT_STATUSES = ('completed', 'completed', 'completed', 'canceled')
+
+
+def _analysis(rng, user_id, day):
+    kind, unit, norm_min, norm_max, mean, spread = rng.choice(ANALYSIS_TYPES)
+    if mean is None:
+        result = rng.choice(QUALITATIVE)
+    else:
+        result = f'{max(0.0, rng.gauss(mean, spread)):.1f}'
+    result_value, is_abnormal = classify_result(result, norm_min, norm_max)
+    return (user_id, kind, day.isoformat(), result, unit, norm_min, norm_max,
+            rng.choice(DOCTORS), rng.choice(NOTES), result_value, is_abnormal)
+
+
+def _appointment(rng, user_id, day, today):
+    start = datetime.combine(day, datetime.min.time()) + timedelta(
+        hours=rng.randint(8, 18), minutes=rng.choice((0, 15, 30, 45)))
+    end = start + timedelta(minutes=rng.choice((20, 30, 45, 60)))
+    status = 'scheduled' if day >= today else rng.choice(APPOINTMENT_STATUSES)
+    specialty = rng.choice(SPECIALTIES)
+    return (user_id, f'{rng.choice(APPOINTMENT_TITLES)}: {specialty.lower()}',
+            start.strftime('%Y-%m-%d %H:%M'), end.strftime('%Y-%m-%d %H:%M'),
+            rng.choice(DOCTORS), specialty, rng.choice(LOCATIONS), status, rng.choice(NOTES))
+
+
+def generate(db_path, users=100, years=3, analyses_per_year=12, appointments_per_year=6,
+             upcoming=2, seed=1, progress=None):
+    """Пополнение БД синтетическими пользователями; (пользователей, анализов, приемов)"""
+    rng = random.Random(seed)
+    today = date.today()
+    first_day = today - timedelta(days=365 * years)
+    span = (today - first_day).days
+
+    # Один хэш на всех: bcrypt на каждого пользователя занял бы минуты
+    password_hash = passwords.hash(BENCH_PASSWORD)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        migrate(conn)
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('BEGIN')
+        start_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]
+        totals = [0, 0, 0]
+        for n in range(users):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            user_id = conn.execute('''
+                INSERT INTO users (email, password_hash, name, birth_date, blood_type, allergies)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (f'bench{start_id + n + 1}@example.com', password_hash, f'{first} {last}',
+                  date(rng.randint(1940, 2005), rng.randint(1, 12), rng.randint(1, 28)).isoformat(),
+                  rng.choice(BLOOD_TYPES), rng.choice(('Нет', 'Пенициллин', 'Пыльца березы')))).lastrowid
+
+            analyses = [
+                _analysis(rng, user_id, first_day + timedelta(days=rng.randrange(span)))
+                for _ in range(rng.randint(analyses_per_year * years // 2, analyses_per_year * years))
+            ]
+            appointments = [
+                _appointment(rng, user_id, first_day + timedelta(days=rng.randrange(span)), today)
+                for _ in range(rng.randint(appointments_per_year * years // 2, appointments_per_year * years))
+            ]
+            appointments += [
+                _appointment(rng, user_id, today + timedelta(days=rng.randint(1, 60)), today)
+                for _ in range(upcoming)
+            ]
+            conn.executemany('''
+                INSERT INTO analyses (user_id, type, date, result, unit, norm_min, norm_max, doctor, notes,
+                                      result_value, is_abnormal)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', analyses)
+            conn.executemany('''
+                INSERT INTO appointments (user_id, title, start_time, end_time, doctor, specialty, location,
+                                          status, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', appointments)
+            totals[0] += 1
+            totals[1] += len(analyses)
+            totals[2] += len(appointments)
+            if progress and (n + 1) % 100 == 0:
+                progress(*totals)
+        conn.commit()
+        conn.execute('PRAGMA optimize')
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return tuple(totals)
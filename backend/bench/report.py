@@ -0,0 +1,86 @@
+"""Сводка замеров по маршрутам и сравнение с сохраненным базовым прогоном"""
+import json
+import math
+
+# Замеров хвоста, на которых процентиль считается устойчивым (5 для p95 - это 100 запросов)
+TAIL_SAMPLES = 5
+
+
+def percentile(sorted_values, q):
+    """Процентиль по ближайшему рангу (sorted_values отсортирован)"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(recorder, elapsed):
+    """{маршрут: {count, errors, rps, p50, p95, p99, mean}}; задержки в мс"""
+    summary = {}
+    for route, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        statuses = recorder.statuses.get(route, {})
+        errors = sum(count for status, count in statuses.items()
+                     if status == 'error' or status >= 500)
+        summary[route] = {
+            'count': len(values),
+            'errors': errors,
+            'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            'rps': round(len(values) / elapsed, 2) if elapsed else 0,
+            'p50': round(percentile(values, 50) * 1000, 3),
+            'p95': round(percentile(values, 95) * 1000, 3),
+            'p99': round(percentile(values, 99) * 1000, 3),
+            'mean': round(sum(values) / len(values) * 1000, 3),
+        }
+    return summary
+
+
+def format_table(summary):
+    lines = [f'{"маршрут":<34} {"запросов":>8} {"ошибок":>6} {"rps":>8} '
+             f'{"p50 мс":>8} {"p95 мс":>8} {"p99 мс":>8}']
+    total = 0
+    total_rps = 0.0
+    for route, row in summary.items():
+        total += row['count']
+        total_rps += row['rps']
+        lines.append(f'{route:<34} {row["count"]:>8} {row["errors"]:>6} {row["rps"]:>8.1f} '
+                     f'{row["p50"]:>8.2f} {row["p95"]:>8.2f} {row["p99"]:>8.2f}')
+    lines.append(f'{"всего":<34} {total:>8} {"":>6} {total_rps:>8.1f}')
+    return '\n'.join(lines)
+
+
+def save_baseline(path, summary, meta):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'routes': summary}, f, ensure_ascii=False, indent=2)
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(summary, baseline, tolerance=0.2, min_delta_ms=1.0):
+    """Регрессии относительно базового прогона: [(маршрут, метрика, было, стало)].
+
+    Задержка (p95, p99) - регрессия, если выросла больше чем на tolerance и
+    больше чем на min_delta_ms (шум на быстрых маршрутах); процентиль
+    сравнивается, только если за ним хотя бы TAIL_SAMPLES замеров в обоих
+    прогонах. Пропускная способность - если упала больше чем на tolerance;
+    ошибки - если появились.
+    """
+    regressions = []
+    for route, base in baseline['routes'].items():
+        row = summary.get(route)
+        if row is None:
+            continue
+        for metric, q in (('p95', 95), ('p99', 99)):
+            enough = TAIL_SAMPLES * 100 / (100 - q)
+            if min(row['count'], base['count']) < enough:
+                continue
+            if row[metric] > base[metric] * (1 + tolerance) and row[metric] - base[metric] > min_delta_ms:
+                regressions.append((route, metric, base[metric], row[metric]))
+        if row['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append((route, 'rps', base['rps'], row['rps']))
+        if row['errors'] and not base['errors']:
+            regressions.append((route, 'errors', base['errors'], row['errors']))
+    return regressions
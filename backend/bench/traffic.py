@@ -0,0 +1,205 @@
+"""Воспроизведение запросов фронтенда с замером задержек.
+
+Сценарии повторяют страницы frontend/src/pages:
+    dashboard     - Dashboard.jsx: статистика, анализы, приемы (последовательно)
+    analyses      - Analysis.jsx: список, новый анализ, список заново
+    appointments  - Appointments.jsx: список, создание, правка, удаление,
+                    после каждого изменения список заново
+    login         - Login.jsx: вход (bcrypt)
+
+Каждый поток-клиент выбирает сценарий по весам и случайного пользователя
+из синтетической популяции. Запросы идут в приложение через Flask test
+client (в процессе) или по HTTP к запущенному серверу.
+"""
+import http.client
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from bench.population import BENCH_PASSWORD, ANALYSIS_TYPES, DOCTORS, SPECIALTIES, LOCATIONS
+
+DEFAULT_MIX = {'dashboard': 45, 'analyses': 25, 'appointments': 25, 'login': 5}
+
+
+# ========== ТРАНСПОРТ ==========
+class TestClientTransport:
+    """Запросы через Flask test client, без сети"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        return self.app.test_client()
+
+    @staticmethod
+    def send(client, method, path, body=None):
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTransport:
+    """Запросы по HTTP; соединение на поток (keep-alive, если сервер держит)"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+
+    def session(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    @staticmethod
+    def send(conn, method, path, body=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload else {}
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            raise
+        if response.getheader('Connection', '').lower() == 'close':
+            conn.close()
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+# ========== ЗАМЕРЫ ==========
+class Recorder:
+    """Задержки и коды ответов по маршрутам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # маршрут -> [секунды]
+        self.statuses = {}  # маршрут -> {код: число}
+        self.recording = True
+
+    def add(self, route, seconds, status):
+        if not self.recording:
+            return
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            counts = self.statuses.setdefault(route, {})
+            counts[status] = counts.get(status, 0) + 1
+
+
+class Session:
+    """Один клиент: соединение и замер каждого запроса"""
+
+    def __init__(self, transport, recorder, rng):
+        self.transport = transport
+        self.conn = transport.session()
+        self.recorder = recorder
+        self.rng = rng
+
+    def call(self, method, path, route, body=None):
+        started = time.perf_counter()
+        try:
+            status, data = self.transport.send(self.conn, method, path, body)
+        except Exception:
+            status, data = 'error', None
+        self.recorder.add(route, time.perf_counter() - started, status)
+        return status, data
+
+
+# ========== СЦЕНАРИИ ==========
+def dashboard(session, user):
+    session.call('GET', f'/api/dashboard/stats?user_id={user["id"]}', 'GET /api/dashboard/stats')
+    session.call('GET', f'/api/analyses?user_id={user["id"]}', 'GET /api/analyses')
+    session.call('GET', f'/api/appointments?user_id={user["id"]}', 'GET /api/appointments')
+
+
+def analyses(session, user):
+    rng = session.rng
+    session.call('GET', f'/api/analyses?user_id={user["id"]}', 'GET /api/analyses')
+    kind, unit, norm_min, norm_max, mean, spread = rng.choice(ANALYSIS_TYPES)
+    session.call('POST', '/api/analyses', 'POST /api/analyses', {
+        'user_id': user['id'],
+        'type': kind,
+        'date': datetime.now().strftime('%Y-%m-%d'),
+        'result': f'{max(0.0, rng.gauss(mean, spread)):.1f}' if mean is not None else 'Отрицательно',
+        'unit': unit,
+        'norm_min': norm_min,
+        'norm_max': norm_max,
+        'doctor': rng.choice(DOCTORS),
+        'notes': 'Нагрузочный тест',
+    })
+    session.call('GET', f'/api/analyses?user_id={user["id"]}', 'GET /api/analyses')
+
+
+def appointments(session, user):
+    rng = session.rng
+    list_path = f'/api/appointments?user_id={user["id"]}'
+    session.call('GET', list_path, 'GET /api/appointments')
+
+    # Далекое будущее и случайное время: пересечения с другими записями редки
+    start = datetime(2031, 1, 1, 8) + timedelta(days=rng.randrange(3650), minutes=15 * rng.randrange(40))
+    specialty = rng.choice(SPECIALTIES)
+    appointment = {
+        'user_id': user['id'],
+        'title': f'Консультация: {specialty.lower()}',
+        'start_time': start.strftime('%Y-%m-%dT%H:%M'),
+        'end_time': (start + timedelta(minutes=30)).strftime('%Y-%m-%dT%H:%M'),
+        'doctor': rng.choice(DOCTORS),
+        'specialty': specialty,
+        'location': rng.choice(LOCATIONS),
+        'status': 'scheduled',
+        'notes': 'Нагрузочный тест',
+    }
+    status, data = session.call('POST', '/api/appointments', 'POST /api/appointments', appointment)
+    session.call('GET', list_path, 'GET /api/appointments')
+    if status != 201 or not data:
+        return
+
+    appointment_id = data['appointment']['id']
+    session.call('PUT', f'/api/appointments/{appointment_id}', 'PUT /api/appointments/<id>',
+                 dict(appointment, notes='Перенесено'))
+    session.call('GET', list_path, 'GET /api/appointments')
+    session.call('DELETE', f'/api/appointments/{appointment_id}', 'DELETE /api/appointments/<id>')
+    session.call('GET', list_path, 'GET /api/appointments')
+
+
+def login(session, user):
+    session.call('POST', '/api/auth/login', 'POST /api/auth/login',
+                 {'email': user['email'], 'password': BENCH_PASSWORD})
+
+
+SCENARIOS = {
+    'dashboard': dashboard,
+    'analyses': analyses,
+    'appointments': appointments,
+    'login': login,
+}
+
+
+def run(transport, users, duration=30.0, concurrency=4, mix=None, warmup=2.0, seed=1):
+    """Нагрузка в concurrency потоков; (Recorder, секунд замера)"""
+    mix = mix or DEFAULT_MIX
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    recorder = Recorder()
+    recorder.recording = warmup <= 0
+    stop_at = time.monotonic() + warmup + duration
+
+    def client(number):
+        rng = random.Random(seed * 1000 + number)
+        session = Session(transport, recorder, rng)
+        while time.monotonic() < stop_at:
+            name = rng.choices(names, weights)[0]
+            SCENARIOS[name](session, rng.choice(users))
+
+    threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    if warmup > 0:
+        time.sleep(warmup)
+        recorder.recording = True
+    started = time.monotonic()
+    for thread in threads:
+        thread.join()
+    return recorder, time.monotonic() - started
@@ -0,0 +1,257 @@
+"""Сжатие ответов по Accept-Encoding (COMPRESSION_ENABLED=1).
+
+Кодировки в порядке предпочтения сервера: br (пакет brotli), zstd (пакет
+zstandard), gzip (zlib, есть всегда); из тех, что принимает клиент,
+выбирается с наибольшим q. Сжимаются текстовые типы (JSON, NDJSON, CSV,
+text/*) от COMPRESSION_MIN_SIZE байт. Ответы, у которых уже есть
+Content-Encoding, и несжимаемые типы не трогаются: выгрузка с ?gzip=1 - это
+вложение .gz с типом application/gzip, а не Content-Encoding, и она
+пропускается по типу, как ZIP и файлы.
+
+Потоковый ответ сжимается по мере выдачи: после каждой пачки - flush, так
+что клиент получает данные сразу, а не в конце. Размер потока заранее
+неизвестен, поэтому порог к нему не применяется. Исходный поток
+закрывается вместе со сжатым (в том числе при обрыве соединения): генератор
+выгрузки держит соединение с БД и транзакцию чтения.
+
+Ответ с ETag (списки с @versioned) сжимается один раз: тело кэшируется по
+(ETag, кодировка, Accept). Пока данные пользователя не менялись, etag.py
+отдает его из кэша: версия данных (read_version) по-прежнему читается на
+каждый запрос, пропускаются только запрос списка, сериализация и сжатие.
+ETag сжатого ответа - и обычного, и потокового - слабый (байты другие,
+содержимое то же), If-None-Match с ним по-прежнему дает 304.
+"""
+import threading
+import zlib
+from collections import OrderedDict
+
+from config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript')
+
+_encodings = {}  # имя -> кодировка, в порядке предпочтения (заполняет init_app)
+_cache = None
+
+
+# ========== КОДИРОВКИ ==========
+def _as_bytes(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+def _close(chunks):
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+class Gzip:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def stream(self, chunks):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        try:
+            for chunk in _as_bytes(chunks):
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            _close(chunks)
+
+
+class Brotli:
+    name = 'br'
+
+    def __init__(self, quality):
+        self.quality = quality
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.quality)
+
+    def stream(self, chunks):
+        compressor = brotli.Compressor(quality=self.quality)
+        try:
+            for chunk in _as_bytes(chunks):
+                data = compressor.process(chunk) + compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            _close(chunks)
+
+
+class Zstd:
+    name = 'zstd'
+
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def stream(self, chunks):
+        compressor = self.compressor.compressobj()
+        try:
+            for chunk in _as_bytes(chunks):
+                data = compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            _close(chunks)
+
+
+def available_encodings():
+    """Кодировки, доступные в этом окружении, в порядке предпочтения"""
+    encodings = []
+    if brotli is not None:
+        encodings.append(Brotli(Config.COMPRESSION_BROTLI_QUALITY))
+    if zstandard is not None:
+        encodings.append(Zstd(Config.COMPRESSION_ZSTD_LEVEL))
+    encodings.append(Gzip(Config.COMPRESSION_GZIP_LEVEL))
+    return encodings
+
+
+# ========== КЭШ ПО ETAG ==========
+class CompressedCache:
+    """Сжатые тела (тело, mimetype) по (ETag, кодировка, Accept); LRU"""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._bodies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._bodies.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._bodies.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._bodies[key] = entry
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self.size:
+                self._bodies.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._bodies), 'hits': self.hits, 'misses': self.misses}
+
+
+# ========== FLASK ==========
+def _compressible(response):
+    mimetype = response.mimetype or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def _cache_key(etag, name):
+    from flask import request
+    return (etag, name, request.headers.get('Accept', ''))
+
+
+def _negotiate():
+    from flask import request
+    return request.accept_encodings.best_match(list(_encodings))
+
+
+def cached_response(etag):
+    """Готовый сжатый ответ для ETag, если тело уже сжималось; иначе None"""
+    if _cache is None:
+        return None
+    name = _negotiate()
+    if name is None:
+        return None
+    entry = _cache.get(_cache_key(etag, name))
+    if entry is None:
+        return None
+
+    from flask import Response
+    body, mimetype = entry
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Encoding'] = name
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def stats():
+    return _cache.stats() if _cache is not None else None
+
+
+def init_app(app):
+    """Сжатие ответов приложения; без COMPRESSION_ENABLED - ничего не делает"""
+    global _cache
+    if not Config.COMPRESSION_ENABLED:
+        return
+
+    from flask import request
+
+    _encodings.clear()
+    _encodings.update((encoding.name, encoding) for encoding in available_encodings())
+    _cache = CompressedCache(Config.COMPRESSION_CACHE_SIZE)
+
+    @app.after_request
+    def compress_response(response):
+        if (request.method == 'HEAD' or response.status_code < 200
+                or response.status_code in (204, 206, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or not _compressible(response)):
+            return response
+
+        # Тело зависит от Accept-Encoding, даже если на этот раз не сжато
+        response.vary.add('Accept-Encoding')
+        name = _negotiate()
+        if name is None:
+            return response
+        encoding = _encodings[name]
+
+        if response.is_streamed:
+            chunks = response.response
+            response.response = encoding.stream(chunks)
+            # Сжатый поток, не начатый до обрыва, не дойдет до finally в stream()
+            response.call_on_close(lambda: _close(chunks))
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < Config.COMPRESSION_MIN_SIZE:
+                return response
+            body = encoding.compress(data)
+            response.set_data(body)
+            etag, _ = response.get_etag()
+            if etag:
+                _cache.put(_cache_key(etag, name), (body, response.mimetype))
+
+        # Байты не те, что у несжатого ответа с этим тегом: строгий ETag
+        # сломал бы Range-запросы и кэши
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        response.headers['Content-Encoding'] = name
+        return response
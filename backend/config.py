@@ -4,18 +4,109 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# путь к папке с данными
+# путь к папке с данными (создается при первом соединении с БД)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 
-# Создаем папку, если ее нет
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-super-secret-key-change-in-production')
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key-change-me')
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
-    DATABASE = os.path.join(DATA_DIR, 'medical.db')  # Абсолютный путь
-    CORS_ORIGINS = ['http://localhost:3000']  # React dev server
\ No newline at end of file
+    DATABASE = os.getenv('DATABASE_PATH', os.path.join(DATA_DIR, 'medical.db'))  # Абсолютный путь
+    CORS_ORIGINS = ['http://localhost:3000']  # React dev server
+
+    # Пул соединений SQLite
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+    DB_POOL_MAX_AGE = float(os.getenv('DB_POOL_MAX_AGE', 3600))  # секунды
+    DB_POOL_MAX_USES = int(os.getenv('DB_POOL_MAX_USES', 10000))
+    DB_POOL_HEALTH_INTERVAL = float(os.getenv('DB_POOL_HEALTH_INTERVAL', 30))
+
+    # PRAGMA для каждого соединения
+    DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'WAL')
+    # FULL: зафиксированная транзакция переживает и отключение питания;
+    # NORMAL в WAL быстрее, но последние коммиты при сбое ОС могут пропасть
+    DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'FULL')
+    DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', -20000))  # отрицательное - в КиБ
+    DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 268435456))
+    DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', 5000))  # мс
+
+    # Постраничная выдача списков
+    PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', 50))
+    PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', 200))
+
+    # Потоковая выдача: строк за один fetchmany
+    STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))
+
+    # Пакетная загрузка анализов
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))  # в одном JSON-пакете
+    BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', 500))  # строк CSV за один executemany
+    BATCH_MAX_ERRORS = int(os.getenv('BATCH_MAX_ERRORS', 100))  # ошибок CSV в ответе
+    BATCH_SPOOL_MEMORY = int(os.getenv('BATCH_SPOOL_MEMORY', 8 * 1024 * 1024))  # проверенный CSV в памяти, больше - во временном файле
+
+    # Графики анализов: число точек после прореживания
+    SERIES_DEFAULT_POINTS = int(os.getenv('SERIES_DEFAULT_POINTS', 200))
+    SERIES_MAX_POINTS = int(os.getenv('SERIES_MAX_POINTS', 2000))
+
+    # Повторяющиеся приемы: сколько развернутых окон держать в кэше
+    RECURRENCE_CACHE_SIZE = int(os.getenv('RECURRENCE_CACHE_SIZE', 1024))
+
+    # Пересечения приемов и поиск свободного времени
+    CONFLICT_HORIZON_DAYS = int(os.getenv('CONFLICT_HORIZON_DAYS', 365))  # насколько вперед проверять серию
+    FREE_SLOTS_MAX_DAYS = int(os.getenv('FREE_SLOTS_MAX_DAYS', 92))  # ширина диапазона поиска
+    FREE_SLOTS_MAX = int(os.getenv('FREE_SLOTS_MAX', 200))  # промежутков в ответе
+
+    # Кэш пользователей в памяти процесса (0 - выключен)
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300))  # секунд
+    USER_CACHE_REVALIDATE = float(os.getenv('USER_CACHE_REVALIDATE', 5))  # сверка версии, секунд
+
+    # Пароли: стоимость bcrypt и пул потоков для хэширования
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))  # при смене хэши обновляются при входе
+    BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', os.cpu_count() or 2))
+    BCRYPT_QUEUE_SIZE = int(os.getenv('BCRYPT_QUEUE_SIZE', 32))  # ожидающих задач сверх BCRYPT_WORKERS
+    BCRYPT_TIMEOUT = float(os.getenv('BCRYPT_TIMEOUT', 10))  # секунд
+
+    # Отозванные JWT: фильтр Блума и LRU перед таблицей revoked_tokens
+    REVOCATION_BLOOM_CAPACITY = int(os.getenv('REVOCATION_BLOOM_CAPACITY', 100000))
+    REVOCATION_BLOOM_ERROR_RATE = float(os.getenv('REVOCATION_BLOOM_ERROR_RATE', 0.001))
+    REVOCATION_CACHE_SIZE = int(os.getenv('REVOCATION_CACHE_SIZE', 4096))
+    REVOCATION_SYNC_INTERVAL = float(os.getenv('REVOCATION_SYNC_INTERVAL', 1))  # секунд
+    REVOCATION_REBUILD_INTERVAL = float(os.getenv('REVOCATION_REBUILD_INTERVAL', 3600))  # секунд
+
+    # Групповая запись: один поток-писатель, одна транзакция на пакет (writequeue.py)
+    WRITE_QUEUE_ENABLED = os.getenv('WRITE_QUEUE_ENABLED', '0') == '1'
+    WRITE_QUEUE_WINDOW = float(os.getenv('WRITE_QUEUE_WINDOW', 0.002))  # секунд на сбор пакета
+    WRITE_QUEUE_MAX_BATCH = int(os.getenv('WRITE_QUEUE_MAX_BATCH', 256))  # записей в транзакции
+    WRITE_QUEUE_SIZE = int(os.getenv('WRITE_QUEUE_SIZE', 1024))  # ожидающих записей, дальше 503
+
+    # Шарды данных пользователей (sharding.py); 0 - все в одной БД
+    DB_SHARDS = int(os.getenv('DB_SHARDS', 0))
+    SHARD_DIR = os.getenv('SHARD_DIR', os.path.join(DATA_DIR, 'shards'))
+    SHARD_VNODES = int(os.getenv('SHARD_VNODES', 128))  # точек кольца на шард
+    SHARD_MAINTENANCE_JOBS = int(os.getenv('SHARD_MAINTENANCE_JOBS', os.cpu_count() or 2))
+
+    # Метрики Prometheus на /metrics и заголовок Server-Timing (metrics.py)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+    METRICS_SERVER_TIMING = os.getenv('METRICS_SERVER_TIMING', '1') == '1'
+
+    # Журнал медленных запросов (queryplan.py): порог в мс, 0 - выключен
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 0))
+    SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', '')  # файл; пусто - логгер slow_query (stderr)
+
+    # Сжатие ответов по Accept-Encoding (compressor.py): br и zstd - если установлены brotli/zstandard
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', '1') == '1'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))  # байт; меньше - как есть
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5))
+    COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3))
+    COMPRESSION_CACHE_SIZE = int(os.getenv('COMPRESSION_CACHE_SIZE', 256))  # сжатых тел по ETag
+
+    # Продакшн-сервер (server.py, gunicorn.conf.py)
+    SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+    SERVER_PORT = int(os.getenv('SERVER_PORT', 5000))
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', os.cpu_count() or 1))
+    SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', 1000))  # затем воркер перезапускается
+    SERVER_MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', 100))  # чтобы не все сразу
+    SERVER_GRACEFUL_TIMEOUT = float(os.getenv('SERVER_GRACEFUL_TIMEOUT', 30))  # секунд на текущий запрос
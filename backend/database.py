@@ -1,153 +1,74 @@
 import sqlite3
 import json
-from datetime import datetime
-import bcrypt
-import os
+from datetime import datetime, timedelta
 
-class Config:
-    # Используем абсолютный путь
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    DATA_DIR = os.path.join(BASE_DIR, 'data')
-    DATABASE = os.path.join(DATA_DIR, 'medical.db')
-    
-    # Создаем папку data, если ее нет
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
+from config import Config
+from pool import get_pool
+from writequeue import get_write_queue
+from sharding import ShardMap, DIRECTORY
+from metrics import instrument_methods
+from migrations import migrate
+from pagination import fetch_page
+from stats import read_stats
+from search import search as search_records
+from usercache import UserCache
+from passwords import passwords
+from results import classify_result
+from ingest import ingest_batch
+from series import load_series
+from schedule import (parse_window, window_events, booking_intervals, find_conflicts,
+                      free_slots, parse_day_time, AppointmentConflict)
+from recurrence import recurrence_values, get_series, edit_occurrence, delete_occurrence
 
+@instrument_methods
 class Database:
     def __init__(self, db_path=Config.DATABASE):
         self.db_path = db_path
-        self.init_database()
+        # Конструктор к БД не обращается: схема мигрирует при первом соединении
+        self.pool = get_pool(db_path, setup=migrate)
+        self.user_cache = UserCache(self._load_user, self._load_user_version)
+        # Все записи идут через execute(): сразу или пакетами (WRITE_QUEUE_ENABLED)
+        self.writes = get_write_queue(db_path)
+        # Анализы и приемы - в шарде пользователя (DB_SHARDS = 0 - в этой же БД)
+        self.shards = ShardMap(db_path)
     
     def get_connection(self):
-        # Убедимся, что папка существует
-        db_dir = os.path.dirname(self.db_path)
-        if not os.path.exists(db_dir):
-            os.makedirs(db_dir)
-        
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Соединение из пула на время блока with (справочная БД)"""
+        return self.pool.connection()
+    
+    def _user_shard(self, user_id):
+        """Шард с данными пользователя (по users.shard из кэша)"""
+        user = self.get_user_by_id(user_id)
+        if not user:
+            return DIRECTORY
+        return user.get('shard') or DIRECTORY
+    
+    def _user_connection(self, user_id):
+        return self.shards.pool(self._user_shard(user_id)).connection()
+    
+    def _user_writes(self, user_id):
+        return self.shards.writes(self._user_shard(user_id))
+    
+    def _row_connection(self, row_id):
+        """Соединение с шардом анализа или приема (шард определяется по id)"""
+        return self.shards.pool(self.shards.index_for_id(row_id)).connection()
+    
+    def _row_writes(self, row_id):
+        return self.shards.writes(self.shards.index_for_id(row_id))
     
     def init_database(self):
-        """Инициализация базы данных и создание таблиц"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                name TEXT NOT NULL,
-                birth_date TEXT,
-                blood_type TEXT,
-                allergies TEXT,
-                chronic_diseases TEXT,
-                emergency_contact TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица анализов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analyses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                type TEXT NOT NULL,
-                date DATE NOT NULL,
-                result TEXT NOT NULL,
-                unit TEXT,
-                norm_min REAL,
-                norm_max REAL,
-                doctor TEXT,
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Таблица приемов врачей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS appointments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                start_time DATETIME NOT NULL,
-                end_time DATETIME NOT NULL,
-                doctor TEXT,
-                specialty TEXT,
-                location TEXT,
-                status TEXT DEFAULT 'scheduled',
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Индексы для быстрого поиска
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_analyses_user_date ON analyses(user_id, date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_user_date ON appointments(user_id, start_time)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
-        
-        # Создаем демо пользователя, если его нет
-        cursor.execute('SELECT COUNT(*) FROM users WHERE email = ?', ('demo@example.com',))
-        if cursor.fetchone()[0] == 0:
-            password_hash = bcrypt.hashpw('demo123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            cursor.execute('''
-                INSERT INTO users (email, password_hash, name, birth_date, blood_type, allergies, emergency_contact)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                'demo@example.com',
-                password_hash,
-                'Демо Пользователь',
-                '1990-01-01',
-                'A(II) Rh+',
-                'Нет',
-                '+7 (999) 123-45-67'
-            ))
-            
-            # Добавляем демо анализы
-            demo_analyses = [
-                ('Общий анализ крови', '2024-01-10', '5.2', 'млн/мкл', '4.5', '5.5', 'Иванов И.И.', 'В норме'),
-                ('Глюкоза', '2024-01-12', '5.8', 'ммоль/л', '3.9', '6.1', 'Петрова А.А.', 'Незначительное повышение'),
-                ('Холестерин', '2024-01-15', '5.0', 'ммоль/л', '3.0', '5.2', 'Сидоров В.В.', 'В пределах нормы'),
-            ]
-            
-            user_id = cursor.lastrowid
-            for analysis in demo_analyses:
-                cursor.execute('''
-                    INSERT INTO analyses (user_id, type, date, result, unit, norm_min, norm_max, doctor, notes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (user_id, *analysis))
-            
-            # Добавляем демо записи
-            demo_appointments = [
-                ('Консультация терапевта', '2024-01-20 10:00', '2024-01-20 11:00', 
-                 'Иванов И.И.', 'Терапевт', 'Поликлиника №1', 'scheduled', 'Ежегодный осмотр'),
-                ('УЗИ брюшной полости', '2024-01-25 14:00', '2024-01-25 15:00',
-                 'Петрова А.А.', 'УЗИ-специалист', 'Диагностический центр', 'scheduled', 'Натощак'),
-            ]
-            
-            for appointment in demo_appointments:
-                cursor.execute('''
-                    INSERT INTO appointments (user_id, title, start_time, end_time, doctor, specialty, location, status, notes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (user_id, *appointment))
-        
-        conn.commit()
-        conn.close()
+        """Применение миграций схемы; список примененных (обычно не нужен:
+        миграции выполняются при первом соединении из пула)"""
+        with self.get_connection() as conn:
+            return migrate(conn)
     
     # ========== ПОЛЬЗОВАТЕЛИ ==========
     def create_user(self, email, password, name, **kwargs):
-        """Создание нового пользователя"""
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Создание нового пользователя (PasswordPoolBusy, если пул хэширования занят)"""
+        password_hash = passwords.hash(password)
         
-        try:
+        def insert(conn):
+            cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO users (email, password_hash, name, birth_date, blood_type, allergies, chronic_diseases, emergency_contact)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -157,47 +78,68 @@ class Database:
                   kwargs.get('emergency_contact')))
             
             user_id = cursor.lastrowid
-            conn.commit()
             
-            return self.get_user_by_id(user_id)
+            # Шард выбирается по id, поэтому назначается после вставки
+            shard = self.shards.placement(user_id)
+            if shard:
+                cursor.execute('UPDATE users SET shard = ? WHERE id = ?', (shard, user_id))
+            
+            # Созданная строка сразу попадает в кэш, без повторного чтения
+            cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+            return dict(cursor.fetchone())
+        
+        try:
+            user = self.writes.execute(insert)
         except sqlite3.IntegrityError:
             return None  # Пользователь с таким email уже существует
-        finally:
-            conn.close()
+        
+        self.user_cache.put(user)
+        return dict(user)
     
-    def get_user_by_email(self, email):
-        """Получение пользователя по email"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _load_user(self, column, value):
+        """Строка пользователя из БД по id или email (для кэша)"""
+        with self.get_connection() as conn:
+            row = conn.execute(f'SELECT * FROM users WHERE {column} = ?', (value,)).fetchone()
         
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        row = cursor.fetchone()
-        conn.close()
+        return dict(row) if row else None
+    
+    def _load_user_version(self, user_id):
+        """Текущая версия строки пользователя или None, если его нет"""
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT version FROM users WHERE id = ?', (user_id,)).fetchone()
         
-        if row:
-            return dict(row)
-        return None
+        return row[0] if row else None
+    
+    def get_user_by_email(self, email):
+        """Получение пользователя по email (через кэш)"""
+        return self.user_cache.get_by_email(email)
     
     def get_user_by_id(self, user_id):
-        """Получение пользователя по ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return dict(row)
-        return None
+        """Получение пользователя по ID (через кэш)"""
+        return self.user_cache.get_by_id(user_id)
     
     def verify_password(self, email, password):
-        """Проверка пароля пользователя"""
+        """Проверка пароля пользователя (PasswordPoolBusy, если пул хэширования занят)"""
         user = self.get_user_by_email(email)
         if not user:
             return False
         
-        return bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8'))
+        if not passwords.check(password, user['password_hash']):
+            return False
+        
+        # Стоимость bcrypt изменилась - пароль известен, обновляем хэш
+        if passwords.needs_rehash(user['password_hash']):
+            self._rehash_password(user, passwords.hash(password))
+        return True
+    
+    def _rehash_password(self, user, password_hash):
+        """Замена хэша, если его не поменяли параллельно"""
+        self.writes.execute(lambda conn: conn.execute(
+            'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+            (password_hash, user['id'], user['password_hash'])
+        ))
+        
+        self.user_cache.invalidate(user['id'])
     
     def update_user(self, user_id, **kwargs):
         """Обновление данных пользователя"""
@@ -218,64 +160,107 @@ class Database:
         update_values.append(user_id)
         update_query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(update_query, update_values)
-        conn.commit()
-        conn.close()
+        def update(conn):
+            cursor = conn.cursor()
+            cursor.execute(update_query, update_values)
+            cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
         
-        return self.get_user_by_id(user_id)
+        user = self.writes.execute(update)
+        if user is None:
+            self.user_cache.invalidate(user_id)
+            return None
+        self.user_cache.put(user)
+        return dict(user)
+    
+    def user_cache_stats(self):
+        """Метрики кэша пользователей"""
+        return self.user_cache.stats()
     
     # ========== АНАЛИЗЫ ==========
     def create_analysis(self, user_id, analysis_data):
         """Создание нового анализа"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO analyses (user_id, type, date, result, unit, norm_min, norm_max, doctor, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, 
-              analysis_data['type'], analysis_data['date'], analysis_data['result'],
-              analysis_data.get('unit'), analysis_data.get('norm_min'), 
-              analysis_data.get('norm_max'), analysis_data.get('doctor'),
-              analysis_data.get('notes')))
+        result_value, is_abnormal = classify_result(
+            analysis_data['result'], analysis_data.get('norm_min'), analysis_data.get('norm_max'))
         
-        analysis_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        def insert(conn):
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO analyses (user_id, type, date, result, unit, norm_min, norm_max, doctor, notes,
+                                      result_value, is_abnormal)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, 
+                  analysis_data['type'], analysis_data['date'], analysis_data['result'],
+                  analysis_data.get('unit'), analysis_data.get('norm_min'), 
+                  analysis_data.get('norm_max'), analysis_data.get('doctor'),
+                  analysis_data.get('notes'), result_value, is_abnormal))
+            
+            return cursor.lastrowid
+        
+        analysis_id = self._user_writes(user_id).execute(insert)
         
         return self.get_analysis_by_id(analysis_id)
     
+    def create_analyses_batch(self, user_id, items, strict=False):
+        """Создание панели анализов одной транзакцией; результат по каждому элементу"""
+        return ingest_batch(self._user_writes(user_id).execute, user_id, items, strict=strict)
+    
     def get_analyses_by_user(self, user_id, limit=None, offset=None):
         """Получение всех анализов пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        query = 'SELECT * FROM analyses WHERE user_id = ? ORDER BY date DESC'
-        params = [user_id]
+        with self._user_connection(user_id) as conn:
+            cursor = conn.cursor()
+            
+            query = 'SELECT * FROM analyses WHERE user_id = ? ORDER BY date DESC'
+            params = [user_id]
+            
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
+            if offset:
+                query += ' OFFSET ?'
+                params.append(offset)
+            
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
         
-        if limit:
-            query += ' LIMIT ?'
-            params.append(limit)
-        if offset:
-            query += ' OFFSET ?'
-            params.append(offset)
+        return [dict(row) for row in rows]
+    
+    def get_analyses_page(self, user_id, limit=None, cursor=None):
+        """Страница анализов пользователя по курсору (date, id)"""
+        with self._user_connection(user_id) as conn:
+            rows, next_cursor = fetch_page(conn, 'analyses', user_id, limit, cursor)
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+        return {'items': [dict(row) for row in rows], 'next_cursor': next_cursor}
+    
+    def get_abnormal_analyses(self, user_id, limit=None):
+        """Анализы с отклонениями от нормы (частичный индекс idx_analyses_abnormal)"""
+        with self._user_connection(user_id) as conn:
+            # Без подсказки планировщик выбирает полный idx_analyses_user_date
+            query = ('SELECT * FROM analyses INDEXED BY idx_analyses_abnormal '
+                     'WHERE user_id = ? AND is_abnormal = 1 ORDER BY date DESC')
+            params = [user_id]
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
+            
+            rows = conn.execute(query, params).fetchall()
         
         return [dict(row) for row in rows]
     
+    def get_analysis_series(self, user_id, analysis_type, date_from=None, date_to=None, points=None):
+        """Динамика одного анализа за период, прореженная до points точек"""
+        with self._user_connection(user_id) as conn:
+            return load_series(conn, user_id, analysis_type, date_from, date_to, points)
+    
     def get_analysis_by_id(self, analysis_id):
         """Получение анализа по ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM analyses WHERE id = ?', (analysis_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self._row_connection(analysis_id) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT * FROM analyses WHERE id = ?', (analysis_id,))
+            row = cursor.fetchone()
         
         if row:
             return dict(row)
@@ -288,20 +273,18 @@ class Database:
         if not analysis or analysis['user_id'] != user_id:
             return None
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        result_value, is_abnormal = classify_result(
+            analysis_data['result'], analysis_data.get('norm_min'), analysis_data.get('norm_max'))
         
-        cursor.execute('''
+        self._row_writes(analysis_id).execute(lambda conn: conn.execute('''
             UPDATE analyses 
-            SET type = ?, date = ?, result = ?, unit = ?, norm_min = ?, norm_max = ?, doctor = ?, notes = ?
+            SET type = ?, date = ?, result = ?, unit = ?, norm_min = ?, norm_max = ?, doctor = ?, notes = ?,
+                result_value = ?, is_abnormal = ?
             WHERE id = ? AND user_id = ?
         ''', (analysis_data['type'], analysis_data['date'], analysis_data['result'],
               analysis_data.get('unit'), analysis_data.get('norm_min'), 
               analysis_data.get('norm_max'), analysis_data.get('doctor'),
-              analysis_data.get('notes'), analysis_id, user_id))
-        
-        conn.commit()
-        conn.close()
+              analysis_data.get('notes'), result_value, is_abnormal, analysis_id, user_id)))
         
         return self.get_analysis_by_id(analysis_id)
     
@@ -312,93 +295,143 @@ class Database:
         if not analysis or analysis['user_id'] != user_id:
             return False
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM analyses WHERE id = ? AND user_id = ?', (analysis_id, user_id))
-        deleted = cursor.rowcount > 0
-        
-        conn.commit()
-        conn.close()
+        deleted = self._row_writes(analysis_id).execute(lambda conn: conn.execute(
+            'DELETE FROM analyses WHERE id = ? AND user_id = ?', (analysis_id, user_id)
+        ).rowcount > 0)
         
         return deleted
     
+    # ========== ПОИСК ==========
+    def search(self, user_id, query, tables=None, limit=None, offset=0):
+        """Поиск по анализам и приемам: {'items': [...], 'next_offset': смещение или None}"""
+        with self._user_connection(user_id) as conn:
+            items, next_offset = search_records(conn, user_id, query, tables, limit, offset)
+        
+        return {'items': items, 'next_offset': next_offset}
+    
     # ========== ПРИЕМЫ ВРАЧЕЙ ==========
-    def create_appointment(self, user_id, appointment_data):
-        """Создание новой записи к врачу"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO appointments (user_id, title, start_time, end_time, doctor, specialty, location, status, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, 
-              appointment_data['title'], appointment_data['start_time'], appointment_data['end_time'],
-              appointment_data.get('doctor'), appointment_data.get('specialty'),
-              appointment_data.get('location'), appointment_data.get('status', 'scheduled'),
-              appointment_data.get('notes')))
-        
-        appointment_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+    def create_appointment(self, user_id, appointment_data, allow_overlap=False):
+        """Создание новой записи к врачу (recurrence - правило повторения серии).
+        
+        Пересечение с другими записями - AppointmentConflict, если не allow_overlap.
+        """
+        rrule, series_end = recurrence_values(
+            appointment_data, appointment_data['start_time'], appointment_data['end_time'])
+        
+        # Проверка пересечений и вставка - в одной транзакции
+        def insert(conn):
+            cursor = conn.cursor()
+            
+            if not allow_overlap:
+                self._check_conflicts(conn, user_id, appointment_data, rrule)
+            
+            cursor.execute('''
+                INSERT INTO appointments (user_id, title, start_time, end_time, doctor, specialty, location, status, notes,
+                                          rrule, series_end)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, 
+                  appointment_data['title'], appointment_data['start_time'], appointment_data['end_time'],
+                  appointment_data.get('doctor'), appointment_data.get('specialty'),
+                  appointment_data.get('location'), appointment_data.get('status', 'scheduled'),
+                  appointment_data.get('notes'), rrule, series_end))
+            
+            return cursor.lastrowid
+        
+        appointment_id = self._user_writes(user_id).execute(insert)
         
         return self.get_appointment_by_id(appointment_id)
     
     def get_appointments_by_user(self, user_id, limit=None, offset=None):
         """Получение всех записей пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        query = 'SELECT * FROM appointments WHERE user_id = ? ORDER BY start_time DESC'
-        params = [user_id]
-        
-        if limit:
-            query += ' LIMIT ?'
-            params.append(limit)
-        if offset:
-            query += ' OFFSET ?'
-            params.append(offset)
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+        with self._user_connection(user_id) as conn:
+            cursor = conn.cursor()
+            
+            query = 'SELECT * FROM appointments WHERE user_id = ? ORDER BY start_time DESC'
+            params = [user_id]
+            
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
+            if offset:
+                query += ' OFFSET ?'
+                params.append(offset)
+            
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
         
         return [dict(row) for row in rows]
     
+    def get_appointments_page(self, user_id, limit=None, cursor=None):
+        """Страница записей пользователя по курсору (start_time, id)"""
+        with self._user_connection(user_id) as conn:
+            rows, next_cursor = fetch_page(conn, 'appointments', user_id, limit, cursor)
+        
+        return {'items': [dict(row) for row in rows], 'next_cursor': next_cursor}
+    
+    def get_appointments_in_window(self, user_id, start, end):
+        """События FullCalendar (с повторениями серий), пересекающиеся с окном [start, end)"""
+        window_start, window_end = parse_window(start, end)
+        with self._user_connection(user_id) as conn:
+            return window_events(conn, user_id, window_start, window_end)
+    
+    def _check_conflicts(self, conn, user_id, appointment_data, rrule, exdates=None, exclude_id=None):
+        """AppointmentConflict, если время приема занято другими записями"""
+        intervals = booking_intervals(appointment_data['start_time'], appointment_data['end_time'],
+                                      rrule, exdates)
+        conflicts = find_conflicts(conn, user_id, intervals, exclude_id)
+        if conflicts:
+            raise AppointmentConflict(conflicts)
+    
+    def get_free_slots(self, user_id, start, end, duration_minutes=30, day_start=None, day_end=None):
+        """Свободные промежутки не короче duration_minutes в окне [start, end); часы дня - 'ЧЧ:ММ'"""
+        range_start, range_end = parse_window(start, end)
+        with self._user_connection(user_id) as conn:
+            return free_slots(conn, user_id, range_start, range_end, timedelta(minutes=duration_minutes),
+                              parse_day_time(day_start), parse_day_time(day_end))
+    
     def get_appointment_by_id(self, appointment_id):
         """Получение записи по ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM appointments WHERE id = ?', (appointment_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self._row_connection(appointment_id) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT * FROM appointments WHERE id = ?', (appointment_id,))
+            row = cursor.fetchone()
         
         if row:
             return dict(row)
         return None
     
-    def update_appointment(self, appointment_id, user_id, appointment_data):
-        """Обновление записи к врачу"""
+    def update_appointment(self, appointment_id, user_id, appointment_data, allow_overlap=False):
+        """Обновление записи к врачу (пересечения - как в create_appointment)"""
         # Проверяем, что запись принадлежит пользователю
         appointment = self.get_appointment_by_id(appointment_id)
         if not appointment or appointment['user_id'] != user_id:
             return None
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        # Правка всей серии: правило из данных или прежнее
+        if 'recurrence' not in appointment_data:
+            appointment_data = dict(appointment_data, recurrence=appointment['rrule'])
+        rrule, series_end = recurrence_values(
+            appointment_data, appointment_data['start_time'], appointment_data['end_time'])
         
-        cursor.execute('''
-            UPDATE appointments 
-            SET title = ?, start_time = ?, end_time = ?, doctor = ?, specialty = ?, location = ?, status = ?, notes = ?
-            WHERE id = ? AND user_id = ?
-        ''', (appointment_data['title'], appointment_data['start_time'], appointment_data['end_time'],
-              appointment_data.get('doctor'), appointment_data.get('specialty'),
-              appointment_data.get('location'), appointment_data.get('status'),
-              appointment_data.get('notes'), appointment_id, user_id))
+        def update(conn):
+            cursor = conn.cursor()
+            
+            if not allow_overlap:
+                self._check_conflicts(conn, user_id, appointment_data, rrule,
+                                      exdates=appointment['exdates'], exclude_id=appointment_id)
+            
+            cursor.execute('''
+                UPDATE appointments 
+                SET title = ?, start_time = ?, end_time = ?, doctor = ?, specialty = ?, location = ?, status = ?, notes = ?,
+                    rrule = ?, series_end = ?
+                WHERE id = ? AND user_id = ?
+            ''', (appointment_data['title'], appointment_data['start_time'], appointment_data['end_time'],
+                  appointment_data.get('doctor'), appointment_data.get('specialty'),
+                  appointment_data.get('location'), appointment_data.get('status'),
+                  appointment_data.get('notes'), rrule, series_end, appointment_id, user_id))
         
-        conn.commit()
-        conn.close()
+        self._row_writes(appointment_id).execute(update)
         
         return self.get_appointment_by_id(appointment_id)
     
@@ -409,56 +442,57 @@ class Database:
         if not appointment or appointment['user_id'] != user_id:
             return False
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM appointments WHERE id = ? AND user_id = ?', (appointment_id, user_id))
-        deleted = cursor.rowcount > 0
-        
-        conn.commit()
-        conn.close()
+        deleted = self._row_writes(appointment_id).execute(lambda conn: conn.execute(
+            'DELETE FROM appointments WHERE id = ? AND user_id = ?', (appointment_id, user_id)
+        ).rowcount > 0)
         
         return deleted
     
+    def update_appointment_occurrence(self, appointment_id, user_id, occurrence_start, changes, scope='this',
+                                      allow_overlap=False):
+        """Изменение повторения серии (scope: this/following); id записи с изменениями"""
+        def update(conn):
+            # Серия перечитывается под блокировкой записи (см. recurrence.get_series)
+            master = get_series(conn, appointment_id, user_id)
+            if master is None:
+                return None
+            new_id = edit_occurrence(conn, master, occurrence_start, changes, scope)
+            if not allow_overlap:
+                # Пересечения - с уже записанной правкой, без ее собственной серии
+                row = conn.execute('SELECT * FROM appointments WHERE id = ?', (new_id,)).fetchone()
+                self._check_conflicts(conn, user_id, row, row['rrule'], exdates=row['exdates'],
+                                      exclude_id=row['series_id'] or row['id'])
+            return new_id
+        
+        new_id = self._row_writes(appointment_id).execute(update)
+        
+        return self.get_appointment_by_id(new_id) if new_id is not None else None
+    
+    def delete_appointment_occurrence(self, appointment_id, user_id, occurrence_start, scope='this'):
+        """Удаление повторения серии (scope: this/following)"""
+        def remove(conn):
+            master = get_series(conn, appointment_id, user_id)
+            if master is None:
+                return False
+            delete_occurrence(conn, master, occurrence_start, scope)
+            return True
+        
+        return self._row_writes(appointment_id).execute(remove)
+    
     # ========== СТАТИСТИКА ==========
     def get_user_stats(self, user_id):
         """Получение статистики пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Количество анализов
-        cursor.execute('SELECT COUNT(*) FROM analyses WHERE user_id = ?', (user_id,))
-        total_analyses = cursor.fetchone()[0]
-        
-        # Количество отклонений от нормы
-        cursor.execute('''
-            SELECT COUNT(*) FROM analyses 
-            WHERE user_id = ? AND (
-                (CAST(result AS REAL) < norm_min) OR 
-                (CAST(result AS REAL) > norm_max)
-            )
-        ''', (user_id,))
-        abnormal_analyses = cursor.fetchone()[0]
-        
-        # Количество записей к врачам
-        cursor.execute('SELECT COUNT(*) FROM appointments WHERE user_id = ?', (user_id,))
-        total_appointments = cursor.fetchone()[0]
-        
-        # Предстоящие записи
-        cursor.execute('''
-            SELECT COUNT(*) FROM appointments 
-            WHERE user_id = ? AND status = 'scheduled' AND start_time > datetime('now')
-        ''', (user_id,))
-        upcoming_appointments = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return {
-            'total_analyses': total_analyses,
-            'abnormal_analyses': abnormal_analyses,
-            'total_appointments': total_appointments,
-            'upcoming_appointments': upcoming_appointments
-        }
+        with self._user_connection(user_id) as conn:
+            stats = read_stats(conn, user_id)
+            
+            # Предстоящие записи зависят от текущего времени, поэтому не хранятся в счетчиках
+            cursor = conn.execute('''
+                SELECT COUNT(*) FROM appointments 
+                WHERE user_id = ? AND status = 'scheduled' AND start_time > datetime('now')
+            ''', (user_id,))
+            stats['upcoming_appointments'] = cursor.fetchone()[0]
+        
+        return stats
     
     def get_recent_analyses(self, user_id, limit=5):
         """Получение последних анализов"""
@@ -466,18 +500,17 @@ class Database:
     
     def get_upcoming_appointments(self, user_id, limit=5):
         """Получение ближайших записей"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM appointments 
-            WHERE user_id = ? AND status = 'scheduled' AND start_time > datetime('now')
-            ORDER BY start_time ASC
-            LIMIT ?
-        ''', (user_id, limit))
-        
-        rows = cursor.fetchall()
-        conn.close()
+        with self._user_connection(user_id) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT * FROM appointments 
+                WHERE user_id = ? AND status = 'scheduled' AND start_time > datetime('now')
+                ORDER BY start_time ASC
+                LIMIT ?
+            ''', (user_id, limit))
+            
+            rows = cursor.fetchall()
         
         return [dict(row) for row in rows]
 
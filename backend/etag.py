@@ -0,0 +1,65 @@
+import hashlib
+from functools import wraps
+
+from flask import request, Response
+
+import compressor
+from stats import read_version
+from streaming import wants_ndjson
+
+
+def request_user_id():
+    """user_id из параметров запроса. Один разбор для ETag и маршрута:
+    иначе тег и тело могли бы относиться к разным пользователям"""
+    return request.args.get('user_id', 1, type=int)
+
+
+def make_etag(user_id, version):
+    """Строгий ETag: версия данных пользователя + маршрут, параметры запроса
+    и представление.
+
+    Разные параметры (страница, окно календаря, формат) дают разные тела,
+    поэтому входят в тег. Порядок параметров не важен. Тот же адрес с
+    Accept: application/x-ndjson отдает NDJSON - у него свой тег.
+    """
+    args = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    representation = 'ndjson' if wants_ndjson() else 'json'
+    variant = hashlib.sha1(f'{request.path}?{args}#{representation}'.encode('utf-8')).hexdigest()[:16]
+    return f'u{user_id}-v{version}-{variant}'
+
+
+def conditional(get_conn):
+    """Декоратор GET-маршрута со списком данных пользователя.
+
+    get_conn(user_id) - соединение с БД, где лежат данные пользователя (его шард).
+
+    Перед запросом списка читается только версия (поиск по первичному
+    ключу user_stats). Совпал If-None-Match - ответ 304 без тела; есть
+    сжатое тело для этого ETag (compressor.py) - оно; иначе маршрут
+    выполняется и ответ получает ETag.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = request_user_id()
+            etag = make_etag(user_id, read_version(get_conn(user_id), user_id))
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                # Данные не менялись, а тело уже сжималось: версия прочитана выше,
+                # запрос списка, сериализация и сжатие пропускаются
+                response = compressor.cached_response(etag)
+                if response is None:
+                    response = view(*args, **kwargs)
+                    if isinstance(response, tuple) or response.status_code != 200:
+                        return response
+            # Сжатое тело побайтно отличается от исходного: тег слабый
+            response.set_etag(etag, weak='Content-Encoding' in response.headers)
+            # Кэш браузера переспрашивает сервер при каждом обращении
+            response.headers['Cache-Control'] = 'private, no-cache'
+            # Тело (и тег) зависит от Accept: JSON или NDJSON
+            response.vary.add('Accept')
+            return response
+        return wrapper
+    return decorator
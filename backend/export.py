@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import zipfile
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import Config
+
+EXPORT_TABLES = ('users', 'analyses', 'appointments')
+EXPORT_FORMATS = ('json', 'csv', 'zip')
+
+# Эти колонки в выгрузку не попадают
+SECRET_COLUMNS = {'password', 'password_hash'}
+
+# Хронологический порядок: его дают индексы (user_id, дата) без сортировки
+TABLE_ORDER = {
+    'analyses': 'date, id',
+    'appointments': 'start_time, id',
+}
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv; charset=utf-8',
+    'zip': 'application/zip',
+}
+
+
+def _table_query(table):
+    if table == 'users':
+        return 'SELECT * FROM users WHERE id = ?'
+    return f'SELECT * FROM {table} WHERE user_id = ? ORDER BY {TABLE_ORDER[table]}'
+
+
+def iter_table(conn, table, user_id, batch_size=None):
+    """(колонки, пачка строк) для таблицы пользователя через fetchmany"""
+    batch_size = batch_size or Config.STREAM_BATCH_SIZE
+    cursor = conn.execute(_table_query(table), (user_id,))
+    columns = [column[0] for column in cursor.description]
+    keep = [i for i, name in enumerate(columns) if name not in SECRET_COLUMNS]
+    columns = [columns[i] for i in keep]
+
+    empty = True
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        empty = False
+        yield columns, [[row[i] for i in keep] for row in rows]
+    if empty:
+        yield columns, []
+
+
+@contextmanager
+def _snapshot(pool):
+    """Соединение с открытой транзакцией чтения: все таблицы из одного снимка"""
+    with pool.connection() as conn:
+        conn.execute('BEGIN')
+        yield conn
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Буфер без seek: zipfile пишет в него, генератор забирает байты"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _csv_lines(columns, rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def iter_csv(pool, user_id, table, data_pool=None):
+    """Одна таблица в CSV"""
+    with _snapshot(pool if table == 'users' else data_pool or pool) as conn:
+        header = True
+        for columns, rows in iter_table(conn, table, user_id):
+            yield _csv_lines(columns, rows, header)
+            header = False
+
+
+def iter_json(pool, user_id, data_pool=None):
+    """Все таблицы пользователя одним JSON-объектом"""
+    with _snapshot(data_pool or pool) as conn, pool.connection() as directory:
+        yield ('{"exported_at": %s' % json.dumps(datetime.now().isoformat())).encode('utf-8')
+        for table in EXPORT_TABLES:
+            if table == 'users':
+                user = None
+                for columns, rows in iter_table(directory, table, user_id):
+                    if rows:
+                        user = dict(zip(columns, rows[0]))
+                yield (', "user": %s' % json.dumps(user)).encode('utf-8')
+                continue
+
+            yield (', "%s": [' % table).encode('utf-8')
+            first = True
+            for columns, rows in iter_table(conn, table, user_id):
+                if not rows:
+                    continue
+                chunk = ', '.join(json.dumps(dict(zip(columns, row))) for row in rows)
+                yield ((', ' if not first else '') + chunk).encode('utf-8')
+                first = False
+            yield b']'
+        yield b'}'
+
+
+def iter_zip(pool, user_id, data_pool=None):
+    """ZIP с отдельным CSV на каждую таблицу; архив пишется потоком"""
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with _snapshot(data_pool or pool) as conn, pool.connection() as directory:
+            for table in EXPORT_TABLES:
+                with archive.open(f'{table}.csv', 'w') as member:
+                    header = True
+                    source = directory if table == 'users' else conn
+                    for columns, rows in iter_table(source, table, user_id):
+                        member.write(_csv_lines(columns, rows, header))
+                        header = False
+                        data = buffer.drain()
+                        if data:
+                            yield data
+    yield buffer.drain()
+
+
+def gzip_chunks(chunks, level=6):
+    """Сжатие gzip на лету, без буферизации всего ответа"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(pool, user_id, fmt, table='analyses', compress=False, data_pool=None):
+    """Генератор байтов выгрузки, тип содержимого и имя файла.
+
+    pool - справочная БД (строка users), data_pool - шард с анализами и
+    приемами пользователя (по умолчанию та же БД).
+    """
+    if fmt == 'json':
+        chunks = iter_json(pool, user_id, data_pool)
+        filename = 'medical-record.json'
+    elif fmt == 'csv':
+        chunks = iter_csv(pool, user_id, table, data_pool)
+        filename = f'{table}.csv'
+    else:
+        chunks = iter_zip(pool, user_id, data_pool)
+        filename = 'medical-record.zip'
+
+    content_type = CONTENT_TYPES[fmt]
+    if compress:
+        chunks = gzip_chunks(chunks)
+        content_type = 'application/gzip'
+        filename += '.gz'
+    return chunks, content_type, filename
@@ -0,0 +1,15 @@
+"""Настройки gunicorn из Config (pip install gunicorn).
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Приложение импортируется в каждом воркере после fork (preload_app выключен),
+поэтому соединения с БД и потоки bcrypt у воркеров свои.
+"""
+from config import Config
+
+bind = f'{Config.SERVER_HOST}:{Config.SERVER_PORT}'
+workers = Config.SERVER_WORKERS
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+preload_app = False
@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+
+from config import Config
+from results import classify_result, parse_number
+
+# Колонки CSV-выгрузки лаборатории (первая строка - заголовок)
+CSV_FIELDS = ('type', 'date', 'result', 'unit', 'norm_min', 'norm_max', 'doctor', 'notes')
+
+INSERT_ANALYSIS = '''
+    INSERT INTO analyses (user_id, type, date, result, unit, norm_min, norm_max, doctor, notes,
+                          result_value, is_abnormal)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class BatchTooLarge(ValueError):
+    """В пакете больше записей, чем разрешено"""
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def validate_analysis(item):
+    """Проверка одного анализа: (параметры для INSERT без user_id, None) или (None, ошибка)"""
+    if not isinstance(item, dict):
+        return None, 'Ожидается объект анализа'
+
+    for field in ('type', 'date', 'result'):
+        if _text(item.get(field)) is None:
+            return None, f'Отсутствует обязательное поле: {field}'
+
+    date = _text(item['date'])
+    try:
+        datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        return None, f'Некорректная дата: {date} (ожидается ГГГГ-ММ-ДД)'
+
+    norms = []
+    for field in ('norm_min', 'norm_max'):
+        raw = item.get(field)
+        if _text(raw) is None:
+            norms.append(None)
+            continue
+        number = parse_number(raw)
+        if number is None:
+            return None, f'Поле {field} должно быть числом'
+        norms.append(number)
+    norm_min, norm_max = norms
+    if norm_min is not None and norm_max is not None and norm_min > norm_max:
+        return None, 'norm_min больше norm_max'
+
+    result = _text(item['result'])
+    result_value, is_abnormal = classify_result(result, norm_min, norm_max)
+    return (
+        _text(item['type']), date, result, _text(item.get('unit')),
+        norm_min, norm_max, _text(item.get('doctor')), _text(item.get('notes')),
+        result_value, is_abnormal
+    ), None
+
+
+def insert_analyses(conn, user_id, rows):
+    """Вставка проверенных строк одним executemany; возвращает их id по порядку"""
+    if not rows:
+        return []
+    conn.executemany(INSERT_ANALYSIS, [(user_id, *row) for row in rows])
+    # Внутри одной транзакции AUTOINCREMENT выдает id подряд
+    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    first_id = last_id - len(rows) + 1
+    return list(range(first_id, last_id + 1))
+
+
+def ingest_batch(write, user_id, items, strict=False):
+    """Проверка и вставка панели анализов в одной транзакции.
+
+    write(job) выполняет job(conn) транзакцией записи (очередь записи
+    шарда пользователя); проверка идет до нее. Возвращает результат по каждому элементу в исходном порядке. При strict
+    одна ошибка отменяет весь пакет.
+    """
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        raise BatchTooLarge(f'Не больше {Config.BATCH_MAX_ITEMS} анализов за раз')
+
+    results = []
+    rows = []
+    positions = []
+    for index, item in enumerate(items):
+        row, error = validate_analysis(item)
+        if error:
+            results.append({'index': index, 'success': False, 'message': error})
+        else:
+            results.append(None)
+            rows.append(row)
+            positions.append(index)
+
+    if strict and len(rows) != len(items):
+        for index in positions:
+            results[index] = {'index': index, 'success': False,
+                              'message': 'Пакет отклонен из-за ошибок в других записях'}
+        return results
+
+    ids = write(lambda conn: insert_analyses(conn, user_id, rows)) if rows else []
+
+    for index, analysis_id in zip(positions, ids):
+        results[index] = {'index': index, 'success': True, 'id': analysis_id}
+    return results
+
+
+def iter_csv_items(stream):
+    """Анализы из CSV-потока по одной строке (разделитель , или ;)"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    header = text.readline()
+    if not header:
+        return
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    fieldnames = [name.strip().lower() for name in next(csv.reader([header], delimiter=delimiter))]
+    missing = {'type', 'date', 'result'} - set(fieldnames)
+    if missing:
+        raise ValueError(f'В заголовке CSV нет колонок: {", ".join(sorted(missing))}')
+
+    for row in csv.DictReader(text, fieldnames=fieldnames, delimiter=delimiter):
+        yield {field: row.get(field) for field in CSV_FIELDS}
+
+
+def _spooled_chunks(spool, chunk_size):
+    spool.seek(0)
+    chunk = []
+    for line in spool:
+        chunk.append(tuple(json.loads(line)))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    yield chunk
+
+
+def ingest_csv(write, user_id, stream, chunk_size=None):
+    """Потоковая загрузка CSV, в памяти не больше chunk_size строк.
+
+    Сначала весь файл читается и проверяется, проверенные строки копятся во
+    временном файле: медленная загрузка не держит блокировку записи SQLite.
+    Затем они вставляются кусками одним заданием write(job) - в одной
+    короткой транзакции записи, как в ingest_batch. Возвращает
+    число вставленных строк и ошибки (номер строки файла, сообщение), не
+    больше BATCH_MAX_ERRORS.
+    """
+    chunk_size = chunk_size or Config.BATCH_CHUNK_SIZE
+    errors = []
+    error_count = 0
+
+    with tempfile.SpooledTemporaryFile(max_size=Config.BATCH_SPOOL_MEMORY, mode='w+',
+                                       encoding='utf-8') as spool:
+        # Строка 1 - заголовок
+        for line_no, item in enumerate(iter_csv_items(stream), start=2):
+            row, error = validate_analysis(item)
+            if error:
+                error_count += 1
+                if len(errors) < Config.BATCH_MAX_ERRORS:
+                    errors.append({'line': line_no, 'message': error})
+                continue
+            spool.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+        def insert(conn):
+            return sum(len(insert_analyses(conn, user_id, chunk))
+                       for chunk in _spooled_chunks(spool, chunk_size))
+
+        inserted = write(insert)
+
+    return {'inserted': inserted, 'failed': error_count, 'errors': errors}
@@ -0,0 +1,96 @@
+"""Обслуживание БД.
+
+    python manage.py migrate   - применить недостающие миграции
+    python manage.py status    - версия схемы в БД и в коде
+    python manage.py seed      - демо-пользователь demo@example.com / demo123
+
+    python manage.py shards status                 - пользователи и строки по шардам
+    python manage.py shards rebalance [--dry-run]  - перенос пользователей по кольцу DB_SHARDS
+    python manage.py shards maintain <задача> [--jobs N] - задача на всех БД параллельно
+"""
+import argparse
+import sys
+
+from config import Config
+from pool import get_pool
+from migrations import migrate, schema_version, LATEST_VERSION, MigrationError
+from seed import seed_demo, DEMO_EMAIL
+from sharding import ShardMap, MAINTENANCE_TASKS, shard_status, rebalance, maintain
+
+
+def shards_command(args):
+    shards = ShardMap(args.db)
+    if args.action == 'status':
+        print(f'Шардов настроено: {shards.count}')
+        for index, info in shard_status(shards).items():
+            name = 'справочная' if index == 0 else f'шард {index}'
+            print(f'{name}: пользователей {info["users"]}, анализов {info["analyses"]}, '
+                  f'приемов {info["appointments"]} ({info["path"]})')
+        return 0
+
+    if args.action == 'rebalance':
+        def progress(user_id, source, target, moved):
+            print(f'user_id={user_id}: {source} -> {target}, строк {moved}')
+
+        plan = rebalance(shards, dry_run=args.dry_run, progress=progress)
+        if args.dry_run:
+            for user_id, source, target in plan:
+                print(f'user_id={user_id}: {source} -> {target}')
+        print(f'Переносов: {len(plan)}' + (' (не выполнялись)' if args.dry_run else ''))
+        return 0
+
+    if args.task not in MAINTENANCE_TASKS:
+        print(f'Задача: {", ".join(MAINTENANCE_TASKS)}')
+        return 2
+    failed = 0
+    for index, result in maintain(shards, args.task, args.jobs).items():
+        if isinstance(result, Exception):
+            failed += 1
+        print(f'{index}: {result!r}')
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Обслуживание БД')
+    parser.add_argument('command', choices=['migrate', 'status', 'seed', 'shards'])
+    parser.add_argument('action', nargs='?', choices=['status', 'rebalance', 'maintain'],
+                        help='для shards')
+    parser.add_argument('task', nargs='?', help='для shards maintain')
+    parser.add_argument('--db', default=Config.DATABASE, help='путь к файлу БД')
+    parser.add_argument('--dry-run', action='store_true', help='shards rebalance: только план')
+    parser.add_argument('--jobs', type=int, help='shards maintain: параллельных задач')
+    args = parser.parse_args(argv)
+
+    if args.command == 'shards':
+        if not args.action:
+            parser.error('укажите действие: status, rebalance или maintain')
+        return shards_command(args)
+
+    with get_pool(args.db).connection() as conn:
+        if args.command == 'status':
+            current = schema_version(conn)
+            print(f'Версия схемы: {current}, последняя: {LATEST_VERSION}')
+            return 0 if current >= LATEST_VERSION else 1
+
+        try:
+            applied = migrate(conn)
+        except MigrationError as e:
+            print(f'Миграция не применена: {e}', file=sys.stderr)
+            return 1
+        for version, description in applied:
+            print(f'Миграция {version}: {description}')
+
+        if args.command == 'seed':
+            user_id = seed_demo(conn)
+            conn.commit()
+            if user_id is None:
+                print(f'{DEMO_EMAIL} уже существует')
+            else:
+                print(f'Создан {DEMO_EMAIL} (id={user_id})')
+        else:
+            print(f'Схема актуальна (версия {LATEST_VERSION})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""Метрики запросов и SQL в формате Prometheus (METRICS_ENABLED=1).
+
+    http_request_duration_seconds{method, route, status}   - время обработки
+    http_request_queries{route}                            - SQL-запросов на HTTP-запрос (N+1)
+    db_query_duration_seconds{statement}                   - время выполнения и выборки
+    db_rows_total{statement}                               - возвращено строк
+    db_method_duration_seconds{method}                     - методы Database
+
+Соединения пула создаются с фабрикой InstrumentedConnection: ее курсор
+замеряет execute и все fetch одного запроса, а число строк и время
+записываются, когда выборка закончена (или курсор закрыт). Текст запроса
+сводится к шаблону (литералы и списки параметров заменены), чтобы у
+метки statement было ограниченное число значений.
+
+К ответу добавляется заголовок Server-Timing (db - время SQL и число
+запросов, app - весь запрос), его видно во вкладке Network браузера.
+Метрики считаются в каждом процессе отдельно: при pre-fork запуске
+/metrics показывает воркер, принявший запрос.
+
+Тот же замер питает журнал медленных запросов (SLOW_QUERY_MS, см.
+queryplan.py). Если выключено и то и другое, соединения обычные,
+обработчики Flask не регистрируются, /metrics отвечает 404.
+"""
+import contextvars
+import functools
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+import queryplan
+from config import Config
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Учет SQL текущего HTTP-запроса (None вне запроса, например в потоке-писателе)
+_request = contextvars.ContextVar('metrics_request', default=None)
+
+
+class _RequestStats:
+    __slots__ = ('started', 'queries', 'db_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# ========== ХРАНЕНИЕ ==========
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # значения меток -> [счетчики корзин..., +Inf, сумма]
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), values):
+                cumulative += count
+                labels = _labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {values[-1]:.6f}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = dict(self._series)
+        for label_values, value in sorted(series.items()):
+            lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+http_duration = Histogram('http_request_duration_seconds', 'Время обработки HTTP-запроса',
+                          ('method', 'route', 'status'), DURATION_BUCKETS)
+http_queries = Histogram('http_request_queries', 'SQL-запросов на один HTTP-запрос',
+                         ('route',), QUERY_COUNT_BUCKETS)
+query_duration = Histogram('db_query_duration_seconds', 'Время SQL-запроса (выполнение и выборка)',
+                           ('statement',), DURATION_BUCKETS)
+query_rows = Counter('db_rows_total', 'Строк возвращено SQL-запросами', ('statement',))
+method_duration = Histogram('db_method_duration_seconds', 'Время методов Database',
+                            ('method',), DURATION_BUCKETS)
+
+REGISTRY = (http_duration, http_queries, query_duration, query_rows, method_duration)
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ========== SQL ==========
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTS = re.compile(r'\?(?:\s*,\s*\?)+')
+_SPACES = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """Шаблон запроса для метки: без литералов, списки (?, ?, ?) - как (?+)"""
+    text = _SPACES.sub(' ', _NUMBERS.sub('?', _STRINGS.sub('?', sql))).strip()
+    return _LISTS.sub('?+', text)[:160]
+
+
+def record_query(sql, elapsed, rows, parameters=(), conn=None):
+    label = fingerprint(sql)
+    if Config.METRICS_ENABLED:
+        query_duration.observe(elapsed, label)
+        if rows:
+            query_rows.inc(rows, label)
+        stats = _request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+    if Config.SLOW_QUERY_MS and elapsed * 1000 >= Config.SLOW_QUERY_MS:
+        queryplan.log_slow_query(conn, sql, parameters, elapsed, label)
+    if queryplan.capturing():
+        queryplan.capture(label, sql, parameters)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор с замером: запрос учитывается, когда выборка закончена"""
+    _sql = None
+    _parameters = ()
+    _elapsed = 0.0
+    _rows = 0
+
+    def _finish(self, collected=False):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            conn = None if collected else self.connection
+            record_query(sql, self._elapsed, self._rows, self._parameters, conn)
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._parameters, self._elapsed, self._rows = sql, parameters, 0.0, 0
+        try:
+            self._timed(super().execute, sql, parameters)
+        except Exception:
+            self._finish()
+            raise
+        if self.description is None:
+            self._finish()  # не SELECT: выбирать нечего
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        # executemany может получить генератор: форма параметров не запоминается
+        self._sql, self._parameters, self._elapsed, self._rows = sql, (), 0.0, 0
+        try:
+            self._timed(super().executemany, sql, seq_of_parameters)
+        finally:
+            self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # conn.execute(...).fetchone() не дочитывает выборку: учет при сборке курсора.
+        # Только время: сборка мусора может прийти в чужом потоке или посреди
+        # транзакции, поэтому без соединения - EXPLAIN для журнала здесь не строится
+        self._finish(collected=True)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, все запросы которого идут через InstrumentedCursor"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            record_query('COMMIT', time.perf_counter() - started, 0)
+
+
+def connection_factory():
+    """Класс соединения для sqlite3.connect(factory=...): замер нужен метрикам,
+    журналу медленных запросов (SLOW_QUERY_MS) и проверке планов"""
+    if Config.METRICS_ENABLED or Config.SLOW_QUERY_MS or queryplan.capturing():
+        return InstrumentedConnection
+    return sqlite3.Connection
+
+
+# ========== FLASK И DATABASE ==========
+def init_app(app):
+    """Замер запросов, заголовок Server-Timing и маршрут /metrics"""
+    if not Config.METRICS_ENABLED:
+        return
+
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request():
+        g.metrics_token = _request.set(_RequestStats())
+
+    @app.after_request
+    def finish_request(response):
+        stats = _request.get()
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_duration.observe(elapsed, request.method, route, str(response.status_code))
+        http_queries.observe(stats.queries, route)
+        if Config.METRICS_SERVER_TIMING:
+            response.headers['Server-Timing'] = (
+                f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+                f'app;dur={elapsed * 1000:.2f}'
+            )
+        return response
+
+    @app.teardown_request
+    def reset_request(exception=None):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            _request.reset(token)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """Метрики процесса в текстовом формате Prometheus"""
+        return Response(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def instrument_methods(cls):
+    """Замер публичных методов класса (db_method_duration_seconds); без METRICS_ENABLED - как есть"""
+    if not Config.METRICS_ENABLED:
+        return cls
+
+    def timed(name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                method_duration.observe(time.perf_counter() - started, name)
+        return wrapper
+
+    for name, method in list(vars(cls).items()):
+        if not name.startswith('_') and callable(method):
+            setattr(cls, name, timed(f'{cls.__name__}.{name}', method))
+    return cls
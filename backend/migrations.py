@@ -0,0 +1,188 @@
+"""Версионные миграции схемы по PRAGMA user_version.
+
+Каждая миграция - (версия, описание, функция(conn)). Недостающие
+применяются по порядку в одной транзакции BEGIN IMMEDIATE, после каждой
+user_version сдвигается. Если схема актуальна, migrate() - это одно
+чтение PRAGMA.
+
+Миграции написаны идемпотентно (IF NOT EXISTS, проверка колонок), поэтому
+БД, созданные до появления версий (user_version = 0), доводятся до
+актуальной схемы теми же шагами.
+"""
+import bcrypt
+
+from config import Config
+from results import migrate_result_columns
+from recurrence import migrate_recurrence_columns
+from usercache import ensure_user_version
+from stats import ensure_stats_schema
+from revocation import ensure_revocation_schema
+from search import ensure_search_schema
+
+
+def _base_tables(conn):
+    """Схема database.py до появления миграций; все новое - следующими шагами"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            name TEXT NOT NULL,
+            birth_date TEXT,
+            blood_type TEXT,
+            allergies TEXT,
+            chronic_diseases TEXT,
+            emergency_contact TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analyses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            date DATE NOT NULL,
+            result TEXT NOT NULL,
+            unit TEXT,
+            norm_min REAL,
+            norm_max REAL,
+            doctor TEXT,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME NOT NULL,
+            doctor TEXT,
+            specialty TEXT,
+            location TEXT,
+            status TEXT DEFAULT 'scheduled',
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_analyses_user_date ON analyses(user_id, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_user_date ON appointments(user_id, start_time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
+
+
+def _series_window_indexes(conn):
+    """Графики по типу анализа и оконные запросы календаря (по концу приема)"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_analyses_user_type_date ON analyses(user_id, type, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_user_end ON appointments(user_id, end_time)')
+
+
+class MigrationError(RuntimeError):
+    """Данные не позволяют применить миграцию без потерь"""
+
+
+# Колонки профиля, которых не было в схеме users из app.py
+PROFILE_COLUMNS = ('birth_date', 'blood_type', 'allergies', 'chronic_diseases', 'emergency_contact')
+
+
+def _hash_password(password):
+    salt = bcrypt.gensalt(Config.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def _unify_users(conn):
+    """Схема users из app.py (открытый password) -> общая (password_hash).
+
+    Хэш считается из password прямо здесь, bcrypt.hashpw, а не через пул
+    passwords.py: тот ограничен запросами входа и при нехватке мест
+    прервал бы миграцию PasswordPoolBusy. Если у пользователя нет ни хэша, ни пароля,
+    войти он после миграции не сможет - миграция прерывается (MigrationError)
+    и БД остается прежней.
+    """
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    for name in ('password_hash', *PROFILE_COLUMNS):
+        if name not in columns:
+            conn.execute(f'ALTER TABLE users ADD COLUMN {name} TEXT')
+
+    if 'password' in columns:
+        rows = conn.execute('''
+            SELECT id, password FROM users
+            WHERE (password_hash IS NULL OR password_hash = '') AND password <> ''
+        ''').fetchall()
+        conn.executemany(
+            'UPDATE users SET password_hash = ? WHERE id = ?',
+            [(_hash_password(row[1]), row[0]) for row in rows]
+        )
+
+    missing = [row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE password_hash IS NULL OR password_hash = '' ORDER BY id"
+    )]
+    if missing:
+        shown = ', '.join(map(str, missing[:10])) + (' ...' if len(missing) > 10 else '')
+        raise MigrationError(
+            f'У {len(missing)} пользователей нет ни password_hash, ни пароля (id: {shown}); '
+            'задайте им пароль и повторите миграцию'
+        )
+
+    if 'password' in columns:
+        conn.execute('ALTER TABLE users DROP COLUMN password')
+
+
+def _user_shard(conn):
+    """Шард с данными пользователя (NULL - справочная БД), см. sharding.py"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    if 'shard' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN shard INTEGER')
+
+
+def _upcoming_index(conn):
+    """Ближайшие приемы (status = 'scheduled' по start_time) без просмотра всех приемов"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_user_status_start '
+                 'ON appointments(user_id, status, start_time)')
+
+
+MIGRATIONS = (
+    (1, 'Базовые таблицы и индексы', _base_tables),
+    (2, 'Общая схема users: password_hash и профиль', _unify_users),
+    (3, 'Числовой результат и признак отклонения анализа', migrate_result_columns),
+    (4, 'Повторяющиеся приемы', migrate_recurrence_columns),
+    (5, 'Версия строки пользователя', ensure_user_version),
+    (6, 'Счетчики дашборда и версия данных', lambda conn: ensure_stats_schema(conn, rebuild=True)),
+    (7, 'Отозванные JWT', ensure_revocation_schema),
+    (8, 'Полнотекстовый поиск (FTS5)', ensure_search_schema),
+    (9, 'Шард пользователя', _user_shard),
+    (10, 'Индекс ближайших приемов', _upcoming_index),
+    (11, 'Индексы графиков и календаря', _series_window_indexes),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Применение недостающих миграций; список примененных (версия, описание)"""
+    if schema_version(conn) >= LATEST_VERSION:
+        return []
+
+    applied = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Другой процесс мог успеть раньше: версия перечитывается под блокировкой
+        current = schema_version(conn)
+        for version, description, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            apply(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            applied.append((version, description))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
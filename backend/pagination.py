@@ -0,0 +1,66 @@
+import base64
+import json
+
+from config import Config
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или относится к другому списку"""
+
+
+# Ключ сортировки для каждого списка: (колонка, id) покрывается индексом (user_id, колонка)
+KEYSETS = {
+    'analyses': 'date',
+    'appointments': 'start_time',
+}
+
+
+def clamp_limit(limit):
+    """Размер страницы в границах, заданных сервером"""
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return Config.PAGE_SIZE_DEFAULT
+    return max(1, min(limit, Config.PAGE_SIZE_MAX))
+
+
+def encode_cursor(table, key, row_id):
+    """Непрозрачный курсор по последней строке страницы"""
+    payload = json.dumps([table, key, row_id], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(table, cursor):
+    """Разбор курсора в (ключ, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_table, key, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Некорректный курсор')
+    if cursor_table != table or not isinstance(row_id, int):
+        raise InvalidCursor('Курсор не относится к этому списку')
+    return key, row_id
+
+
+def fetch_page(conn, table, user_id, limit=None, cursor=None):
+    """Страница записей пользователя от новых к старым по ключу (колонка, id)"""
+    sort_col = KEYSETS[table]
+    limit = clamp_limit(limit)
+
+    query = f'SELECT * FROM {table} WHERE user_id = ?'
+    params = [user_id]
+    if cursor:
+        key, row_id = decode_cursor(table, cursor)
+        query += f' AND ({sort_col}, id) < (?, ?)'
+        params.extend([key, row_id])
+    query += f' ORDER BY {sort_col} DESC, id DESC LIMIT ?'
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    params.append(limit + 1)
+
+    rows = conn.execute(query, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(table, last[sort_col], last['id'])
+    return rows, next_cursor
@@ -0,0 +1,95 @@
+"""Хэширование паролей bcrypt в отдельном ограниченном пуле потоков.
+
+bcrypt отпускает GIL, поэтому хэширование идет параллельно обработке
+запросов, но занимает не больше BCRYPT_WORKERS ядер. Если в очереди уже
+BCRYPT_QUEUE_SIZE задач, новая сразу отклоняется PasswordPoolBusy
+(ответ 503), а не ждет, блокируя поток запроса.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import bcrypt
+
+from config import Config
+
+
+class PasswordPoolBusy(Exception):
+    """Пул хэширования занят: запрос нужно повторить позже"""
+
+
+class PasswordPool:
+    def __init__(self, workers=None, queue_size=None, timeout=None, rounds=None):
+        self.workers = workers or Config.BCRYPT_WORKERS
+        self.queue_size = Config.BCRYPT_QUEUE_SIZE if queue_size is None else queue_size
+        self.timeout = timeout or Config.BCRYPT_TIMEOUT
+        self.rounds = rounds or Config.BCRYPT_ROUNDS
+        self._executor = None
+        self._lock = threading.Lock()
+        # Выполняемые + ожидающие задачи
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self.rejected = 0
+
+    def _get_executor(self):
+        # Потоки создаются при первой задаче, а не при импорте
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='bcrypt')
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordPoolBusy('Сервер перегружен, повторите попытку позже')
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordPoolBusy('Истекло время ожидания проверки пароля')
+
+    def hash(self, password):
+        """bcrypt-хэш пароля с текущей стоимостью BCRYPT_ROUNDS"""
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, password, password_hash):
+        """Совпадает ли пароль с хэшем"""
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def needs_rehash(self, password_hash):
+        """Хэш посчитан с другой стоимостью, чем задана сейчас"""
+        return hash_rounds(password_hash) != self.rounds
+
+    def reset_after_fork(self):
+        """Потоки пула не переживают fork: дочерний процесс создаст свои"""
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'rounds': self.rounds,
+            'rejected': self.rejected,
+        }
+
+
+def hash_rounds(password_hash):
+    """Стоимость из хэша вида $2b$12$...; None для нераспознанного"""
+    parts = password_hash.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+passwords = PasswordPool()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=passwords.reset_after_fork)
@@ -0,0 +1,305 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from config import Config
+from metrics import connection_factory
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+def default_pragmas():
+    """PRAGMA, применяемые к каждому новому соединению"""
+    return {
+        'journal_mode': Config.DB_JOURNAL_MODE,
+        'synchronous': Config.DB_SYNCHRONOUS,
+        'cache_size': Config.DB_CACHE_SIZE,
+        'mmap_size': Config.DB_MMAP_SIZE,
+        'busy_timeout': Config.DB_BUSY_TIMEOUT,
+    }
+
+
+class _ConnInfo:
+    __slots__ = ('created_at', 'last_used', 'uses')
+
+    def __init__(self):
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений SQLite с повторным использованием в потоке"""
+
+    def __init__(self, db_path, max_size=None, timeout=None, max_age=None,
+                 max_uses=None, health_interval=None, pragmas=None, setup=None):
+        self.db_path = db_path
+        self.max_size = max_size or Config.DB_POOL_SIZE
+        self.timeout = timeout if timeout is not None else Config.DB_POOL_TIMEOUT
+        self.max_age = max_age if max_age is not None else Config.DB_POOL_MAX_AGE
+        self.max_uses = max_uses if max_uses is not None else Config.DB_POOL_MAX_USES
+        self.health_interval = (health_interval if health_interval is not None
+                                else Config.DB_POOL_HEALTH_INTERVAL)
+        self.pragmas = pragmas if pragmas is not None else default_pragmas()
+
+        # setup(conn) выполняется один раз, до выдачи первого соединения
+        # (миграции схемы). Конструктор сам к файлу БД не обращается.
+        self.setup = setup
+        self._ready = False
+        self._setup_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = []  # LIFO: самое "теплое" соединение выдается первым
+        self._info = {}
+        self._size = 0
+        self._local = threading.local()
+        self._stats = {
+            'created': 0,
+            'acquired': 0,
+            'reused': 0,
+            'recycled': 0,
+            'discarded': 0,
+            'health_checks': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'peak_in_use': 0,
+        }
+
+    # ========== СОЗДАНИЕ И ПРОВЕРКА ==========
+    def _connect(self):
+        """Открытие нового соединения с применением PRAGMA"""
+        if not self._ready:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=connection_factory())
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            if value is None:
+                continue
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _is_healthy(self, conn, info):
+        """Проверка, что соединение можно выдать повторно"""
+        now = time.monotonic()
+        if self.max_age and now - info.created_at > self.max_age:
+            return False
+        if self.max_uses and info.uses >= self.max_uses:
+            return False
+        if self.health_interval and now - info.last_used > self.health_interval:
+            with self._lock:
+                self._stats['health_checks'] += 1
+            try:
+                conn.execute('SELECT 1').fetchone()
+            except sqlite3.Error:
+                return False
+        return True
+
+    def _discard(self, conn, recycled=False):
+        """Закрытие соединения и освобождение места в пуле"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._available:
+            self._info.pop(conn, None)
+            self._size -= 1
+            self._stats['recycled' if recycled else 'discarded'] += 1
+            self._available.notify()
+
+    # ========== ВЫДАЧА И ВОЗВРАТ ==========
+    def acquire(self):
+        """Получение соединения из пула (ждет не дольше timeout)"""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            conn = None
+            create = False
+            with self._available:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f'Нет свободных соединений ({self.max_size}) '
+                            f'в течение {self.timeout} с'
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    started = time.monotonic()
+                    self._available.wait(remaining)
+                    self._stats['wait_time_total'] += time.monotonic() - started
+
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._available:
+                        self._size -= 1
+                        self._available.notify()
+                    raise
+                info = _ConnInfo()
+                with self._lock:
+                    self._info[conn] = info
+                    self._stats['created'] += 1
+            else:
+                info = self._info[conn]
+                if not self._is_healthy(conn, info):
+                    self._discard(conn, recycled=True)
+                    continue
+                with self._lock:
+                    self._stats['reused'] += 1
+
+            if not self._ready:
+                try:
+                    self._run_setup(conn)
+                except Exception:
+                    self.release(conn)
+                    raise
+
+            info.uses += 1
+            with self._lock:
+                self._stats['acquired'] += 1
+                in_use = self._size - len(self._idle)
+                if in_use > self._stats['peak_in_use']:
+                    self._stats['peak_in_use'] = in_use
+            return conn
+
+    def _run_setup(self, conn):
+        """Однократная подготовка БД; остальные потоки ждут ее окончания"""
+        with self._setup_lock:
+            if self._ready:
+                return
+            if self.setup is not None:
+                self.setup(conn)
+            self._ready = True
+
+    def release(self, conn):
+        """Возврат соединения в пул"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._available:
+            info = self._info.get(conn)
+            if info is None:
+                return
+            info.last_used = time.monotonic()
+            self._idle.append(conn)
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """Соединение на время блока; вложенные вызовы в потоке получают то же"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self.acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self.release(conn)
+
+    def open_dedicated(self):
+        """Отдельное соединение вне лимита пула (для фонового потока-писателя,
+        который не должен ждать, пока запросы вернут соединения); закрывает вызывающий"""
+        conn = self._connect()
+        if not self._ready:
+            try:
+                self._run_setup(conn)
+            except Exception:
+                conn.close()
+                raise
+        return conn
+
+    # ========== ОБСЛУЖИВАНИЕ ==========
+    def stats(self):
+        """Статистика пула для подбора размера"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+            })
+        stats['wait_time_total'] = round(stats['wait_time_total'], 6)
+        return stats
+
+    def reset_after_fork(self):
+        """Забыть соединения родителя: в дочернем процессе их нельзя ни
+        использовать, ни закрывать (общие файловые блокировки SQLite)"""
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._setup_lock = threading.Lock()
+        self._idle = []
+        self._info = {}
+        self._size = 0
+        self._local = threading.local()
+
+    def close_all(self):
+        """Закрытие всех простаивающих соединений"""
+        with self._available:
+            idle, self._idle = self._idle, []
+            for conn in idle:
+                self._info.pop(conn, None)
+            self._size -= len(idle)
+            self._available.notify_all()
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, setup=None):
+    """Общий пул для файла БД (один на процесс); setup - см. ConnectionPool"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(key)
+        if setup is not None:
+            pool.setup = setup
+        return pool
+
+
+def _reset_pools_after_fork():
+    for pool in _pools.values():
+        pool.reset_after_fork()
+
+
+# Воркеры pre-fork сервера открывают свои соединения уже после fork
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
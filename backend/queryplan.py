@@ -0,0 +1,351 @@
+"""Планы SQL-запросов: журнал медленных запросов и проверка индексов.
+
+Журнал (SLOW_QUERY_MS > 0): запрос дольше порога пишется в логгер
+slow_query (или в файл SLOW_QUERY_LOG) с текстом, формой параметров
+(типы и длины, без значений - в них медицинские данные) и EXPLAIN QUERY
+PLAN. План для одного шаблона запроса строится один раз.
+
+Проверка планов:
+
+    python queryplan.py check [--users 50] [--verbose]
+
+создает временную БД с синтетическими пациентами (bench.population),
+проходит сценарии фронтенда через test client и методы Database, запоминая
+каждый выполненный запрос с его параметрами, и строит для всех план.
+Полный просмотр таблицы (SCAN без индекса) и временное B-дерево для
+ORDER BY / GROUP BY / DISTINCT - ошибка (код возврата 1), если запрос не
+внесен в ALLOWED_PLANS с причиной. Запросы из REQUIRED_INDEXES, кроме того,
+обязаны выполниться при проверке и использовать указанный индекс, а из
+REQUIRED_QUERIES - хотя бы один раз встретиться среди выполненных.
+"""
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+from config import Config
+
+logger = logging.getLogger('slow_query')
+
+# Шаблон запроса (начало) -> почему полный просмотр или сортировка допустимы
+ALLOWED_PLANS = {
+    'SELECT * FROM appointments WHERE user_id = :user_id AND start_time >= :start':
+        'сортируются только приемы, начатые до окна (не длиннее max_appointment_span)',
+    'SELECT ? AS kind, t.id': 'ранжирование bm25 требует сортировки найденного',
+}
+
+# Шаблон запроса (начало) -> индекс, которым он обязан пользоваться.
+# Другой индекс по user_id тоже дает план без SCAN, но читает все строки
+# пользователя - такое проверка по одним SCAN не замечает
+REQUIRED_INDEXES = {
+    'SELECT * FROM appointments WHERE user_id = ? AND status = ?': 'idx_appointments_user_status_start',
+    'SELECT COUNT(*) FROM appointments WHERE user_id = ? AND status = ?': 'idx_appointments_user_status_start',
+    'SELECT * FROM analyses WHERE user_id = ? AND (date, id) <': 'idx_analyses_user_date',
+    'SELECT * FROM appointments WHERE user_id = ? AND (start_time, id) <': 'idx_appointments_user_date',
+    'SELECT * FROM appointments WHERE user_id = :user_id AND start_time >= :start': 'idx_appointments_user_date',
+}
+
+# Фрагменты запросов, которые сценарии обязаны выполнить: без них часть
+# путей (серии приемов) прошла бы проверку, не построив ни одного плана
+REQUIRED_QUERIES = (
+    'rrule IS NOT NULL',
+)
+
+# Запросы, для которых план имеет смысл
+EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE|INSERT|REPLACE)\b', re.IGNORECASE)
+
+# Просмотры, которые не читают таблицу целиком
+HARMLESS_SCANS = ('VIRTUAL TABLE', 'CONSTANT ROW', 'SCAN (subquery', 'SCAN json_each')
+
+
+# ========== ПЛАН ==========
+def explain(conn, sql, parameters=()):
+    """Строки EXPLAIN QUERY PLAN (с отступом по вложенности)"""
+    # Обычный курсор: план не должен попадать в метрики и журнал
+    cursor = conn.cursor(sqlite3.Cursor)
+    try:
+        rows = cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+    finally:
+        cursor.close()
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, 0) + 1
+        lines.append('  ' * (depth[node_id] - 1) + detail)
+    return lines
+
+
+def plan_problems(plan):
+    """Полные просмотры и временные B-деревья в плане"""
+    problems = []
+    for line in plan:
+        detail = line.strip()
+        if detail.startswith('SCAN ') and not any(ok in detail for ok in HARMLESS_SCANS):
+            problems.append(detail)
+        elif 'USE TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def allowed(template):
+    for prefix, reason in ALLOWED_PLANS.items():
+        if template.startswith(prefix):
+            return reason
+    return None
+
+
+def required_index(template):
+    for prefix, index in REQUIRED_INDEXES.items():
+        if template.startswith(prefix):
+            return index
+    return None
+
+
+def missing_index(plan, index):
+    """Ошибка, если план не использует индекс index"""
+    if any(f' INDEX {index}' in line for line in plan):
+        return None
+    return f'не используется {index}'
+
+
+# ========== ЖУРНАЛ МЕДЛЕННЫХ ЗАПРОСОВ ==========
+def _value_shape(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, (bool, int)):
+        return 'int'
+    if isinstance(value, float):
+        return 'real'
+    if isinstance(value, str):
+        return f'text[{len(value)}]'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'blob[{len(value)}]'
+    return type(value).__name__
+
+
+def parameters_shape(parameters):
+    """Типы параметров без значений: ['int', 'text[10]'] или {'name': 'text[5]'}"""
+    if isinstance(parameters, dict):
+        return {key: _value_shape(value) for key, value in parameters.items()}
+    shapes = [_value_shape(value) for value in parameters or ()]
+    if len(shapes) > 10 and len(set(shapes)) == 1:
+        return f'[{shapes[0]} x {len(shapes)}]'
+    return shapes
+
+
+_configured = False
+
+
+def _configure_log():
+    global _configured
+    _configured = True
+    if Config.SLOW_QUERY_LOG and not logger.handlers:
+        handler = logging.FileHandler(Config.SLOW_QUERY_LOG, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(logging.WARNING)
+
+
+_plans = {}  # шаблон -> строки плана
+
+
+def _plan_for(template, conn, sql, parameters):
+    plan = _plans.get(template)
+    if plan is None:
+        try:
+            plan = tuple(explain(conn, sql, parameters))
+        except sqlite3.Error as e:
+            plan = (f'план недоступен: {e}',)
+        _plans[template] = plan
+    return plan
+
+
+def log_slow_query(conn, sql, parameters, elapsed, template):
+    """Запись медленного запроса; план - по первому вхождению шаблона"""
+    if not _configured:
+        _configure_log()
+    plan = ()
+    if conn is not None and EXPLAINABLE.match(sql):
+        plan = _plan_for(template, conn, sql, parameters)
+    logger.warning('Медленный запрос %.1f мс: %s | параметры: %s | план: %s',
+                   elapsed * 1000, ' '.join(sql.split()), parameters_shape(parameters),
+                   '; '.join(line.strip() for line in plan) or '-')
+
+
+# ========== СБОР ЗАПРОСОВ ДЛЯ ПРОВЕРКИ ==========
+_captured = None  # шаблон -> (sql, параметры) первого вхождения
+
+
+def capturing():
+    return _captured is not None
+
+
+def capture(template, sql, parameters):
+    if template not in _captured and EXPLAINABLE.match(sql):
+        _captured[template] = (sql, parameters)
+
+
+def _exercise_app(users):
+    """Сценарии фронтенда через test client (bench.traffic)"""
+    import random
+    from app import app
+    from bench import traffic
+
+    transport = traffic.TestClientTransport(app)
+    recorder = traffic.Recorder()
+    session = traffic.Session(transport, recorder, random.Random(1))
+    for user in users[:3]:
+        for scenario in traffic.SCENARIOS.values():
+            scenario(session, user)
+
+    client = app.test_client()
+    user_id = users[0]['id']
+    for path in (
+        f'/api/analyses/abnormal?user_id={user_id}',
+        f'/api/analyses/series?user_id={user_id}&type=Глюкоза',
+        f'/api/appointments?user_id={user_id}&start=2024-01-01T00:00&end=2024-02-01T00:00',
+        f'/api/appointments/free-slots?user_id={user_id}&start=2030-01-01T00:00&end=2030-01-08T00:00&duration=30',
+        f'/api/search?user_id={user_id}&q=глюкоза',
+        f'/api/export?user_id={user_id}&format=csv',
+        f'/api/export?user_id={user_id}&format=csv&table=appointments',
+        f'/api/export?user_id={user_id}&format=zip',
+    ):
+        response = client.get(path)
+        response.get_data()
+
+    # Вторая страница списков - запрос по курсору (keyset)
+    for path in (f'/api/analyses?user_id={user_id}&limit=5',
+                 f'/api/appointments?user_id={user_id}&limit=5'):
+        next_cursor = client.get(path).get_json()['next_cursor']
+        if next_cursor:
+            client.get(f'{path}&cursor={next_cursor}').get_data()
+
+    # Запись на занятое время: проверка пересечений отвечает 409
+    booked = {'user_id': user_id, 'title': 'Проверка планов',
+              'start_time': '2031-01-06T10:00', 'end_time': '2031-01-06T11:00'}
+    client.post('/api/appointments', json=booked)
+    client.post('/api/appointments', json=booked)
+    client.post('/api/appointments', json=dict(booked, start_time='2031-01-05T10:30',
+                                                end_time='2031-01-05T11:30', recurrence='FREQ=DAILY;COUNT=3'))
+
+    # Отзыв токена: запись в revoked_tokens и проверка при следующем запросе
+    from flask_jwt_extended import create_access_token
+    with app.app_context():
+        token = create_access_token(identity=str(user_id))
+    for _ in range(2):
+        client.post('/api/auth/logout', headers={'Authorization': f'Bearer {token}'})
+    return [route for route, statuses in recorder.statuses.items()
+            if any(status == 'error' or status >= 500 for status in statuses)]
+
+
+def _exercise_database(db, user_id):
+    """Методы Database, которых нет в сценариях фронтенда"""
+    from schedule import AppointmentConflict
+
+    db.get_user_by_email(db.get_user_by_id(user_id)['email'])
+    db.get_analyses_by_user(user_id)
+    page = db.get_analyses_page(user_id, limit=5)
+    db.get_analyses_page(user_id, limit=5, cursor=page['next_cursor'])
+    db.get_abnormal_analyses(user_id, limit=5)
+    db.get_analysis_series(user_id, 'Глюкоза')
+    db.get_recent_analyses(user_id)
+    db.get_appointments_by_user(user_id, limit=5)
+    page = db.get_appointments_page(user_id, limit=5)
+    db.get_appointments_page(user_id, limit=5, cursor=page['next_cursor'])
+    db.get_appointments_in_window(user_id, '2024-01-01T00:00', '2024-03-01T00:00')
+    db.get_free_slots(user_id, '2030-01-01T00:00', '2030-01-03T00:00')
+    db.get_upcoming_appointments(user_id)
+    db.get_user_stats(user_id)
+    db.search(user_id, 'анализ')
+    analysis = db.create_analysis(user_id, {'type': 'Глюкоза', 'date': '2024-05-01', 'result': '5.5'})
+    db.update_analysis(analysis['id'], user_id, {'type': 'Глюкоза', 'date': '2024-05-02', 'result': '5.6'})
+    db.delete_analysis(analysis['id'], user_id)
+    booked = {'title': 'Проверка планов', 'start_time': '2032-01-06T10:00', 'end_time': '2032-01-06T11:00'}
+    db.create_appointment(user_id, booked)
+    try:
+        db.create_appointment(user_id, booked)
+    except AppointmentConflict:
+        pass
+
+
+def check(users=30, verbose=False):
+    """Проверка планов всех выполненных запросов; число недопустимых"""
+    global _captured
+
+    workdir = tempfile.mkdtemp(prefix='queryplan-')
+    db_path = os.path.join(workdir, 'check.db')
+    # До импорта приложения: пул откроет эту БД
+    Config.DATABASE = db_path
+
+    from bench.population import generate
+    generate(db_path, users=users, years=2, seed=7)
+    _captured = {}  # с этого момента пул создает инструментированные соединения
+    try:
+        from database import Database
+        from bench.__main__ import load_users
+
+        bench_users = load_users(db_path)
+        failed_routes = _exercise_app(bench_users)
+        _exercise_database(Database(db_path), bench_users[0]['id'])
+        captured, _captured = _captured, None
+    finally:
+        _captured = None
+
+    violations = 0
+    conn = sqlite3.connect(db_path)
+    try:
+        for template, (sql, parameters) in sorted(captured.items()):
+            try:
+                plan = explain(conn, sql, parameters)
+            except sqlite3.Error as e:
+                print(f'ОШИБКА ПЛАНА {template}: {e}')
+                violations += 1
+                continue
+            problems = plan_problems(plan)
+            reason = allowed(template) if problems else None
+            index = required_index(template)
+            wrong_index = missing_index(plan, index) if index else None
+            bad = (problems and not reason) or wrong_index
+            if bad:
+                violations += 1
+                print(f'ПЛОХОЙ ПЛАН{" (" + wrong_index + ")" if wrong_index else ""}: {template}')
+            elif verbose:
+                print(f'{"допустимо (" + reason + ")" if reason else "ok"}: {template}')
+            if verbose or bad:
+                for line in plan:
+                    print(f'    {line}')
+    finally:
+        conn.close()
+
+    for prefix in REQUIRED_INDEXES:
+        if not any(template.startswith(prefix) for template in captured):
+            violations += 1
+            print(f'НЕ ВЫПОЛНЯЛСЯ: {prefix}...')
+    for fragment in REQUIRED_QUERIES:
+        if not any(fragment in template for template in captured):
+            violations += 1
+            print(f'НЕ ВЫПОЛНЯЛСЯ запрос с {fragment}')
+
+    for route in failed_routes:
+        print(f'Ошибки сервера на {route} - часть запросов могла не выполниться')
+    print(f'Запросов проверено: {len(captured)}, недопустимых планов: {violations}')
+    return violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Проверка планов SQL-запросов')
+    parser.add_argument('command', choices=['check'])
+    parser.add_argument('--users', type=int, default=30, help='синтетических пользователей')
+    parser.add_argument('--verbose', action='store_true', help='планы всех запросов')
+    args = parser.parse_args(argv)
+    return 1 if check(args.users, args.verbose) else 0
+
+
+if __name__ == '__main__':
+    # Собранные запросы живут в модуле queryplan, который импортирует metrics
+    import queryplan
+    sys.exit(queryplan.main())
@@ -0,0 +1,399 @@
+import calendar
+import json
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from config import Config
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+
+# Формат времени повторений (как у datetime-local во фронтенде)
+OCCURRENCE_FORMAT = '%Y-%m-%dT%H:%M'
+UNTIL_FORMAT = '%Y%m%dT%H%M%S'
+
+# Поля приема, которые можно менять у отдельного повторения
+EVENT_FIELDS = ('title', 'doctor', 'specialty', 'location', 'status', 'notes')
+
+
+class RuleError(ValueError):
+    """Некорректное правило повторения или повторение не из серии"""
+
+
+def parse_time(value):
+    """Время приема из БД или запроса ('2024-01-20 10:00', '2024-01-20T10:00')"""
+    try:
+        return datetime.fromisoformat(str(value).strip()).replace(tzinfo=None)
+    except ValueError:
+        raise RuleError(f'Некорректное время: {value}')
+
+
+def format_time(moment):
+    return moment.strftime(OCCURRENCE_FORMAT)
+
+
+# ========== ПРАВИЛО ==========
+def parse_rule(value):
+    """Правило из строки RRULE ('FREQ=WEEKLY;INTERVAL=2;COUNT=10') или объекта"""
+    if isinstance(value, str):
+        parts = {}
+        for part in value.strip().removeprefix('RRULE:').split(';'):
+            if not part:
+                continue
+            key, _, val = part.partition('=')
+            parts[key.strip().lower()] = val.strip()
+        value = parts
+    if not isinstance(value, dict):
+        raise RuleError('Правило повторения: строка RRULE или объект')
+
+    freq = str(value.get('freq', '')).upper()
+    if freq not in FREQUENCIES:
+        raise RuleError(f'FREQ должен быть одним из: {", ".join(FREQUENCIES)}')
+
+    try:
+        interval = int(value.get('interval') or 1)
+        count = int(value['count']) if value.get('count') not in (None, '') else None
+    except (TypeError, ValueError):
+        raise RuleError('INTERVAL и COUNT должны быть целыми числами')
+    if interval < 1 or (count is not None and count < 1):
+        raise RuleError('INTERVAL и COUNT должны быть положительными')
+
+    until = value.get('until')
+    if until:
+        until = str(until)
+        try:
+            until = datetime.strptime(until.rstrip('Z'), UNTIL_FORMAT)
+        except ValueError:
+            until = parse_time(until)
+    else:
+        until = None
+    if count is not None and until is not None:
+        raise RuleError('COUNT и UNTIL нельзя указывать вместе')
+
+    return {'freq': freq, 'interval': interval, 'count': count, 'until': until}
+
+
+def format_rule(rule):
+    """Каноническая строка RRULE для хранения"""
+    parts = [f'FREQ={rule["freq"]}', f'INTERVAL={rule["interval"]}']
+    if rule['count'] is not None:
+        parts.append(f'COUNT={rule["count"]}')
+    if rule['until'] is not None:
+        parts.append(f'UNTIL={rule["until"].strftime(UNTIL_FORMAT)}')
+    return ';'.join(parts)
+
+
+def parse_exdates(value):
+    """Исключенные повторения: JSON-массив или список -> множество datetime"""
+    if not value:
+        return set()
+    if isinstance(value, str):
+        value = json.loads(value)
+    return {parse_time(item) for item in value}
+
+
+def format_exdates(exdates):
+    return json.dumps(sorted(format_time(moment) for moment in exdates)) if exdates else None
+
+
+# ========== АРИФМЕТИКА ПОВТОРЕНИЙ ==========
+def _add_months(moment, months, day):
+    month_index = moment.month - 1 + months
+    year = moment.year + month_index // 12
+    month = month_index % 12 + 1
+    # 29-31 числа в коротких месяцах переносятся на последний день месяца
+    day = min(day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+
+def _step(rule):
+    if rule['freq'] == 'DAILY':
+        return timedelta(days=rule['interval'])
+    if rule['freq'] == 'WEEKLY':
+        return timedelta(weeks=rule['interval'])
+    return None
+
+
+def _months(rule):
+    return rule['interval'] * (12 if rule['freq'] == 'YEARLY' else 1)
+
+
+def nth_occurrence(dtstart, rule, k):
+    """Начало k-го (с нуля) повторения без учета COUNT/UNTIL"""
+    step = _step(rule)
+    if step is not None:
+        return dtstart + step * k
+    return _add_months(dtstart, _months(rule) * k, dtstart.day)
+
+
+def _first_index_after(dtstart, rule, moment):
+    """Наименьшее k, при котором начало повторения > moment"""
+    if moment < dtstart:
+        return 0
+    step = _step(rule)
+    if step is not None:
+        return (moment - dtstart) // step + 1
+    months = (moment.year - dtstart.year) * 12 + moment.month - dtstart.month
+    k = max(0, months // _months(rule) - 1)
+    while nth_occurrence(dtstart, rule, k) <= moment:
+        k += 1
+    return k
+
+
+def _in_series(rule, k, start):
+    if rule['count'] is not None and k >= rule['count']:
+        return False
+    if rule['until'] is not None and start > rule['until']:
+        return False
+    return True
+
+
+def occurrence_index(dtstart, rule, moment):
+    """Номер повторения, начинающегося ровно в moment; RuleError, если такого нет"""
+    k = _first_index_after(dtstart, rule, moment - timedelta(seconds=1))
+    if nth_occurrence(dtstart, rule, k) != moment or not _in_series(rule, k, moment):
+        raise RuleError(f'В серии нет повторения {format_time(moment)}')
+    return k
+
+
+def series_end(start_time, end_time, rule):
+    """Верхняя граница конца серии для отбора по окну (None - бесконечная)"""
+    dtstart, dtend = parse_time(start_time), parse_time(end_time)
+    duration = dtend - dtstart
+    if rule['count'] is not None:
+        last = nth_occurrence(dtstart, rule, rule['count'] - 1)
+        return format_time(last + duration)
+    if rule['until'] is not None:
+        return format_time(rule['until'] + duration)
+    return None
+
+
+@lru_cache(maxsize=Config.RECURRENCE_CACHE_SIZE)
+def expand(start_time, end_time, rrule, exdates, window_start, window_end):
+    """Повторения серии, пересекающиеся с окном: кортеж (начало, конец).
+
+    Ключ кэша - само содержимое правила, поэтому правка серии дает новый
+    ключ и старые окна просто вытесняются. Разворачиваются только
+    повторения внутри окна: первое находится арифметически.
+    """
+    rule = parse_rule(rrule)
+    dtstart, dtend = parse_time(start_time), parse_time(end_time)
+    duration = dtend - dtstart
+    excluded = parse_exdates(exdates)
+    window_start, window_end = parse_time(window_start), parse_time(window_end)
+
+    occurrences = []
+    k = _first_index_after(dtstart, rule, window_start - duration)
+    while True:
+        start = nth_occurrence(dtstart, rule, k)
+        if start >= window_end or not _in_series(rule, k, start):
+            break
+        if start not in excluded:
+            occurrences.append((format_time(start), format_time(start + duration)))
+        k += 1
+    return tuple(occurrences)
+
+
+# ========== СХЕМА ==========
+RECURRENCE_COLUMNS = (
+    ('rrule', 'TEXT'),            # правило серии (на главной записи)
+    ('exdates', 'TEXT'),          # JSON-массив исключенных повторений
+    ('series_end', 'DATETIME'),   # конец последнего повторения, NULL - бесконечно
+    ('series_id', 'INTEGER'),     # отдельно измененное повторение -> главная запись
+    ('original_start', 'DATETIME'),  # какое повторение серии оно заменяет
+)
+
+
+def migrate_recurrence_columns(conn):
+    """Колонки повторений в appointments и частичный индекс серий"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(appointments)')}
+    for name, column_type in RECURRENCE_COLUMNS:
+        if name not in columns:
+            conn.execute(f'ALTER TABLE appointments ADD COLUMN {name} {column_type}')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_appointments_recurring
+        ON appointments(user_id, start_time) WHERE rrule IS NOT NULL
+    ''')
+
+
+def recurrence_values(data, start_time, end_time):
+    """(rrule, series_end) для записи из поля recurrence запроса"""
+    value = data.get('recurrence')
+    if not value:
+        return None, None
+    rule = parse_rule(value)
+    if parse_time(end_time) <= parse_time(start_time):
+        raise RuleError('Конец приема должен быть позже начала')
+    return format_rule(rule), series_end(start_time, end_time, rule)
+
+
+# ========== ОКНО КАЛЕНДАРЯ ==========
+def window_occurrences(conn, user_id, window_start, window_end):
+    """События-повторения всех серий пользователя, пересекающихся с окном"""
+    start, end = format_time(window_start), format_time(window_end)
+    masters = conn.execute('''
+        SELECT * FROM appointments INDEXED BY idx_appointments_recurring
+        WHERE user_id = ? AND rrule IS NOT NULL AND start_time < ?
+          AND (series_end IS NULL OR series_end > ?)
+    ''', (user_id, end, start)).fetchall()
+
+    events = []
+    for master in masters:
+        for occ_start, occ_end in expand(master['start_time'], master['end_time'],
+                                         master['rrule'], master['exdates'], start, end):
+            events.append(occurrence_event(master, occ_start, occ_end))
+    return events
+
+
+def occurrence_event(master, start, end):
+    """Повторение серии в формате события FullCalendar"""
+    props = {field: master[field] for field in EVENT_FIELDS if field != 'title'}
+    props.update({'series_id': master['id'], 'occurrence_start': start, 'rrule': master['rrule']})
+    return {
+        'id': f'{master["id"]}@{start}',
+        'groupId': master['id'],
+        'title': master['title'],
+        'start': start,
+        'end': end,
+        'extendedProps': props,
+    }
+
+
+# ========== ПРАВКА ПОВТОРЕНИЙ ==========
+class SeriesNotFound(LookupError):
+    """Нет повторяющейся записи с таким id"""
+
+
+def get_series(conn, appointment_id, user_id=None):
+    """Главная запись серии или None.
+
+    Читается внутри задания записи: exdates пересобираются из этой копии,
+    и прочитанная до блокировки копия затерла бы исключения соседней правки.
+    """
+    sql = 'SELECT * FROM appointments WHERE id = ? AND rrule IS NOT NULL'
+    params = [appointment_id]
+    if user_id is not None:
+        sql += ' AND user_id = ?'
+        params.append(user_id)
+    return conn.execute(sql, params).fetchone()
+
+
+def _save_rule(conn, master_id, start_time, end_time, rule, exdates):
+    conn.execute(
+        'UPDATE appointments SET rrule = ?, exdates = ?, series_end = ? WHERE id = ?',
+        (format_rule(rule), format_exdates(exdates),
+         series_end(start_time, end_time, rule), master_id)
+    )
+
+
+def _truncate(conn, master, rule, k, occurrence, exdates):
+    """Серия заканчивается перед повторением k"""
+    if rule['count'] is not None:
+        rule = dict(rule, count=k)
+    else:
+        rule = dict(rule, until=occurrence - timedelta(seconds=1))
+    kept = {moment for moment in exdates if moment < occurrence}
+    _save_rule(conn, master['id'], master['start_time'], master['end_time'], rule, kept)
+
+
+def _insert_appointment(conn, values):
+    columns = ', '.join(values)
+    placeholders = ', '.join('?' for _ in values)
+    cursor = conn.execute(
+        f'INSERT INTO appointments ({columns}) VALUES ({placeholders})', list(values.values())
+    )
+    return cursor.lastrowid
+
+
+def edit_occurrence(conn, master, occurrence_start, changes, scope='this'):
+    """Изменение одного повторения или повторения и всех следующих.
+
+    'this' - повторение исключается из серии и сохраняется отдельной
+    записью со ссылкой на серию. 'following' - серия обрывается перед
+    повторением, а с него начинается новая серия с изменениями.
+    Возвращает id записи с изменениями. В любом случае пишется не больше
+    двух строк, сколько бы повторений ни было в серии.
+    """
+    rule = parse_rule(master['rrule'])
+    dtstart, dtend = parse_time(master['start_time']), parse_time(master['end_time'])
+    occurrence = parse_time(occurrence_start)
+    k = occurrence_index(dtstart, rule, occurrence)
+    exdates = parse_exdates(master['exdates'])
+
+    new_start = parse_time(changes['start_time']) if changes.get('start_time') else occurrence
+    if changes.get('end_time'):
+        new_end = parse_time(changes['end_time'])
+    else:
+        new_end = new_start + (dtend - dtstart)
+    if new_end <= new_start:
+        raise RuleError('Конец приема должен быть позже начала')
+
+    values = {'user_id': master['user_id']}
+    for field in EVENT_FIELDS:
+        values[field] = changes.get(field, master[field])
+    values['start_time'] = format_time(new_start)
+    values['end_time'] = format_time(new_end)
+
+    if scope == 'this':
+        exdates.add(occurrence)
+        _save_rule(conn, master['id'], master['start_time'], master['end_time'], rule, exdates)
+        values.update({'series_id': master['id'], 'original_start': format_time(occurrence)})
+        return _insert_appointment(conn, values)
+
+    if scope != 'following':
+        raise RuleError("scope: 'this' или 'following'")
+
+    tail_rule = dict(rule)
+    if rule['count'] is not None:
+        tail_rule['count'] = rule['count'] - k
+    tail_exdates = {moment + (new_start - occurrence)
+                    for moment in exdates if moment >= occurrence}
+
+    if k == 0:
+        # Изменение с первого повторения - это правка всей серии
+        conn.execute(
+            f'UPDATE appointments SET {", ".join(f"{name} = ?" for name in values)} WHERE id = ?',
+            [*values.values(), master['id']]
+        )
+        _save_rule(conn, master['id'], values['start_time'], values['end_time'],
+                   tail_rule, tail_exdates)
+        return master['id']
+
+    _truncate(conn, master, rule, k, occurrence, exdates)
+    values.update({
+        'rrule': format_rule(tail_rule),
+        'exdates': format_exdates(tail_exdates),
+        'series_end': series_end(values['start_time'], values['end_time'], tail_rule),
+    })
+    new_id = _insert_appointment(conn, values)
+    # Отдельно измененные повторения из хвоста переходят к новой серии
+    conn.execute(
+        'UPDATE appointments SET series_id = ? WHERE series_id = ? AND original_start >= ?',
+        (new_id, master['id'], format_time(occurrence))
+    )
+    return new_id
+
+
+def delete_occurrence(conn, master, occurrence_start, scope='this'):
+    """Удаление одного повторения или повторения и всех следующих"""
+    rule = parse_rule(master['rrule'])
+    dtstart = parse_time(master['start_time'])
+    occurrence = parse_time(occurrence_start)
+    k = occurrence_index(dtstart, rule, occurrence)
+    exdates = parse_exdates(master['exdates'])
+
+    if scope == 'this':
+        exdates.add(occurrence)
+        _save_rule(conn, master['id'], master['start_time'], master['end_time'], rule, exdates)
+        return
+    if scope != 'following':
+        raise RuleError("scope: 'this' или 'following'")
+
+    # Отдельно измененные повторения из хвоста удаляются вместе с ним
+    conn.execute(
+        'DELETE FROM appointments WHERE series_id = ? AND original_start >= ?',
+        (master['id'], format_time(occurrence))
+    )
+    if k == 0:
+        conn.execute('DELETE FROM appointments WHERE id = ?', (master['id'],))
+    else:
+        _truncate(conn, master, rule, k, occurrence, exdates)
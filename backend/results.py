@@ -0,0 +1,81 @@
+import math
+
+# Качественные результаты без числового значения
+NORMAL_RESULTS = {
+    'negative', 'neg', 'normal', 'not detected',
+    'отрицательный', 'отрицательно', 'отр', 'не обнаружено', 'не обнаружен',
+    'отсутствует', 'норма', 'в норме',
+}
+ABNORMAL_RESULTS = {
+    'positive', 'pos', 'detected',
+    'положительный', 'положительно', 'пол', 'обнаружено', 'обнаружен',
+}
+
+
+def parse_number(value):
+    """Число из результата или нормы ('5,2' -> 5.2); None, если не число"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        text = str(value).strip().replace(',', '.')
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+    if math.isnan(number) or math.isinf(number):
+        return None
+    return number
+
+
+def classify_result(result, norm_min=None, norm_max=None):
+    """Разбор результата при записи: (result_value, is_abnormal).
+
+    Для числового результата is_abnormal - выход за norm_min/norm_max.
+    Для качественного ("negative", "положительный") result_value = None,
+    а is_abnormal берется из словаря; неизвестный текст дает None.
+    """
+    value = parse_number(result)
+    if value is None:
+        text = str(result).strip().lower() if result is not None else ''
+        if text in NORMAL_RESULTS:
+            return None, 0
+        if text in ABNORMAL_RESULTS:
+            return None, 1
+        return None, None
+
+    low = parse_number(norm_min)
+    high = parse_number(norm_max)
+    abnormal = (low is not None and value < low) or (high is not None and value > high)
+    return value, int(abnormal)
+
+
+def migrate_result_columns(conn):
+    """Добавление result_value/is_abnormal в старую БД и заполнение по result.
+
+    Возвращает True, если схема изменилась и счетчики нужно пересчитать.
+    """
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(analyses)')}
+    migrated = False
+
+    if 'result_value' not in columns:
+        conn.execute('ALTER TABLE analyses ADD COLUMN result_value REAL')
+        migrated = True
+    if 'is_abnormal' not in columns:
+        conn.execute('ALTER TABLE analyses ADD COLUMN is_abnormal INTEGER')
+        migrated = True
+
+    if migrated:
+        rows = conn.execute('SELECT id, result, norm_min, norm_max FROM analyses').fetchall()
+        conn.executemany(
+            'UPDATE analyses SET result_value = ?, is_abnormal = ? WHERE id = ?',
+            [(*classify_result(row[1], row[2], row[3]), row[0]) for row in rows]
+        )
+
+    # Частичный индекс: в нем только строки с отклонениями
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_analyses_abnormal
+        ON analyses(user_id, date) WHERE is_abnormal = 1
+    ''')
+    return migrated
@@ -0,0 +1,199 @@
+"""Отозванные JWT (выход из системы).
+
+Источник истины - таблица revoked_tokens. Перед ней в памяти процесса:
+фильтр Блума по jti всех действующих отзывов и LRU точных ответов.
+Почти все токены не отозваны, и фильтр отвечает "нет" без обращения к БД.
+
+Отзывы из других процессов подхватываются досинхронизацией по id не
+реже раза в REVOCATION_SYNC_INTERVAL секунд. Раз в REVOCATION_REBUILD_INTERVAL
+истекшие отзывы удаляются из таблицы, а фильтр строится заново.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+from pool import get_pool
+
+
+def ensure_revocation_schema(conn):
+    """Таблица отозванных токенов; id растет монотонно (AUTOINCREMENT)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            jti TEXT UNIQUE NOT NULL,
+            expires_at INTEGER NOT NULL,
+            revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens(expires_at)')
+
+
+class BloomFilter:
+    """Фильтр Блума на bytearray: ложноположительные ответы возможны, ложноотрицательные - нет"""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Двойное хэширование: k позиций из двух 64-битных половин одного хэша
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class RevocationStore:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or Config.DATABASE
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.RLock()  # одна перестройка за раз
+        self._bloom = None
+        self._last_id = 0
+        self._synced_at = 0.0
+        self._rebuilt_at = 0.0
+        self._cache = OrderedDict()  # jti -> отозван ли (только для попавших в фильтр)
+
+        self.checks = 0
+        self.bloom_negatives = 0
+        self.cache_hits = 0
+        self.db_lookups = 0
+
+    @property
+    def pool(self):
+        return get_pool(self.db_path)
+
+    def revoke(self, jti, expires_at):
+        """Отзыв токена до его естественного истечения (exp, unix-время)"""
+        with self.pool.connection() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)',
+                (jti, int(expires_at))
+            )
+            conn.commit()
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+            self._remember(jti, True)
+
+    def is_revoked(self, jti):
+        """Отозван ли токен; без I/O, если фильтр говорит "нет" """
+        self._refresh()
+        with self._lock:
+            self.checks += 1
+            if jti not in self._bloom:
+                self.bloom_negatives += 1
+                return False
+            if jti in self._cache:
+                self._cache.move_to_end(jti)
+                self.cache_hits += 1
+                return self._cache[jti]
+            self.db_lookups += 1
+
+        with self.pool.connection() as conn:
+            revoked = conn.execute(
+                'SELECT 1 FROM revoked_tokens WHERE jti = ?', (jti,)
+            ).fetchone() is not None
+        with self._lock:
+            self._remember(jti, revoked)
+        return revoked
+
+    def _remember(self, jti, revoked):
+        self._cache[jti] = revoked
+        self._cache.move_to_end(jti)
+        while len(self._cache) > Config.REVOCATION_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def _refresh(self):
+        if self._bloom is None:
+            # Первый фильтр: остальные потоки ждут его, а не строят свой
+            with self._rebuild_lock:
+                if self._bloom is None:
+                    self.rebuild()
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            rebuild = now - self._rebuilt_at >= Config.REVOCATION_REBUILD_INTERVAL
+            sync = now - self._synced_at >= Config.REVOCATION_SYNC_INTERVAL
+            if not (rebuild or sync):
+                return
+            # Пока один поток обновляет фильтр, остальные работают с текущим
+            self._synced_at = now
+            if rebuild:
+                self._rebuilt_at = now
+        if rebuild:
+            self.rebuild()
+        else:
+            self._sync()
+
+    def _sync(self):
+        """Отзывы, добавленные после последней синхронизации (в т.ч. другими процессами)"""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                'SELECT id, jti FROM revoked_tokens WHERE id > ? ORDER BY id', (self._last_id,)
+            ).fetchall()
+        with self._lock:
+            for row_id, jti in rows:
+                self._bloom.add(jti)
+                self._remember(jti, True)
+                self._last_id = max(self._last_id, row_id)
+
+    def rebuild(self):
+        """Удаление истекших отзывов и новый фильтр по оставшимся"""
+        with self._rebuild_lock, self.pool.connection() as conn:
+            now = int(time.time())
+            # Под блокировкой записи: удаление не начинается как чтение, которое
+            # потом упрется в писателя, а выборка видит ровно то, что осталось
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM revoked_tokens WHERE expires_at < ?', (now,))
+                # Тем же условием, что и удаление: выборка идет по индексу expires_at
+                rows = conn.execute('SELECT id, jti FROM revoked_tokens WHERE expires_at >= ?',
+                                    (now,)).fetchall()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        # Запас емкости, чтобы новые отзывы до следующей перестройки не ухудшали фильтр
+        bloom = BloomFilter(max(Config.REVOCATION_BLOOM_CAPACITY, 2 * len(rows)),
+                            Config.REVOCATION_BLOOM_ERROR_RATE)
+        for _, jti in rows:
+            bloom.add(jti)
+        with self._lock:
+            self._bloom = bloom
+            self._last_id = max(row[0] for row in rows) if rows else 0
+            self._rebuilt_at = time.monotonic()
+            self._cache.clear()
+        # Отзывы, сделанные во время перестройки
+        self._sync()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'checks': self.checks,
+                'bloom_negatives': self.bloom_negatives,
+                'cache_hits': self.cache_hits,
+                'db_lookups': self.db_lookups,
+                'revoked': self._bloom.count if self._bloom else None,
+            }
+
+
+revocations = RevocationStore()
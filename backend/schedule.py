@@ -0,0 +1,218 @@
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+
+from config import Config
+from stats import read_max_span
+from recurrence import window_occurrences, expand, format_time
+
+# Отмененные приемы время не занимают
+CANCELED_STATUSES = ('canceled', 'cancelled')
+
+
+class AppointmentConflict(ValueError):
+    """Прием пересекается с другими записями пользователя"""
+
+    def __init__(self, conflicts):
+        super().__init__('Время пересекается с другими записями')
+        self.conflicts = conflicts
+
+
+def parse_moment(value):
+    """Момент из ISO-строки FullCalendar ('2024-01-01', '...T00:00:00+03:00', 'Z')"""
+    moment = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    # Время в БД хранится без часового пояса - отбрасываем смещение
+    return moment.replace(tzinfo=None)
+
+
+def parse_window(start, end):
+    """Границы окна [start, end); ValueError при неверных датах"""
+    window_start = parse_moment(start)
+    window_end = parse_moment(end)
+    if window_end <= window_start:
+        raise ValueError('Конец окна должен быть позже начала')
+    return window_start, window_end
+
+
+def window_appointments(conn, user_id, window_start, window_end):
+    """Приемы, пересекающиеся с окном: start_time < end и end_time > start.
+
+    Первая часть - приемы, начавшиеся в днях окна (индекс по start_time).
+    Вторая - начавшиеся раньше и еще идущие: по индексу end_time, причем
+    конец не дальше start + максимальная длительность приема пользователя.
+    Обе части - диапазоны по индексам, стоимость O(приемов в окне).
+    Главные записи серий сюда не входят, их повторения дает window_events.
+    """
+    # Время хранится и как 'ГГГГ-ММ-ДД ЧЧ:ММ', и как 'ГГГГ-ММ-ДДTЧЧ:ММ': внутри
+    # одного дня строки разных форматов не сравнимы, поэтому SQL выбирает
+    # целые дни, а точная граница проверяется после разбора времени
+    first_day = window_start.date()
+    last_day = window_end.date() if window_end.time() == time.min else window_end.date() + timedelta(days=1)
+    max_span = read_max_span(conn, user_id)
+    bound = first_day + timedelta(days=max_span + 1)
+
+    params = {
+        'user_id': user_id,
+        'start': first_day.isoformat(),
+        'end': last_day.isoformat(),
+        'bound': bound.isoformat(),
+    }
+    rows = conn.execute('''
+        SELECT * FROM appointments
+        WHERE user_id = :user_id AND start_time >= :start AND start_time < :end
+          AND rrule IS NULL
+        UNION ALL
+        SELECT * FROM appointments INDEXED BY idx_appointments_user_end
+        WHERE user_id = :user_id AND end_time > :start AND end_time <= :bound
+          AND start_time < :start AND rrule IS NULL
+        ORDER BY start_time, id
+    ''', params).fetchall()
+    return [
+        row for row in rows
+        if parse_moment(row['start_time']) < window_end and parse_moment(row['end_time']) > window_start
+    ]
+
+
+def to_event(row):
+    """Строка приема в формате события FullCalendar"""
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'start': row['start_time'],
+        'end': row['end_time'],
+        'extendedProps': {
+            'doctor': row['doctor'],
+            'specialty': row['specialty'],
+            'location': row['location'],
+            'status': row['status'],
+            'notes': row['notes'],
+            'series_id': row['series_id'],
+        },
+    }
+
+
+def window_events(conn, user_id, window_start, window_end):
+    """Все события окна: обычные приемы и развернутые повторения серий"""
+    events = [to_event(row) for row in window_appointments(conn, user_id, window_start, window_end)]
+    events.extend(window_occurrences(conn, user_id, window_start, window_end))
+    events.sort(key=lambda event: event['start'].replace(' ', 'T'))
+    return events
+
+
+# ========== ЗАНЯТОСТЬ ==========
+def _busy(events, exclude_id=None):
+    """(начало, конец, событие) занятых интервалов по возрастанию начала"""
+    busy = []
+    for event in events:
+        props = event['extendedProps']
+        if props.get('status') in CANCELED_STATUSES:
+            continue
+        # Правка записи не конфликтует сама с собой, со своими повторениями
+        # и с отдельно измененными повторениями своей серии
+        if exclude_id is not None and exclude_id in (event['id'], event.get('groupId'),
+                                                     props.get('series_id')):
+            continue
+        busy.append((parse_moment(event['start']), parse_moment(event['end']), event))
+    busy.sort(key=lambda item: item[0])
+    return busy
+
+
+def booking_intervals(start_time, end_time, rrule=None, exdates=None):
+    """Интервалы, которые займет прием: одно время или повторения серии.
+
+    Серия проверяется на CONFLICT_HORIZON_DAYS вперед - бесконечную
+    целиком не развернуть. Все интервалы одной длины, поэтому и начала,
+    и концы идут по возрастанию.
+    """
+    start, end = parse_moment(start_time), parse_moment(end_time)
+    if end <= start:
+        raise ValueError('Конец приема должен быть позже начала')
+    if not rrule:
+        return [(start, end)]
+
+    horizon = start + timedelta(days=Config.CONFLICT_HORIZON_DAYS)
+    occurrences = expand(format_time(start), format_time(end), rrule, exdates,
+                         format_time(start), format_time(horizon))
+    return [(parse_moment(occ_start), parse_moment(occ_end)) for occ_start, occ_end in occurrences]
+
+
+def find_conflicts(conn, user_id, intervals, exclude_id=None):
+    """События, пересекающиеся хотя бы с одним из интервалов.
+
+    Занятость читается одним запросом окна по индексам, затем для каждого
+    занятого интервала бинарным поиском находится первый кандидат,
+    который кончается позже его начала: O((n + m) log n).
+    """
+    if not intervals:
+        return []
+    starts = [start for start, _ in intervals]
+    ends = [end for _, end in intervals]
+    events = window_events(conn, user_id, starts[0], ends[-1])
+
+    conflicts = []
+    for busy_start, busy_end, event in _busy(events, exclude_id):
+        i = bisect_right(ends, busy_start)
+        if i < len(intervals) and starts[i] < busy_end:
+            conflicts.append(event)
+    return conflicts
+
+
+def parse_day_time(value):
+    """Время суток 'ЧЧ:ММ' или None"""
+    if not value:
+        return None
+    return time.fromisoformat(value)
+
+
+def _search_windows(range_start, range_end, day_start=None, day_end=None):
+    """Окна поиска: весь диапазон или рабочие часы каждого дня в нем"""
+    if day_start is None and day_end is None:
+        yield range_start, range_end
+        return
+    day_start = day_start or time.min
+    day = range_start.date()
+    while day <= range_end.date():
+        start = max(datetime.combine(day, day_start), range_start)
+        end = min(datetime.combine(day, day_end) if day_end else
+                  datetime.combine(day + timedelta(days=1), time.min), range_end)
+        if start < end:
+            yield start, end
+        day += timedelta(days=1)
+
+
+def free_slots(conn, user_id, range_start, range_end, duration, day_start=None, day_end=None):
+    """Свободные промежутки не короче duration внутри [range_start, range_end).
+
+    Занятые интервалы окна сливаются в непересекающиеся, затем один проход
+    по ним и окнам поиска (оба упорядочены) выдает промежутки между ними.
+    """
+    if range_end - range_start > timedelta(days=Config.FREE_SLOTS_MAX_DAYS):
+        raise ValueError(f'Диапазон поиска не больше {Config.FREE_SLOTS_MAX_DAYS} дней')
+    if duration <= timedelta(0):
+        raise ValueError('Длительность должна быть положительной')
+
+    merged = []
+    for start, end, _ in _busy(window_events(conn, user_id, range_start, range_end)):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    slots = []
+    first = 0
+    for search_start, search_end in _search_windows(range_start, range_end, day_start, day_end):
+        # Занятость, закончившаяся до окна, дальше не понадобится
+        while first < len(merged) and merged[first][1] <= search_start:
+            first += 1
+        cursor = search_start
+        k = first
+        while k < len(merged) and merged[k][0] < search_end:
+            busy_start, busy_end = merged[k]
+            if busy_start - cursor >= duration:
+                slots.append({'start': format_time(cursor), 'end': format_time(busy_start)})
+            cursor = max(cursor, busy_end)
+            k += 1
+        if search_end - cursor >= duration:
+            slots.append({'start': format_time(cursor), 'end': format_time(search_end)})
+        if len(slots) >= Config.FREE_SLOTS_MAX:
+            break
+    return slots[:Config.FREE_SLOTS_MAX]
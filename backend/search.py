@@ -0,0 +1,203 @@
+"""Полнотекстовый поиск по анализам и приемам пользователя (SQLite FTS5).
+
+Индексы - внешнего содержимого (content=...): текст хранится только в
+исходных таблицах, FTS держит лишь словарь и позиции. Синхронизацию
+обеспечивают триггеры.
+"""
+import html
+import json
+import re
+import sqlite3
+
+from pagination import clamp_limit
+
+# Таблица -> (FTS-таблица, индексируемые колонки)
+SEARCH_TABLES = {
+    'analyses': ('analyses_fts', ('type', 'doctor', 'notes')),
+    'appointments': ('appointments_fts', ('title', 'doctor', 'specialty', 'location', 'notes')),
+}
+
+# Вид результата в ответе API
+SEARCH_KINDS = {'analyses': 'analysis', 'appointments': 'appointment'}
+
+# unicode61 разбивает и приводит к нижнему регистру и кириллицу
+# (диакритику снимает только у латиницы, "ё" и "е" - разные буквы).
+# Префиксные индексы ускоряют поиск по началу слова ("холест*")
+TOKENIZE = 'unicode61 remove_diacritics 2'
+PREFIX = '2 3 4'
+
+# Колонки, из которых в ответ идет фрагмент, а не весь текст
+SNIPPET_COLUMNS = {'notes'}
+SNIPPET_TOKENS = 12
+
+# Служебные маркеры подсветки: текст экранируется, затем они становятся <mark>
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def fts5_available(conn):
+    """Собран ли SQLite с FTS5"""
+    try:
+        conn.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)')
+        conn.execute('DROP TABLE temp.fts5_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _trigger_names(table):
+    return [f'trg_{table}_fts_insert', f'trg_{table}_fts_update', f'trg_{table}_fts_delete']
+
+
+def _triggers(table, fts, columns):
+    names = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{column}' for column in columns)
+    old_values = ', '.join(f'OLD.{column}' for column in columns)
+    # Для внешнего содержимого старый текст удаляется командой 'delete'
+    delete_old = f'''
+            INSERT INTO {fts} ({fts}, rowid, {names})
+            VALUES ('delete', OLD.id, {old_values});'''
+    insert_new = f'''
+            INSERT INTO {fts} (rowid, {names}) VALUES (NEW.id, {new_values});'''
+    insert, update, delete = _trigger_names(table)
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS {insert} AFTER INSERT ON {table} BEGIN{insert_new}\n        END',
+        f'CREATE TRIGGER IF NOT EXISTS {update} AFTER UPDATE OF {names} ON {table} BEGIN'
+        f'{delete_old}{insert_new}\n        END',
+        f'CREATE TRIGGER IF NOT EXISTS {delete} AFTER DELETE ON {table} BEGIN{delete_old}\n        END',
+    ]
+
+
+def ensure_search_schema(conn):
+    """FTS-таблицы и триггеры; новая таблица сразу заполняется. False - нет FTS5.
+
+    Наличие таблицы проверяется и первое заполнение идет под блокировкой
+    записи: migrate() вызывает функцию внутри BEGIN IMMEDIATE, при вызове
+    вне транзакции она открывает такую сама. Иначе два процесса могут оба не
+    найти таблицу и оба запустить 'rebuild'.
+    """
+    if not fts5_available(conn):
+        return False
+
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            _create_search_tables(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    else:
+        _create_search_tables(conn)
+    return True
+
+
+def _create_search_tables(conn):
+    for table, (fts, columns) in SEARCH_TABLES.items():
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).fetchone()
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {', '.join(columns)},
+                content='{table}', content_rowid='id',
+                tokenize='{TOKENIZE}', prefix='{PREFIX}'
+            )
+        ''')
+        # Триггеры пересоздаются, чтобы в БД всегда было актуальное определение
+        for name in _trigger_names(table):
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        for trigger in _triggers(table, fts, columns):
+            conn.execute(trigger)
+        if not exists:
+            conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def rebuild_search(conn):
+    """Полная перестройка индексов по исходным таблицам"""
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    for fts, _ in SEARCH_TABLES.values():
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+    conn.commit()
+
+
+def build_match(query):
+    """Строка запроса пользователя -> выражение MATCH или None.
+
+    Синтаксис FTS5 пользователю не доступен: берутся только слова, каждое
+    в кавычках и с префиксом "*", все слова обязательны.
+    """
+    words = _WORD.findall(query or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _highlight_sql(fts, columns):
+    parts = []
+    for i, column in enumerate(columns):
+        if column in SNIPPET_COLUMNS:
+            expr = f"snippet({fts}, {i}, :mark_start, :mark_end, '…', {SNIPPET_TOKENS})"
+        else:
+            expr = f'highlight({fts}, {i}, :mark_start, :mark_end)'
+        parts.append(f"'{column}', {expr}")
+    return f"json_object({', '.join(parts)})"
+
+
+def _kind_sql(table):
+    fts, columns = SEARCH_TABLES[table]
+    title, date = ('type', 'date') if table == 'analyses' else ('title', 'start_time')
+    return f'''
+        SELECT '{SEARCH_KINDS[table]}' AS kind, t.id, t.{title} AS title, t.{date} AS date,
+               bm25({fts}) AS rank, {_highlight_sql(fts, columns)} AS highlights
+        FROM {fts} JOIN {table} t ON t.id = {fts}.rowid
+        WHERE {fts} MATCH :match AND t.user_id = :user_id
+    '''
+
+
+def _render(text):
+    """Экранирование HTML и замена маркеров на <mark>"""
+    return (html.escape(text)
+            .replace(_MARK_START, '<mark>')
+            .replace(_MARK_END, '</mark>'))
+
+
+def search(conn, user_id, query, tables=None, limit=None, offset=0):
+    """Найденные записи пользователя по убыванию релевантности (bm25).
+
+    Возвращает (результаты, смещение следующей страницы или None).
+    В highlights - только колонки с совпадениями.
+    """
+    match = build_match(query)
+    if match is None:
+        return [], None
+    tables = tables or tuple(SEARCH_TABLES)
+    limit = clamp_limit(limit)
+    offset = max(0, int(offset or 0))
+
+    sql = ' UNION ALL '.join(_kind_sql(table) for table in tables)
+    sql += ' ORDER BY rank, kind, id LIMIT :limit OFFSET :offset'
+    rows = conn.execute(sql, {
+        'match': match, 'user_id': user_id, 'mark_start': _MARK_START, 'mark_end': _MARK_END,
+        'limit': limit + 1, 'offset': offset,
+    }).fetchall()
+
+    has_more = len(rows) > limit
+    results = []
+    for row in rows[:limit]:
+        highlights = {
+            column: _render(text)
+            for column, text in json.loads(row['highlights']).items()
+            if text and _MARK_START in text
+        }
+        results.append({
+            'kind': row['kind'],
+            'id': row['id'],
+            'title': row['title'],
+            'date': row['date'],
+            'rank': row['rank'],
+            'highlights': highlights,
+        })
+    return results, (offset + limit if has_more else None)
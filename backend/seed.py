@@ -0,0 +1,53 @@
+"""Демо-данные для разработки (python manage.py seed)"""
+from passwords import passwords
+from results import classify_result
+
+DEMO_EMAIL = 'demo@example.com'
+DEMO_PASSWORD = 'demo123'
+
+DEMO_ANALYSES = [
+    ('Общий анализ крови', '2024-01-10', '5.2', 'млн/мкл', '4.5', '5.5', 'Иванов И.И.', 'В норме'),
+    ('Глюкоза', '2024-01-12', '5.8', 'ммоль/л', '3.9', '6.1', 'Петрова А.А.', 'Незначительное повышение'),
+    ('Холестерин', '2024-01-15', '5.0', 'ммоль/л', '3.0', '5.2', 'Сидоров В.В.', 'В пределах нормы'),
+]
+
+DEMO_APPOINTMENTS = [
+    ('Консультация терапевта', '2024-01-20 10:00', '2024-01-20 11:00',
+     'Иванов И.И.', 'Терапевт', 'Поликлиника №1', 'scheduled', 'Ежегодный осмотр'),
+    ('УЗИ брюшной полости', '2024-01-25 14:00', '2024-01-25 15:00',
+     'Петрова А.А.', 'УЗИ-специалист', 'Диагностический центр', 'scheduled', 'Натощак'),
+]
+
+
+def seed_demo(conn):
+    """Демо-пользователь с анализами и приемами; None, если он уже есть"""
+    if conn.execute('SELECT 1 FROM users WHERE email = ?', (DEMO_EMAIL,)).fetchone():
+        return None
+
+    cursor = conn.execute('''
+        INSERT INTO users (email, password_hash, name, birth_date, blood_type, allergies, emergency_contact)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        DEMO_EMAIL,
+        passwords.hash(DEMO_PASSWORD),
+        'Демо Пользователь',
+        '1990-01-01',
+        'A(II) Rh+',
+        'Нет',
+        '+7 (999) 123-45-67'
+    ))
+    user_id = cursor.lastrowid
+
+    conn.executemany('''
+        INSERT INTO analyses (user_id, type, date, result, unit, norm_min, norm_max, doctor, notes,
+                              result_value, is_abnormal)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (user_id, *analysis, *classify_result(analysis[2], analysis[4], analysis[5]))
+        for analysis in DEMO_ANALYSES
+    ])
+    conn.executemany('''
+        INSERT INTO appointments (user_id, title, start_time, end_time, doctor, specialty, location, status, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(user_id, *appointment) for appointment in DEMO_APPOINTMENTS])
+    return user_id
@@ -0,0 +1,165 @@
+"""Строки SQLite сразу в JSON, без dict(row) и jsonify.
+
+Для набора колонок один раз строится шаблон объекта вида
+'{"date":%s,"doctor":%s,...}': ключи уже закодированы и расставлены так,
+как их выдал бы jsonify (app.json.sort_keys, ensure_ascii), вместе с
+перестановкой значений под этот порядок. Строка выборки (кортеж или
+sqlite3.Row) кодируется одной подстановкой %: строки - C-функцией модуля
+json, целые - repr, NULL - готовой строкой. Тело совпадает с компактным
+jsonify(dict(row)); если вывод JSON приложения не компактный (debug,
+app.json.compact = False), rows_response отдает обычный jsonify.
+
+Колонки берутся из cursor.description или ключей sqlite3.Row (у старой БД
+порядок колонок может отличаться от TABLE_COLUMNS); для пустой выборки -
+TABLE_COLUMNS.
+"""
+import json
+import math
+from json.encoder import encode_basestring, encode_basestring_ascii
+from operator import itemgetter
+
+from flask import Response, current_app, jsonify
+
+# Колонки SELECT * в порядке схемы - для пустой выборки, где их не у чего взять
+TABLE_COLUMNS = {
+    'users': (
+        'id', 'email', 'password_hash', 'name', 'birth_date', 'blood_type', 'allergies',
+        'chronic_diseases', 'emergency_contact', 'created_at', 'version', 'shard',
+    ),
+    'analyses': (
+        'id', 'user_id', 'type', 'date', 'result', 'unit', 'norm_min', 'norm_max',
+        'doctor', 'notes', 'created_at', 'result_value', 'is_abnormal',
+    ),
+    'appointments': (
+        'id', 'user_id', 'title', 'start_time', 'end_time', 'doctor', 'specialty', 'location',
+        'status', 'notes', 'created_at', 'rrule', 'exdates', 'series_end', 'series_id',
+        'original_start',
+    ),
+}
+
+# Колонки, которые не отдаются клиенту
+SECRET_COLUMNS = {'users': ('password_hash',)}
+
+
+def _float(value):
+    if math.isfinite(value):
+        return float.__repr__(value)
+    return json.dumps(value)  # NaN и Infinity, как у json
+
+
+class _Encoders(dict):
+    """Тип значения -> функция в JSON; редкие типы - через json.dumps"""
+
+    def __missing__(self, kind):
+        return json.dumps
+
+
+def _encoders(encode_str):
+    # Для str, int и None - функции на C: в цикле по значениям нет вызовов Python
+    return _Encoders({
+        str: encode_str,
+        int: int.__repr__,
+        float: _float,
+        type(None): 'null'.format,
+    })
+
+
+class RowTemplate:
+    """Шаблон JSON-объекта для строк с заданными колонками"""
+    __slots__ = ('columns', 'keys', '_template', '_order', '_encoders')
+
+    def __init__(self, columns, exclude=(), sort_keys=True, ensure_ascii=True):
+        self.columns = tuple(columns)
+        encode_str = encode_basestring_ascii if ensure_ascii else encode_basestring
+        indexes = [i for i, name in enumerate(self.columns) if name not in exclude]
+        if sort_keys:
+            indexes.sort(key=lambda i: self.columns[i])
+        self.keys = tuple(self.columns[i] for i in indexes)
+        self._template = '{' + ','.join(
+            encode_str(key).replace('%', '%%') + ':%s' for key in self.keys
+        ) + '}'
+        if indexes == list(range(len(self.columns))):
+            self._order = tuple
+        elif len(indexes) == 1:
+            index = indexes[0]
+            self._order = lambda row: (row[index],)
+        else:
+            self._order = itemgetter(*indexes)
+        self._encoders = _encoders(encode_str)
+
+    def as_dict(self, row):
+        return dict(zip(self.keys, self._order(row)))
+
+    def encode(self, row):
+        encoders = self._encoders
+        return self._template % tuple([encoders[value.__class__](value) for value in self._order(row)])
+
+    def encode_rows(self, rows):
+        template, order, encoders = self._template, self._order, self._encoders
+        parts = []
+        for row in rows:
+            parts.append(template % tuple([encoders[value.__class__](value) for value in order(row)]))
+        return '[' + ','.join(parts) + ']'
+
+
+_templates = {}  # (колонки, исключенные, sort_keys, ensure_ascii) -> RowTemplate
+
+
+def template_for(columns, exclude=()):
+    """Шаблон для колонок с настройками JSON текущего приложения"""
+    provider = current_app.json
+    key = (tuple(columns), frozenset(exclude), provider.sort_keys, provider.ensure_ascii)
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = RowTemplate(*key)
+    return template
+
+
+def table_template(table):
+    """Шаблон строки SELECT * таблицы (секретные колонки исключены)"""
+    return template_for(TABLE_COLUMNS[table], SECRET_COLUMNS.get(table, ()))
+
+
+def cursor_template(cursor, table=None):
+    """Шаблон по cursor.description (для таблицы - без ее секретных колонок)"""
+    columns = tuple(column[0] for column in cursor.description)
+    return template_for(columns, SECRET_COLUMNS.get(table, ()))
+
+
+def rows_template(rows, table):
+    """Шаблон для списка sqlite3.Row (колонки - по первой строке)"""
+    if not rows:
+        return table_template(table)
+    return template_for(rows[0].keys(), SECRET_COLUMNS.get(table, ()))
+
+
+class _Raw:
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def rows_response(key, rows, template, status=200, **fields):
+    """Ответ {key: [строки...], **fields} с тем же телом, что и у jsonify"""
+    provider = current_app.json
+    if provider.compact is False or (provider.compact is None and current_app.debug):
+        # Вывод с отступами шаблон не повторяет - отдает сам jsonify
+        response = jsonify({**fields, key: [template.as_dict(row) for row in rows]})
+        response.status_code = status
+        return response
+    encode_str = encode_basestring_ascii if provider.ensure_ascii else encode_basestring
+    items = dict(fields)
+    items[key] = _Raw(template.encode_rows(rows))
+    names = sorted(items) if provider.sort_keys else list(items)
+    parts = []
+    for name in names:
+        value = items[name]
+        if isinstance(value, _Raw):
+            value = value.text
+        else:
+            value = json.dumps(value, ensure_ascii=provider.ensure_ascii,
+                               sort_keys=provider.sort_keys, separators=(',', ':'))
+        parts.append(f'{encode_str(name)}:{value}')
+    body = '{' + ','.join(parts) + '}\n'
+    return Response(body, status=status, mimetype=provider.mimetype)
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+import numpy as np
+
+from config import Config
+
+
+def clamp_points(points):
+    """Число точек графика в границах, заданных сервером"""
+    try:
+        points = int(points)
+    except (TypeError, ValueError):
+        return Config.SERIES_DEFAULT_POINTS
+    return max(3, min(points, Config.SERIES_MAX_POINTS))
+
+
+def parse_date(value):
+    """Дата ГГГГ-ММ-ДД или None; ValueError при неверном формате"""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+def lttb_indices(x, y, threshold):
+    """Индексы точек, отобранных Largest-Triangle-Three-Buckets.
+
+    Первая и последняя точки сохраняются всегда, остальные делятся на
+    threshold - 2 корзины. Средние по корзинам считаются векторно через
+    накопленные суммы. Удвоенная площадь треугольника (a, точка корзины,
+    среднее следующей) линейна по координатам точки: |w . (x, y) + c|, где
+    w и c зависят только от a и среднего, поэтому площади всей корзины -
+    одно умножение матрицы ее точек на w. Цикл по корзинам остается: a -
+    точка, выбранная в предыдущей корзине.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    starts, ends = edges[:-1], edges[1:]
+
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = ends - starts
+    avg_x = (cum_x[ends] - cum_x[starts]) / sizes
+    avg_y = (cum_y[ends] - cum_y[starts]) / sizes
+    # Для последней корзины "следующая" - это последняя точка ряда
+    next_x = np.append(avg_x[1:], x[-1]).tolist()
+    next_y = np.append(avg_y[1:], y[-1]).tolist()
+
+    points = np.column_stack((x, y))
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    weights = np.empty(2)
+    for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        ax, ay = points[a].tolist()
+        weights[0], weights[1] = next_y[i] - ay, ax - next_x[i]
+        area = np.abs(points[start:end] @ weights + (next_x[i] * ay - next_y[i] * ax))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def load_series(conn, user_id, analysis_type, date_from=None, date_to=None, points=None):
+    """Числовые результаты одного типа анализа за период, прореженные LTTB"""
+    # Дату, которую SQLite не разбирает (julianday - NULL), на ось X не положить
+    query = '''
+        SELECT date, julianday(date), result_value, unit, norm_min, norm_max
+        FROM analyses
+        WHERE user_id = ? AND type = ? AND result_value IS NOT NULL
+          AND julianday(date) IS NOT NULL
+    '''
+    params = [user_id, analysis_type]
+    if date_from:
+        query += ' AND date >= ?'
+        params.append(date_from)
+    if date_to:
+        query += ' AND date <= ?'
+        params.append(date_to)
+    query += ' ORDER BY date, id'
+
+    rows = conn.execute(query, params).fetchall()
+    total = len(rows)
+    if not rows:
+        return {
+            'type': analysis_type, 'unit': None, 'norm_min': None, 'norm_max': None,
+            'total': 0, 'points': []
+        }
+
+    x = np.fromiter((row[1] for row in rows), dtype=np.float64, count=total)
+    y = np.fromiter((row[2] for row in rows), dtype=np.float64, count=total)
+    indices = lttb_indices(x, y, clamp_points(points))
+
+    # Коридор нормы и единицы - по самому свежему результату
+    latest = rows[-1]
+    return {
+        'type': analysis_type,
+        'unit': latest[3],
+        'norm_min': latest[4],
+        'norm_max': latest[5],
+        'total': total,
+        'points': [{'date': rows[i][0], 'value': rows[i][2]} for i in indices.tolist()],
+    }
@@ -0,0 +1,183 @@
+"""Продакшн-запуск без внешних зависимостей: мастер и pre-fork воркеры.
+
+    python server.py [--host 0.0.0.0] [--port 5000] [--workers N] [--max-requests N]
+
+Мастер открывает сокет и запускает воркеры (по умолчанию - по числу ядер),
+сам приложение не импортирует и к БД не обращается. Каждый воркер
+импортирует app.py после fork и обслуживает запросы с общего сокета по
+одному. Отработав max-requests запросов (плюс случайный разброс), воркер
+завершается, и мастер запускает новый.
+
+Сигналы мастеру:
+    HUP       - плавная перезагрузка: запускаются новые воркеры (с новым кодом),
+                старые дорабатывают текущий запрос и выходят
+    TERM, INT - остановка; воркеры, не успевшие за SERVER_GRACEFUL_TIMEOUT, снимаются
+
+Под стандартным WSGI-сервером то же приложение: wsgi.py и gunicorn.conf.py.
+"""
+import argparse
+import os
+import random
+import signal
+import socket
+import sys
+import time
+
+from config import Config
+
+# Код выхода воркера, если приложение не удалось загрузить
+WORKER_BOOT_ERROR = 3
+
+
+def log(message):
+    print(f'[{os.getpid()}] {message}', file=sys.stderr, flush=True)
+
+
+# ========== ВОРКЕР ==========
+def run_worker(sock, max_requests):
+    """Цикл воркера: запросы с общего сокета, пока не пора выйти"""
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    try:
+        from werkzeug.serving import make_server
+        from app import app
+    except Exception as e:
+        log(f'Ошибка загрузки приложения: {e!r}')
+        os._exit(WORKER_BOOT_ERROR)
+
+    handled = 0
+
+    def counted(environ, start_response):
+        nonlocal handled
+        handled += 1
+        return app(environ, start_response)
+
+    server = make_server(Config.SERVER_HOST, 0, counted, fd=sock.fileno())
+    # Раз в секунду проверяем, не пора ли выйти
+    server.timeout = 1
+    while not stopping and handled < max_requests:
+        server.handle_request()
+    log(f'Воркер завершается после {handled} запросов')
+    os._exit(0)
+
+
+# ========== МАСТЕР ==========
+class Master:
+    def __init__(self, host, port, workers, max_requests, jitter, graceful_timeout):
+        self.workers = workers
+        self.max_requests = max_requests
+        self.jitter = jitter
+        self.graceful_timeout = graceful_timeout
+        self.children = {}  # pid -> поколение
+        self.generation = 0
+        self.signals = []
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(128)
+        # Неблокирующий accept: воркер, проигравший гонку за соединение, не зависает
+        self.sock.setblocking(False)
+        self.sock.set_inheritable(True)
+
+    def spawn(self):
+        limit = self.max_requests + random.randint(0, self.jitter)
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.sock, limit)
+        self.children[pid] = self.generation
+
+    def stop_workers(self, pids, sig=signal.SIGTERM):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        """Сбор завершившихся воркеров; False - воркер не смог загрузиться"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return True
+            if pid == 0:
+                return True
+            generation = self.children.pop(pid, None)
+            if os.waitstatus_to_exitcode(status) == WORKER_BOOT_ERROR:
+                return False
+            # Воркер текущего поколения (исчерпал max-requests или упал) заменяется
+            if generation == self.generation:
+                self.spawn()
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, _: self.signals.append(signum))
+        log(f'Слушаю {self.sock.getsockname()}, воркеров: {self.workers}')
+        for _ in range(self.workers):
+            self.spawn()
+
+        try:
+            while True:
+                if not self.reap():
+                    log('Воркер не смог загрузить приложение, остановка')
+                    return 1
+                while self.signals:
+                    signum = self.signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        self.reload()
+                    else:
+                        return 0
+                time.sleep(0.5)
+        finally:
+            self.shutdown()
+
+    def reload(self):
+        """Новое поколение воркеров; старое дорабатывает и выходит"""
+        old = list(self.children)
+        self.generation += 1
+        log(f'Перезагрузка: поколение {self.generation}')
+        for _ in range(self.workers):
+            self.spawn()
+        self.stop_workers(old)
+
+    def shutdown(self):
+        log('Остановка воркеров')
+        self.stop_workers(list(self.children))
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        self.stop_workers(list(self.children), signal.SIGKILL)
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-fork сервер приложения')
+    parser.add_argument('--host', default=Config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=Config.SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=Config.SERVER_WORKERS)
+    parser.add_argument('--max-requests', type=int, default=Config.SERVER_MAX_REQUESTS)
+    parser.add_argument('--max-requests-jitter', type=int, default=Config.SERVER_MAX_REQUESTS_JITTER)
+    parser.add_argument('--graceful-timeout', type=float, default=Config.SERVER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, 'fork'):
+        parser.error('pre-fork запуск доступен только на Unix; на Windows используйте waitress (см. README)')
+
+    master = Master(args.host, args.port, max(1, args.workers), args.max_requests,
+                    args.max_requests_jitter, args.graceful_timeout)
+    return master.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
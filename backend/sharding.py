@@ -0,0 +1,273 @@
+"""Шардирование данных пользователей по нескольким файлам SQLite.
+
+Справочная БД (Config.DATABASE) хранит users и прочие общие таблицы.
+Анализы и приемы пользователя лежат в одном из DB_SHARDS файлов
+SHARD_DIR/medical-<n>.db (n = 1..DB_SHARDS), у каждого свой писатель.
+Шард выбирается консистентным хэшированием user_id (кольцо, SHARD_VNODES
+точек на шард) и запоминается в users.shard. При изменении DB_SHARDS
+переезжает примерно 1/N пользователей, и только командой rebalance.
+
+users.shard = NULL - данные в самой справочной БД (так хранится все до
+включения шардов; DB_SHARDS = 0 - шардирование выключено).
+
+id строк шарда n начинаются с n << SHARD_ID_BITS, поэтому шард анализа
+или приема определяется по его id без обращения к справочной БД.
+
+Шарды понимают и класс Database, и маршруты app.py: списки и записи
+пользователя идут в его шард (users.shard), правка и удаление по id - в
+шард из диапазона id.
+
+    python manage.py shards status
+    python manage.py shards rebalance [--dry-run]
+    python manage.py shards maintain optimize|checkpoint|integrity|verify-stats|vacuum [--jobs N]
+"""
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from config import Config
+from pool import get_pool
+from writequeue import get_write_queue
+from migrations import migrate
+from stats import verify_stats
+
+# Таблицы, строки которых живут в шарде пользователя
+SHARDED_TABLES = ('analyses', 'appointments')
+
+# Диапазон id одного шарда: 2^40 строк, id остаются в пределах 2^53 (JS Number)
+SHARD_ID_BITS = 40
+
+DIRECTORY = 0
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Кольцо консистентного хэширования: ключ -> ближайшая точка по часовой"""
+
+    def __init__(self, shards, vnodes):
+        points = sorted((_hash(f'{shard}:{i}'), shard) for shard in shards for i in range(vnodes))
+        self._keys = [key for key, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        if not self._keys:
+            return DIRECTORY
+        index = bisect_right(self._keys, _hash(key)) % len(self._keys)
+        return self._shards[index]
+
+
+def setup_shard(conn, index):
+    """Схема шарда (та же, что у справочной БД) и начало его диапазона id"""
+    migrate(conn)
+    base = index << SHARD_ID_BITS
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany('''
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+        ''', [(table, base, table) for table in SHARDED_TABLES])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+class ShardMap:
+    """Файлы шардов, их пулы и очереди записи; размещение пользователей"""
+
+    def __init__(self, directory_path=None, count=None, shard_dir=None, vnodes=None):
+        self.directory_path = directory_path or Config.DATABASE
+        self.count = Config.DB_SHARDS if count is None else count
+        self.shard_dir = shard_dir or Config.SHARD_DIR
+        self.ring = HashRing(range(1, self.count + 1), vnodes or Config.SHARD_VNODES)
+
+    @property
+    def enabled(self):
+        return self.count > 0
+
+    def path(self, index):
+        if not index:
+            return self.directory_path
+        return os.path.join(self.shard_dir, f'medical-{index}.db')
+
+    def pool(self, index):
+        if not index:
+            return get_pool(self.directory_path, setup=migrate)
+        return get_pool(self.path(index), setup=partial(setup_shard, index=index))
+
+    def writes(self, index):
+        self.pool(index)  # очередь пишет через пул, настроенный выше
+        return get_write_queue(self.path(index))
+
+    def placement(self, user_id):
+        """Шард для нового или переносимого пользователя (None - справочная БД)"""
+        return self.ring.shard_for(user_id) if self.enabled else None
+
+    @staticmethod
+    def index_for_id(row_id):
+        """Шард строки анализа или приема по ее id"""
+        return row_id >> SHARD_ID_BITS
+
+    def exists(self, index):
+        """Есть ли такой шард (id из запроса не должен создавать новый файл)"""
+        return (index == DIRECTORY or 1 <= index <= self.count
+                or os.path.exists(self.path(index)))
+
+    def indexes(self):
+        """Справочная БД и все шарды: настроенные и оставшиеся на диске"""
+        found = set(range(1, self.count + 1))
+        for path in glob.glob(os.path.join(self.shard_dir, 'medical-*.db')):
+            match = re.search(r'medical-(\d+)\.db$', path)
+            if match:
+                found.add(int(match.group(1)))
+        return [DIRECTORY, *sorted(found)]
+
+
+# ========== ПЕРЕНОС ПОЛЬЗОВАТЕЛЕЙ ==========
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})') if row[1] != 'id']
+
+
+def move_user(shards, user_id, source, target):
+    """Перенос анализов и приемов пользователя из шарда source в target.
+
+    Одна транзакция на присоединенных БД: копирование (с новыми id из
+    диапазона target), удаление из source и смена users.shard. В режиме WAL
+    она атомарна для каждого файла; при сбое ОС между файлами повторный
+    rebalance доведет перенос до конца, но строки могут задвоиться.
+    Возвращает число перенесенных строк.
+    """
+    source, target = source or DIRECTORY, target or DIRECTORY
+    for index in {source, target, DIRECTORY}:
+        with shards.pool(index).connection():
+            pass  # схема и диапазон id создаются при первом соединении
+
+    conn = sqlite3.connect(shards.path(target), timeout=Config.DB_BUSY_TIMEOUT / 1000)
+    conn.row_factory = sqlite3.Row
+    schemas = {target: 'main'}
+    for index, alias in ((source, 'src'), (DIRECTORY, 'dir')):
+        if index not in schemas:
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (shards.path(index),))
+            schemas[index] = alias
+    src, dst, directory = schemas[source], schemas[target], schemas[DIRECTORY]
+
+    moved = 0
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        columns = _columns(conn, src, 'analyses')
+        moved += conn.execute(f'''
+            INSERT INTO {dst}.analyses ({", ".join(columns)})
+            SELECT {", ".join(columns)} FROM {src}.analyses WHERE user_id = ? ORDER BY id
+        ''', (user_id,)).rowcount
+
+        # Приемы по одному: измененные повторения ссылаются на главную запись (series_id)
+        columns = _columns(conn, src, 'appointments')
+        insert = (f'INSERT INTO {dst}.appointments ({", ".join(columns)}) '
+                  f'VALUES ({", ".join("?" * len(columns))})')
+        new_ids = {}
+        linked = []
+        for row in conn.execute(
+            f'SELECT * FROM {src}.appointments WHERE user_id = ? ORDER BY id', (user_id,)
+        ).fetchall():
+            new_ids[row['id']] = conn.execute(insert, [row[name] for name in columns]).lastrowid
+            if row['series_id'] is not None:
+                linked.append((row['id'], row['series_id']))
+        conn.executemany(
+            f'UPDATE {dst}.appointments SET series_id = ? WHERE id = ?',
+            [(new_ids.get(series_id), new_ids[row_id]) for row_id, series_id in linked]
+        )
+        moved += len(new_ids)
+
+        for table in SHARDED_TABLES:
+            conn.execute(f'DELETE FROM {src}.{table} WHERE user_id = ?', (user_id,))
+        conn.execute(f'UPDATE {directory}.users SET shard = ? WHERE id = ?', (target or None, user_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return moved
+
+
+def plan_rebalance(shards):
+    """Пользователи не на своем шарде: [(user_id, текущий, нужный)]"""
+    with shards.pool(DIRECTORY).connection() as conn:
+        rows = conn.execute('SELECT id, shard FROM users ORDER BY id').fetchall()
+    plan = []
+    for user_id, current in rows:
+        target = shards.placement(user_id) or DIRECTORY
+        if (current or DIRECTORY) != target:
+            plan.append((user_id, current or DIRECTORY, target))
+    return plan
+
+
+def rebalance(shards, dry_run=False, progress=None):
+    """Перенос всех пользователей на шарды по текущему кольцу; план переносов.
+
+    Рассчитан на окно обслуживания: запись переносимого пользователя из
+    другого процесса во время переноса может попасть в старый шард.
+    """
+    plan = plan_rebalance(shards)
+    if dry_run:
+        return plan
+    for user_id, source, target in plan:
+        moved = move_user(shards, user_id, source, target)
+        if progress:
+            progress(user_id, source, target, moved)
+    return plan
+
+
+# ========== ОБСЛУЖИВАНИЕ ==========
+def _integrity(conn):
+    return [row[0] for row in conn.execute('PRAGMA quick_check')]
+
+
+MAINTENANCE_TASKS = {
+    'optimize': lambda conn: conn.execute('PRAGMA optimize').fetchall(),
+    'checkpoint': lambda conn: tuple(conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()),
+    'integrity': _integrity,
+    'verify-stats': verify_stats,
+    'vacuum': lambda conn: conn.execute('VACUUM').fetchall(),
+}
+
+
+def maintain(shards, task, jobs=None):
+    """Задача обслуживания на всех БД параллельно: {номер шарда: результат или исключение}"""
+    run = MAINTENANCE_TASKS[task]
+
+    def on_shard(index):
+        with shards.pool(index).connection() as conn:
+            return run(conn)
+
+    indexes = shards.indexes()
+    results = {}
+    # SQLite отпускает GIL на время запроса: файлы обрабатываются параллельно
+    with ThreadPoolExecutor(jobs or Config.SHARD_MAINTENANCE_JOBS, thread_name_prefix='shard') as executor:
+        futures = {index: executor.submit(on_shard, index) for index in indexes}
+        for index, future in futures.items():
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = e
+    return results
+
+
+def shard_status(shards):
+    """Число пользователей и строк по шардам"""
+    with shards.pool(DIRECTORY).connection() as conn:
+        users = dict(conn.execute('SELECT COALESCE(shard, 0), COUNT(*) FROM users GROUP BY 1').fetchall())
+    status = {}
+    for index in shards.indexes():
+        with shards.pool(index).connection() as conn:
+            rows = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in SHARDED_TABLES}
+        status[index] = {'path': shards.path(index), 'users': users.get(index, 0), **rows}
+    return status
@@ -0,0 +1,301 @@
+"""Счетчики пользователя для дашборда, поддерживаемые триггерами.
+
+Проверка расхождений и пересчет:
+    python stats.py verify
+    python stats.py rebuild [--user ID]
+"""
+import argparse
+import sqlite3
+import sys
+
+COUNTERS = ('total_analyses', 'abnormal_analyses', 'total_appointments')
+
+# Верхняя граница длительности приема (дни) для оконных запросов календаря.
+# Только растет: удаление приема ее не уменьшает, точное значение дает rebuild.
+SPAN_COLUMN = 'max_appointment_span'
+
+# Версия данных пользователя: растет при любой записи в analyses/appointments,
+# на ней держатся ETag списков. Пересчет счетчиков ее не сбрасывает.
+VERSION_COLUMN = 'data_version'
+
+TRIGGER_NAMES = (
+    'trg_user_stats_analyses_insert',
+    'trg_user_stats_analyses_update',
+    'trg_user_stats_analyses_delete',
+    'trg_user_stats_appointments_insert',
+    'trg_user_stats_appointments_update',
+    'trg_user_stats_appointments_span',
+    'trg_user_stats_appointments_delete',
+    'trg_user_stats_analyses_version',
+    'trg_user_stats_appointments_version',
+)
+
+
+def _abnormal(prefix=''):
+    # Признак отклонения вычисляется при записи (см. results.py)
+    return f'COALESCE({prefix}is_abnormal, 0)'
+
+
+def _span(prefix=''):
+    # Длительность приема в днях
+    return f'COALESCE(julianday({prefix}end_time) - julianday({prefix}start_time), 0)'
+
+
+def _triggers():
+    new_abnormal = _abnormal('NEW.')
+    old_abnormal = _abnormal('OLD.')
+    new_span = _span('NEW.')
+    ensure_new = 'INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);'
+    bump = f'{VERSION_COLUMN} = {VERSION_COLUMN} + 1'
+    return [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_analyses_insert
+        AFTER INSERT ON analyses BEGIN
+            {ensure_new}
+            UPDATE user_stats
+            SET total_analyses = total_analyses + 1,
+                abnormal_analyses = abnormal_analyses + {new_abnormal},
+                {bump}
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_analyses_update
+        AFTER UPDATE OF user_id, is_abnormal ON analyses BEGIN
+            UPDATE user_stats
+            SET total_analyses = total_analyses - 1,
+                abnormal_analyses = abnormal_analyses - {old_abnormal}
+            WHERE user_id = OLD.user_id;
+            {ensure_new}
+            UPDATE user_stats
+            SET total_analyses = total_analyses + 1,
+                abnormal_analyses = abnormal_analyses + {new_abnormal}
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_analyses_delete
+        AFTER DELETE ON analyses BEGIN
+            UPDATE user_stats
+            SET total_analyses = total_analyses - 1,
+                abnormal_analyses = abnormal_analyses - {old_abnormal},
+                {bump}
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_appointments_insert
+        AFTER INSERT ON appointments BEGIN
+            {ensure_new}
+            UPDATE user_stats
+            SET total_appointments = total_appointments + 1,
+                max_appointment_span = MAX(max_appointment_span, {new_span}),
+                {bump}
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_appointments_span
+        AFTER UPDATE OF user_id, start_time, end_time ON appointments BEGIN
+            {ensure_new}
+            UPDATE user_stats
+            SET max_appointment_span = MAX(max_appointment_span, {new_span})
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_appointments_update
+        AFTER UPDATE OF user_id ON appointments
+        WHEN OLD.user_id IS NOT NEW.user_id BEGIN
+            UPDATE user_stats
+            SET total_appointments = total_appointments - 1
+            WHERE user_id = OLD.user_id;
+            {ensure_new}
+            UPDATE user_stats
+            SET total_appointments = total_appointments + 1
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_appointments_delete
+        AFTER DELETE ON appointments BEGIN
+            UPDATE user_stats
+            SET total_appointments = total_appointments - 1,
+                {bump}
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+        # Любое изменение строки меняет версию (старого и нового владельца)
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_analyses_version
+        AFTER UPDATE ON analyses BEGIN
+            {ensure_new}
+            UPDATE user_stats SET {bump} WHERE user_id IN (OLD.user_id, NEW.user_id);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_appointments_version
+        AFTER UPDATE ON appointments BEGIN
+            {ensure_new}
+            UPDATE user_stats SET {bump} WHERE user_id IN (OLD.user_id, NEW.user_id);
+        END
+        ''',
+    ]
+
+
+def _expected_sql(where=''):
+    """Счетчики, посчитанные заново по исходным таблицам"""
+    return f'''
+        SELECT user_id,
+               SUM(is_analysis) AS total_analyses,
+               SUM(is_abnormal) AS abnormal_analyses,
+               SUM(is_appointment) AS total_appointments,
+               MAX(span) AS max_appointment_span
+        FROM (
+            SELECT user_id, 1 AS is_analysis, {_abnormal()} AS is_abnormal, 0 AS is_appointment,
+                   0 AS span
+            FROM analyses {where}
+            UNION ALL
+            SELECT user_id, 0, 0, 1, {_span()} FROM appointments {where}
+        )
+        GROUP BY user_id
+    '''
+
+
+def ensure_stats_schema(conn, rebuild=False):
+    """Создание таблицы user_stats и триггеров; при первом создании - пересчет"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_stats'"
+    ).fetchone()
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_analyses INTEGER NOT NULL DEFAULT 0,
+            abnormal_analyses INTEGER NOT NULL DEFAULT 0,
+            total_appointments INTEGER NOT NULL DEFAULT 0,
+            max_appointment_span REAL NOT NULL DEFAULT 0,
+            data_version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(user_stats)')}
+    if SPAN_COLUMN not in columns:
+        conn.execute(f'ALTER TABLE user_stats ADD COLUMN {SPAN_COLUMN} REAL NOT NULL DEFAULT 0')
+        rebuild = True
+    if VERSION_COLUMN not in columns:
+        conn.execute(f'ALTER TABLE user_stats ADD COLUMN {VERSION_COLUMN} INTEGER NOT NULL DEFAULT 0')
+    # Триггеры пересоздаются, чтобы в БД всегда было актуальное определение
+    for name in TRIGGER_NAMES:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for trigger in _triggers():
+        conn.execute(trigger)
+
+    if rebuild or not exists:
+        rebuild_stats(conn)
+
+
+def read_stats(conn, user_id):
+    """Счетчики пользователя одним поиском по первичному ключу"""
+    row = conn.execute(
+        'SELECT total_analyses, abnormal_analyses, total_appointments '
+        'FROM user_stats WHERE user_id = ?',
+        (user_id,)
+    ).fetchone()
+    if row is None:
+        return dict.fromkeys(COUNTERS, 0)
+    return dict(zip(COUNTERS, row))
+
+
+def rebuild_stats(conn, user_id=None):
+    """Пересчет счетчиков (всех или одного пользователя); фиксирует вызывающий.
+
+    Строки не удаляются: версия данных только растет, иначе старый ETag
+    мог бы совпасть с новым содержимым.
+    """
+    where = '' if user_id is None else 'WHERE user_id = :user_id'
+    params = {'user_id': user_id}
+    zeros = ', '.join(f'{name} = 0' for name in (*COUNTERS, SPAN_COLUMN))
+    conn.execute(f'UPDATE user_stats SET {zeros}, {VERSION_COLUMN} = {VERSION_COLUMN} + 1 {where}',
+                 params)
+    updates = ', '.join(f'{name} = excluded.{name}' for name in (*COUNTERS, SPAN_COLUMN))
+    conn.execute(f'''
+        INSERT INTO user_stats (user_id, {", ".join(COUNTERS)}, {SPAN_COLUMN})
+        {_expected_sql(where)}
+        ON CONFLICT(user_id) DO UPDATE SET {updates}
+    ''', params)
+
+
+def read_version(conn, user_id):
+    """Версия данных пользователя (0 - записей еще не было)"""
+    row = conn.execute(
+        f'SELECT {VERSION_COLUMN} FROM user_stats WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def read_max_span(conn, user_id):
+    """Верхняя граница длительности приема пользователя в днях"""
+    row = conn.execute(
+        f'SELECT {SPAN_COLUMN} FROM user_stats WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return row[0] if row else 0.0
+
+
+def verify_stats(conn):
+    """Список расхождений: (user_id, {счетчик: (ожидается, в таблице)})"""
+    expected = {row[0]: row[1:] for row in conn.execute(_expected_sql())}
+    stored = {
+        row[0]: row[1:]
+        for row in conn.execute(
+            f'SELECT user_id, {", ".join(COUNTERS)}, {SPAN_COLUMN} FROM user_stats')
+    }
+
+    drift = []
+    zeros = (0,) * (len(COUNTERS) + 1)
+    for user_id in sorted(set(expected) | set(stored)):
+        want = tuple(expected.get(user_id, zeros))
+        have = tuple(stored.get(user_id, zeros))
+        diff = {
+            name: (w, h) for name, w, h in zip(COUNTERS, want, have) if w != h
+        }
+        # Граница длительности может быть завышена, но не занижена
+        if (want[-1] or 0) > (have[-1] or 0) + 1e-9:
+            diff[SPAN_COLUMN] = (want[-1], have[-1])
+        if diff:
+            drift.append((user_id, diff))
+    return drift
+
+
+def main(argv=None):
+    from config import Config
+    from migrations import migrate
+
+    parser = argparse.ArgumentParser(description='Счетчики дашборда (user_stats)')
+    parser.add_argument('command', choices=['verify', 'rebuild'])
+    parser.add_argument('--user', type=int, help='только для одного пользователя')
+    parser.add_argument('--db', default=Config.DATABASE, help='путь к файлу БД')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        migrate(conn)
+        if args.command == 'rebuild':
+            rebuild_stats(conn, args.user)
+            conn.commit()
+            print('Счетчики пересчитаны')
+            return 0
+
+        drift = verify_stats(conn)
+        for user_id, diff in drift:
+            print(f'user_id={user_id}: ' + ', '.join(
+                f'{name} ожидается {want}, в таблице {have}'
+                for name, (want, have) in diff.items()
+            ))
+        print('Расхождений нет' if not drift else f'Расхождений: {len(drift)}')
+        return 1 if drift else 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import json
+
+from flask import Response, request
+
+from config import Config
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    """Клиент явно просит NDJSON (Accept или ?stream=ndjson)"""
+    if request.args.get('stream') == 'ndjson':
+        return True
+    return any(
+        mimetype == NDJSON_MIMETYPE and quality > 0
+        for mimetype, quality in request.accept_mimetypes
+    )
+
+
+def wants_stream():
+    """Клиент запросил потоковую выдачу (Accept: NDJSON или ?stream=1)"""
+    return request.args.get('stream') in ('1', 'true', 'ndjson') or wants_ndjson()
+
+
+def iter_batches(pool, query, params, batch_size=None):
+    """Строки запроса пачками через fetchmany; соединение живет, пока идет выдача"""
+    batch_size = batch_size or Config.STREAM_BATCH_SIZE
+    with pool.connection() as conn:
+        cursor = conn.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(zip(columns, row)) for row in rows]
+
+
+def _ndjson(batches):
+    for batch in batches:
+        yield ''.join(json.dumps(item) + '\n' for item in batch)
+
+
+def _json_object(batches, key, envelope):
+    # Тот же формат, что и у обычного ответа: {..., key: [...], "count": N}
+    head = json.dumps(envelope or {})[:-1]
+    yield head + (', ' if envelope else '') + json.dumps(key) + ': ['
+    count = 0
+    for batch in batches:
+        chunk = ', '.join(json.dumps(item) for item in batch)
+        yield (', ' if count else '') + chunk
+        count += len(batch)
+    yield '], "count": %d}' % count
+
+
+def stream_rows(pool, query, params, key, envelope=None):
+    """Потоковый ответ со строками запроса: NDJSON или JSON-объект"""
+    batches = iter_batches(pool, query, params)
+    if wants_ndjson():
+        return Response(_ndjson(batches), mimetype=NDJSON_MIMETYPE)
+    return Response(_json_object(batches, key, envelope), mimetype='application/json')
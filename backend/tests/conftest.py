@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Модули backend импортируются как в app.py; БД - временная, до импорта config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='med-web-tests-'), 'test.db'))
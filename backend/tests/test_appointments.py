@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def slow_conflict_check(monkeypatch):
+    """Пауза между проверкой пересечений и вставкой: окно для гонки"""
+    find_conflicts = app_module.find_conflicts
+
+    def slow(*args, **kwargs):
+        conflicts = find_conflicts(*args, **kwargs)
+        time.sleep(0.05)
+        return conflicts
+
+    monkeypatch.setattr(app_module, 'find_conflicts', slow)
+
+
+def appointment(user_id, start, end):
+    return {
+        'user_id': user_id,
+        'title': 'Консультация',
+        'start_time': start,
+        'end_time': end,
+        'status': 'scheduled',
+    }
+
+
+def test_concurrent_overlapping_bookings_create_one_appointment(slow_conflict_check):
+    user_id = 9001
+    bodies = [
+        appointment(user_id, '2030-05-01T10:00', '2030-05-01T10:30'),
+        appointment(user_id, '2030-05-01T10:15', '2030-05-01T10:45'),
+    ]
+    statuses = []
+    barrier = threading.Barrier(len(bodies))
+
+    def book(body):
+        client = app_module.app.test_client()
+        barrier.wait()
+        statuses.append(client.post('/api/appointments', json=body).status_code)
+
+    threads = [threading.Thread(target=book, args=(body,)) for body in bodies]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [201, 409]
+    listed = app_module.app.test_client().get(f'/api/appointments?user_id={user_id}').get_json()
+    assert listed['count'] == 1
+
+
+def test_update_into_taken_slot_is_rejected(client):
+    user_id = 9002
+    first = client.post('/api/appointments', json=appointment(
+        user_id, '2030-06-01T09:00', '2030-06-01T09:30')).get_json()['appointment']
+    second = client.post('/api/appointments', json=appointment(
+        user_id, '2030-06-01T11:00', '2030-06-01T11:30')).get_json()['appointment']
+
+    response = client.put(f'/api/appointments/{second["id"]}', json=appointment(
+        user_id, '2030-06-01T09:15', '2030-06-01T09:45'))
+
+    assert response.status_code == 409
+    assert [conflict['id'] for conflict in response.get_json()['conflicts']] == [first['id']]
@@ -0,0 +1,57 @@
+import zlib
+
+from flask import Flask, Response
+
+import compressor
+from compressor import Gzip
+
+
+class Chunks:
+    """Исходный поток ответа, который нужно закрыть (как генератор выгрузки)"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_closes_source_when_consumer_stops_early():
+    source = Chunks(['{"a": 1}\n', '{"a": 2}\n', '{"a": 3}\n'])
+    stream = Gzip(6).stream(source)
+    next(stream)
+
+    stream.close()
+
+    assert source.closed
+
+
+def test_stream_closes_source_after_last_chunk():
+    source = Chunks(['{"a": 1}\n', b'{"a": 2}\n'])
+    body = b''.join(Gzip(6).stream(source))
+
+    assert source.closed
+    assert zlib.decompress(body, 31) == b'{"a": 1}\n{"a": 2}\n'
+
+
+def test_streamed_response_gets_weak_etag():
+    app = Flask(__name__)
+    compressor.init_app(app)
+
+    @app.route('/rows')
+    def rows():
+        response = Response(iter(['{"a": 1}\n'] * 200), mimetype='application/x-ndjson')
+        response.set_etag('v1')
+        return response
+
+    response = app.test_client().get('/rows', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.get_etag() == ('v1', True)
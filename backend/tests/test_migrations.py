@@ -0,0 +1,75 @@
+import sqlite3
+
+import pytest
+
+from migrations import migrate, schema_version, LATEST_VERSION, MigrationError
+from passwords import passwords
+
+
+def app_schema_db(path, users):
+    """БД в схеме users из app.py: открытый пароль в колонке password"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany('INSERT INTO users (email, password, name) VALUES (?, ?, ?)', users)
+    return conn
+
+
+def columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def test_fresh_database_gets_result_columns_from_their_own_step(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'fresh.db', isolation_level=None)
+
+    applied = migrate(conn)
+
+    assert applied[0][0] == 1 and applied[-1][0] == LATEST_VERSION
+    assert {'result_value', 'is_abnormal'} <= columns(conn, 'analyses')
+    assert schema_version(conn) == LATEST_VERSION
+
+
+def test_app_schema_passwords_are_hashed(tmp_path):
+    conn = app_schema_db(tmp_path / 'app.db', [('anna@example.com', 'secret1', 'Анна')])
+
+    migrate(conn)
+
+    assert 'password' not in columns(conn, 'users')
+    password_hash = conn.execute('SELECT password_hash FROM users').fetchone()[0]
+    assert passwords.check('secret1', password_hash)
+
+
+def test_hashing_does_not_go_through_login_pool(tmp_path, monkeypatch):
+    conn = app_schema_db(tmp_path / 'app.db', [('anna@example.com', 'secret1', 'Анна')])
+
+    def busy(*args):
+        raise AssertionError('миграция заняла место в пуле входа')
+
+    monkeypatch.setattr(passwords, '_run', busy)
+    migrate(conn)
+    monkeypatch.undo()
+
+    password_hash = conn.execute('SELECT password_hash FROM users').fetchone()[0]
+    assert passwords.check('secret1', password_hash)
+
+
+def test_user_without_any_password_stops_migration(tmp_path):
+    conn = app_schema_db(tmp_path / 'app.db', [
+        ('anna@example.com', 'secret1', 'Анна'),
+        ('oleg@example.com', '', 'Олег'),
+    ])
+
+    with pytest.raises(MigrationError, match='id: 2'):
+        migrate(conn)
+
+    # Транзакция откатана: БД в исходной схеме, пароли на месте
+    assert schema_version(conn) == 0
+    assert 'password' in columns(conn, 'users')
+    assert 'password_hash' not in columns(conn, 'users')
@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def slow_edit(monkeypatch):
+    """Пауза перед записью правки: обе правки успевают начаться"""
+    edit_occurrence = app_module.edit_occurrence
+
+    def slow(*args, **kwargs):
+        time.sleep(0.05)
+        return edit_occurrence(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'edit_occurrence', slow)
+
+
+def create_series(client, user_id):
+    response = client.post('/api/appointments', json={
+        'user_id': user_id,
+        'title': 'Физиотерапия',
+        'start_time': '2030-06-03T09:00',
+        'end_time': '2030-06-03T09:30',
+        'recurrence': 'FREQ=DAILY;COUNT=5',
+    })
+    assert response.status_code == 201
+    return response.get_json()['appointment']['id']
+
+
+def test_two_single_occurrence_edits_keep_both_exdates(slow_edit):
+    client = app_module.app.test_client()
+    series_id = create_series(client, 9201)
+    starts = ['2030-06-04T09:00', '2030-06-05T09:00']
+    statuses = []
+    barrier = threading.Barrier(len(starts))
+
+    def edit(start):
+        barrier.wait()
+        response = app_module.app.test_client().put(
+            f'/api/appointments/{series_id}/occurrence?start={start}&scope=this',
+            json={'notes': 'Перенесено в другой кабинет'}
+        )
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=edit, args=(start,)) for start in starts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200, 200]
+    conn = sqlite3.connect(app_module.DB_PATH)
+    exdates, = conn.execute('SELECT exdates FROM appointments WHERE id = ?', (series_id,)).fetchone()
+    edited = conn.execute('SELECT COUNT(*) FROM appointments WHERE series_id = ?', (series_id,)).fetchone()[0]
+    conn.close()
+    assert [moment[:16] for moment in sorted(json.loads(exdates))] == starts
+    assert edited == 2
+
+
+def test_occurrence_of_missing_series_is_404():
+    response = app_module.app.test_client().put(
+        '/api/appointments/987654/occurrence?start=2030-06-04T09:00&scope=this', json={}
+    )
+    assert response.status_code == 404
+
+
+def test_moving_occurrence_onto_other_appointment_is_409():
+    client = app_module.app.test_client()
+    series_id = create_series(client, 9202)
+    client.post('/api/appointments', json={
+        'user_id': 9202,
+        'title': 'Терапевт',
+        'start_time': '2030-06-10T14:00',
+        'end_time': '2030-06-10T14:30',
+    })
+
+    response = client.put(
+        f'/api/appointments/{series_id}/occurrence?start=2030-06-04T09:00&scope=this',
+        json={'start_time': '2030-06-10T14:15', 'end_time': '2030-06-10T14:45'}
+    )
+
+    assert response.status_code == 409
+    conn = sqlite3.connect(app_module.DB_PATH)
+    exdates, = conn.execute('SELECT exdates FROM appointments WHERE id = ?', (series_id,)).fetchone()
+    edited = conn.execute('SELECT COUNT(*) FROM appointments WHERE series_id = ?', (series_id,)).fetchone()[0]
+    conn.close()
+    assert not json.loads(exdates or '[]')
+    assert edited == 0
+
+
+def test_series_edit_does_not_conflict_with_its_edited_occurrence():
+    client = app_module.app.test_client()
+    series_id = create_series(client, 9203)
+    response = client.put(
+        f'/api/appointments/{series_id}/occurrence?start=2030-06-04T09:00&scope=this',
+        json={'start_time': '2030-06-05T12:00', 'end_time': '2030-06-05T12:30'}
+    )
+    assert response.status_code == 200
+
+    # Серия переезжает на 12:00 - туда же, куда перенесено ее повторение
+    response = client.put(f'/api/appointments/{series_id}', json={
+        'title': 'Физиотерапия',
+        'start_time': '2030-06-03T12:00',
+        'end_time': '2030-06-03T12:30',
+    })
+
+    assert response.status_code == 200
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from pool import get_pool
+from migrations import migrate
+from revocation import RevocationStore
+
+
+def test_concurrent_first_checks_build_the_filter_once(tmp_path):
+    db_path = str(tmp_path / 'revocation.db')
+    with get_pool(db_path, setup=migrate).connection():
+        pass
+    store = RevocationStore(db_path)
+    store.revoke('revoked-jti', time.time() + 3600)
+    store._bloom = None  # как после запуска процесса
+
+    rebuilds = []
+    rebuild = store.rebuild
+
+    def slow_rebuild():
+        rebuilds.append(threading.current_thread().name)
+        time.sleep(0.05)
+        rebuild()
+
+    store.rebuild = slow_rebuild
+    barrier = threading.Barrier(4)
+    answers = []
+
+    def check(jti):
+        barrier.wait()
+        answers.append((jti, store.is_revoked(jti)))
+
+    threads = [threading.Thread(target=check, args=(jti,))
+               for jti in ('revoked-jti', 'a', 'b', 'c')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(rebuilds) == 1
+    assert sorted(answers) == [('a', False), ('b', False), ('c', False), ('revoked-jti', True)]
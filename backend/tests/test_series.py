@@ -0,0 +1,58 @@
+import sqlite3
+
+import numpy as np
+
+import app as app_module
+from series import lttb_indices
+
+
+def test_series_skips_rows_with_unparsable_date():
+    user_id = 9101
+    client = app_module.app.test_client()
+    client.get(f'/api/analyses/series?user_id={user_id}&type=Глюкоза')  # пул создает схему
+
+    conn = sqlite3.connect(app_module.DB_PATH)
+    with conn:
+        conn.executemany(
+            'INSERT INTO analyses (user_id, type, date, result, result_value) VALUES (?, ?, ?, ?, ?)',
+            [
+                (user_id, 'Глюкоза', '2024-01-10', '5.1', 5.1),
+                (user_id, 'Глюкоза', 'в прошлом месяце', '5.4', 5.4),
+                (user_id, 'Глюкоза', '2024-02-10', 'норма', None),
+                (user_id, 'Глюкоза', '2024-03-10', '5.8', 5.8),
+            ]
+        )
+    conn.close()
+
+    response = client.get(f'/api/analyses/series?user_id={user_id}&type=Глюкоза')
+
+    assert response.status_code == 200
+    series = response.get_json()
+    assert series['total'] == 2
+    assert [point['date'] for point in series['points']] == ['2024-01-10', '2024-03-10']
+
+
+def reference_lttb(x, y, threshold):
+    """LTTB по определению: точка за точкой"""
+    n = len(x)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = [0]
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nx, ny = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            nx, ny = x[-1], y[-1]
+        ax, ay = x[selected[-1]], y[selected[-1]]
+        areas = [abs((ax - nx) * (y[j] - ay) - (ax - x[j]) * (ny - ay)) for j in range(start, end)]
+        selected.append(start + int(np.argmax(areas)))
+    return selected + [n - 1]
+
+
+def test_lttb_matches_reference():
+    rng = np.random.default_rng(7)
+    x = np.cumsum(rng.random(500) + 0.1)
+    y = np.cumsum(rng.normal(size=500))
+
+    for threshold in (3, 10, 97, 499):
+        assert lttb_indices(x, y, threshold).tolist() == reference_lttb(x, y, threshold)
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+
+import pytest
+
+import app as app_module
+from sharding import ShardMap, DIRECTORY, SHARD_ID_BITS, move_user
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    """Два шарда в отдельном каталоге, справочная БД - общая для тестов"""
+    shard_map = ShardMap(app_module.DB_PATH, count=2, shard_dir=str(tmp_path / 'shards'))
+    monkeypatch.setattr(app_module, 'shards', shard_map)
+    return shard_map
+
+
+def register(client, email):
+    response = client.post('/api/auth/register', json={
+        'email': email, 'password': 'secret1', 'name': 'Пациент'
+    })
+    assert response.status_code == 201
+    return response.get_json()['user']
+
+
+def rows_in(path, table, user_id):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE user_id = ?', (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_api_reads_and_writes_the_users_shard(shards):
+    client = app_module.app.test_client()
+    user = register(client, 'sharded@example.com')
+    user_id = user['id']
+    assert user['shard'] == shards.placement(user_id)
+
+    client.post('/api/analyses', json={
+        'user_id': user_id, 'type': 'Глюкоза', 'date': '2024-03-01', 'result': '5.2'
+    })
+    created = client.post('/api/appointments', json={
+        'user_id': user_id, 'title': 'Терапевт',
+        'start_time': '2030-07-01T10:00', 'end_time': '2030-07-01T10:30'
+    }).get_json()['appointment']
+
+    shard_path = shards.path(user['shard'])
+    assert rows_in(shard_path, 'analyses', user_id) == 1
+    assert rows_in(app_module.DB_PATH, 'analyses', user_id) == 0
+    assert created['id'] >> SHARD_ID_BITS == user['shard']
+
+    analyses = client.get(f'/api/analyses?user_id={user_id}').get_json()['analyses']
+    assert [analysis['type'] for analysis in analyses] == ['Глюкоза']
+    stats = client.get(f'/api/dashboard/stats?user_id={user_id}').get_json()['stats']
+    assert stats == {'total_analyses': 1, 'total_appointments': 1}
+
+    updated = client.put(f'/api/appointments/{created["id"]}', json={
+        'title': 'Терапевт, кабинет 12',
+        'start_time': '2030-07-01T11:00', 'end_time': '2030-07-01T11:30'
+    })
+    assert updated.status_code == 200
+    assert client.delete(f'/api/appointments/{created["id"]}').status_code == 200
+    assert rows_in(shard_path, 'appointments', user_id) == 0
+
+    exported = client.get(f'/api/export?user_id={user_id}&format=json').get_json()
+    assert exported['user']['email'] == 'sharded@example.com'
+    assert len(exported['analyses']) == 1
+
+
+def test_api_sees_data_moved_to_a_shard(shards):
+    client = app_module.app.test_client()
+    unsharded = ShardMap(app_module.DB_PATH, count=0)
+    app_module.shards = unsharded
+    user_id = register(client, 'moved@example.com')['id']
+    client.post('/api/analyses', json={
+        'user_id': user_id, 'type': 'Гемоглобин', 'date': '2024-04-01', 'result': '140'
+    })
+    assert rows_in(app_module.DB_PATH, 'analyses', user_id) == 1
+
+    app_module.shards = shards
+    # Как при shards rebalance, но только этот пользователь: справочная БД общая для тестов
+    move_user(shards, user_id, DIRECTORY, shards.placement(user_id))
+
+    assert rows_in(app_module.DB_PATH, 'analyses', user_id) == 0
+    analyses = client.get(f'/api/analyses?user_id={user_id}').get_json()['analyses']
+    assert [analysis['type'] for analysis in analyses] == ['Гемоглобин']
+
+
+def test_id_outside_known_shards_is_404_without_creating_a_file(shards):
+    row_id = 7 << SHARD_ID_BITS
+    response = app_module.app.test_client().delete(f'/api/appointments/{row_id}')
+
+    assert response.status_code == 404
+    assert not os.path.exists(shards.path(7))
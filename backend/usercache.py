@@ -0,0 +1,166 @@
+"""Кэш записей пользователей в памяти процесса (LRU + TTL).
+
+Ключи - id и email. Свои записи обновляют кэш сразу (write-through).
+Изменения из других процессов видны по колонке users.version: запись
+кэша не чаще раза в USER_CACHE_REVALIDATE секунд сверяется с версией
+в БД (поиск по первичному ключу), при расхождении перечитывается.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+
+def ensure_user_version(conn):
+    """Колонка users.version и триггер, увеличивающий ее при любом UPDATE"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    if 'version' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    # Условие WHEN не дает триггеру сработать на собственный UPDATE
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_version
+        AFTER UPDATE ON users
+        WHEN NEW.version = OLD.version BEGIN
+            UPDATE users SET version = OLD.version + 1 WHERE id = NEW.id;
+        END
+    ''')
+
+
+class _Entry:
+    __slots__ = ('row', 'expires_at', 'checked_at')
+
+    def __init__(self, row, now, ttl):
+        self.row = row
+        self.expires_at = now + ttl
+        self.checked_at = now
+
+
+class UserCache:
+    """LRU-кэш строк users.
+
+    load(column, value) читает пользователя из БД ('id' или 'email'),
+    load_version(user_id) - только его версию.
+    """
+
+    def __init__(self, load, load_version, max_size=None, ttl=None, revalidate=None):
+        self._load = load
+        self._load_version = load_version
+        self.max_size = Config.USER_CACHE_SIZE if max_size is None else max_size
+        self.ttl = Config.USER_CACHE_TTL if ttl is None else ttl
+        self.revalidate = Config.USER_CACHE_REVALIDATE if revalidate is None else revalidate
+
+        self._entries = OrderedDict()  # id -> _Entry, в порядке использования
+        self._emails = {}  # email -> id
+        self._lock = threading.Lock()
+        # Растет при каждой записи: чтение, начатое до нее, результат не кэширует
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_by_id(self, user_id):
+        return self._get('id', user_id)
+
+    def get_by_email(self, email):
+        return self._get('email', email)
+
+    def _get(self, column, value):
+        if self.max_size <= 0:
+            return self._load(column, value)
+
+        now = time.monotonic()
+        with self._lock:
+            user_id = value if column == 'id' else self._emails.get(value)
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.expires_at <= now:
+                self._drop(user_id)
+                self.expired += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                row = entry.row
+                check = now - entry.checked_at >= self.revalidate
+            generation = self._generation
+
+        if entry is not None:
+            if not check or self._load_version(user_id) == row.get('version'):
+                with self._lock:
+                    entry.checked_at = now if check else entry.checked_at
+                    self.hits += 1
+                return dict(row)
+            with self._lock:
+                self._drop(user_id)
+                self.stale += 1
+
+        with self._lock:
+            self.misses += 1
+        row = self._load(column, value)
+        if row is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._store(row, now)
+            return dict(row)
+        return None
+
+    def put(self, row):
+        """Свежая строка после собственной записи (create/update)"""
+        with self._lock:
+            self._generation += 1
+            self._drop(row['id'])
+            self._store(dict(row), time.monotonic())
+
+    def invalidate(self, user_id=None, email=None):
+        """Удаление пользователя из кэша (по id и/или email)"""
+        with self._lock:
+            self._generation += 1
+            if user_id is None and email is not None:
+                user_id = self._emails.get(email)
+            if user_id in self._entries:
+                self._drop(user_id)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._emails.clear()
+
+    def _store(self, row, now):
+        if self.max_size <= 0:
+            return
+        self._entries[row['id']] = _Entry(row, now, self.ttl)
+        self._emails[row['email']] = row['id']
+        while len(self._entries) > self.max_size:
+            user_id, evicted = self._entries.popitem(last=False)
+            self._drop_email(user_id, evicted.row['email'])
+            self.evictions += 1
+
+    def _drop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._drop_email(user_id, entry.row['email'])
+
+    def _drop_email(self, user_id, email):
+        if self._emails.get(email) == user_id:
+            del self._emails[email]
+
+    def stats(self):
+        """Метрики кэша для мониторинга"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'stale': self.stale,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,218 @@
+"""Групповая запись (group commit) через один поток-писатель.
+
+У SQLite один писатель: параллельные транзакции ждут друг друга и по
+отдельности платят за fsync. В режиме WRITE_QUEUE_ENABLED каждая запись -
+функция job(conn) - ставится в очередь. Писатель собирает все, что пришло за
+WRITE_QUEUE_WINDOW, и выполняет пакет одной транзакцией BEGIN IMMEDIATE,
+каждую запись - в своей точке сохранения: ошибка одной откатывает только
+ее. Вызывающий получает результат job (id строки и т.п.) или ее исключение
+только после COMMIT, поэтому подтвержденная запись так же надежна, как при
+отдельной транзакции.
+
+При выключенном режиме execute() выполняет job сразу и фиксирует
+собственной транзакцией - код записей одинаков в обоих режимах.
+
+job не должна вызывать commit/rollback. Вызывающий поток не должен держать
+открытую транзакцию записи: писатель будет ждать ее блокировку.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config import Config
+from pool import get_pool
+
+
+class WriteQueueBusy(Exception):
+    """Очередь записи переполнена: запрос нужно повторить позже"""
+
+
+class WriteQueue:
+    def __init__(self, db_path, enabled=None, window=None, max_batch=None, queue_size=None):
+        self.db_path = db_path
+        self.enabled = Config.WRITE_QUEUE_ENABLED if enabled is None else enabled
+        self.window = Config.WRITE_QUEUE_WINDOW if window is None else window
+        self.max_batch = max_batch or Config.WRITE_QUEUE_MAX_BATCH
+        self.queue_size = queue_size or Config.WRITE_QUEUE_SIZE
+        self._reset()
+
+    def _reset(self):
+        self._queue = queue.Queue(self.queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'writes': 0,
+            'batches': 0,
+            'errors': 0,
+            'rejected': 0,
+            'largest_batch': 0,
+        }
+
+    @property
+    def pool(self):
+        return get_pool(self.db_path)
+
+    # ========== ВЫЗЫВАЮЩАЯ СТОРОНА ==========
+    def execute(self, job, conn=None):
+        """Выполнение записи job(conn) и ее фиксация; результат job.
+
+        conn - соединение вызывающего для режима без очереди (иначе из пула).
+        """
+        if self.enabled:
+            return self.submit(job).result()
+        if conn is not None:
+            return self._run_direct(conn, job)
+        with self.pool.connection() as conn:
+            return self._run_direct(conn, job)
+
+    def submit(self, job):
+        """Постановка записи в очередь; Future с результатом после COMMIT"""
+        self._ensure_writer()
+        future = Future()
+        try:
+            self._queue.put_nowait((future, job))
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise WriteQueueBusy('Сервер перегружен записью, повторите попытку позже')
+        return future
+
+    @staticmethod
+    def _run_direct(conn, job):
+        # Блокировка записи с начала: проверки job (SELECT) и запись атомарны,
+        # как в транзакции потока-писателя
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = job(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return result
+
+    # ========== ПИСАТЕЛЬ ==========
+    def _ensure_writer(self):
+        # Поток создается при первой записи, а не при импорте
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_writer, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _run_writer(self):
+        conn = None
+        while True:
+            batch = self._collect()
+            if conn is None:
+                try:
+                    conn = self.pool.open_dedicated()
+                except Exception as e:
+                    self._fail(batch, e)
+                    continue
+            try:
+                self._commit_batch(conn, batch)
+            except Exception as e:
+                self._fail(batch, e)
+                # Соединение после сбоя COMMIT/ROLLBACK не переиспользуется
+                conn.close()
+                conn = None
+
+    def _collect(self):
+        """Первая запись (ожидание без ограничения) и все, что придет за окно"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit_batch(self, conn, batch):
+        outcomes = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for future, job in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT write_job')
+                try:
+                    result = job(conn)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_job')
+                    conn.execute('RELEASE write_job')
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute('RELEASE write_job')
+                    outcomes.append((future, result, None))
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+        # Результаты отдаются только после COMMIT
+        errors = 0
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                errors += 1
+                future.set_exception(error)
+        with self._lock:
+            self._stats['writes'] += len(outcomes)
+            self._stats['batches'] += 1
+            self._stats['errors'] += errors
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(outcomes))
+
+    def _fail(self, batch, error):
+        """Весь пакет не зафиксирован: ошибка каждому ожидающему"""
+        for future, _ in batch:
+            if not future.done():
+                if future.running() or future.set_running_or_notify_cancel():
+                    future.set_exception(error)
+        with self._lock:
+            self._stats['errors'] += len(batch)
+
+    # ========== ОБСЛУЖИВАНИЕ ==========
+    def reset_after_fork(self):
+        """Поток-писатель не переживает fork: дочерний процесс создаст свой"""
+        self._reset()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'enabled': self.enabled,
+            'pending': self._queue.qsize(),
+            'avg_batch': round(stats['writes'] / stats['batches'], 2) if stats['batches'] else 0,
+        })
+        return stats
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_queue(db_path):
+    """Общая очередь записи для файла БД (одна на процесс)"""
+    with _queues_lock:
+        writes = _queues.get(db_path)
+        if writes is None:
+            writes = _queues[db_path] = WriteQueue(db_path)
+        return writes
+
+
+def _reset_queues_after_fork():
+    for writes in _queues.values():
+        writes.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_queues_after_fork)
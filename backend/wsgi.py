@@ -0,0 +1,2 @@
+"""Точка входа для WSGI-серверов: gunicorn -c gunicorn.conf.py wsgi:application"""
+from app import app as application